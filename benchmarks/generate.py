@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Author: Tobias Karger und Marie Berger
+# Contact: coding@thepatchwork.de
+# License: The Unlicense, see LICENSE file.
+"""Generate synthetic KeePass databases for the benchmarks.
+
+Every database holds ``size`` entries in groups of ENTRIES_PER_GROUP. The
+``shallow`` shape puts all groups below the root group, the ``deep`` shape
+nests them DEEP_LEVELS levels deep. The ``aes`` databases use AES-KDF, the
+``argon2`` ones Argon2d. Content is generated from a fixed seed, so the same
+arguments always give the same entries.
+"""
+
+import argparse
+import os
+import random
+import shutil
+import string
+import sys
+
+from pykeepass import PyKeePass, create_database
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# the only AES-KDF database at hand, its content is removed
+AES_TEMPLATE = os.path.join(HERE, os.pardir, 'molecule', 'default', 'resources', 'CI_CD_Database.kdbx')
+AES_TEMPLATE_PASSWORD = 'ansible'
+
+PASSWORD = 'benchmark'
+SIZES = [1000, 10000, 100000]
+SHAPES = ['shallow', 'deep']
+KDFS = ['aes', 'argon2']
+ENTRIES_PER_GROUP = 100
+DEEP_LEVELS = 6
+DEEP_FANOUT = 4
+
+
+def database_name(size, shape, kdf):
+    return '{}-{}-{}.kdbx'.format(kdf, shape, size)
+
+
+def group_path(index, shape):
+    """Return the path of the ``index``-th group holding entries."""
+    name = 'group-{:05d}'.format(index)
+    if shape == 'shallow':
+        return (name,)
+    levels = []
+    for _ in range(DEEP_LEVELS):
+        levels.append('level-{}'.format(index % DEEP_FANOUT))
+        index //= DEEP_FANOUT
+    return tuple(reversed(levels)) + (name,)
+
+
+def empty_database(path, kdf):
+    if kdf == 'argon2':
+        return create_database(path, password=PASSWORD)
+    shutil.copyfile(AES_TEMPLATE, path)
+    kp = PyKeePass(path, password=AES_TEMPLATE_PASSWORD)
+    for group in kp.root_group.subgroups:
+        kp.delete_group(group)
+    for entry in kp.root_group.entries:
+        kp.delete_entry(entry)
+    kp.password = PASSWORD
+    return kp
+
+
+def set_kdf_cost(kp, kdf, aes_rounds=None, argon2_iterations=None, argon2_memory=None):
+    params = kp.kdbx.header.value.dynamic_header.kdf_parameters.data.dict
+    if kdf == 'aes' and aes_rounds:
+        params['R'].value = aes_rounds
+    if kdf == 'argon2' and argon2_iterations:
+        params['I'].value = argon2_iterations
+    if kdf == 'argon2' and argon2_memory:
+        params['M'].value = argon2_memory * 1024 * 1024
+
+
+def generate(path, size, shape, kdf, seed=0, **kdf_cost):
+    rng = random.Random(seed)
+    alphabet = string.ascii_letters + string.digits
+    kp = empty_database(path, kdf)
+    set_kdf_cost(kp, kdf, **kdf_cost)
+    groups = {(): kp.root_group}
+
+    def group(path):
+        if path not in groups:
+            groups[path] = kp.add_group(group(path[:-1]), path[-1])
+        return groups[path]
+
+    for index in range(size):
+        kp.add_entry(
+            group(group_path(index // ENTRIES_PER_GROUP, shape)),
+            'entry-{:06d}'.format(index),
+            'user-{:02d}'.format(index % 97),
+            ''.join(rng.choice(alphabet) for _ in range(20)),
+            url='https://host-{}.example.com'.format(index % 1000),
+            notes='Notes of entry {}'.format(index) if index % 10 == 0 else None,
+            tags=['bench', 'tag-{}'.format(index % 10)],
+            force_creation=True,
+        )
+    kp.save()
+    return path
+
+
+def ensure_databases(directory, sizes=SIZES, shapes=SHAPES, kdfs=KDFS, force=False, log=None, **kdf_cost):
+    """Generate the databases missing in ``directory`` and return their (path, size, shape, kdf) tuples."""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    databases = []
+    for kdf in kdfs:
+        for shape in shapes:
+            for size in sizes:
+                path = os.path.join(directory, database_name(size, shape, kdf))
+                if force or not os.path.exists(path):
+                    if log:
+                        log('Generating {}'.format(path))
+                    generate(path, size, shape, kdf, **kdf_cost)
+                databases.append((path, size, shape, kdf))
+    return databases
+
+
+def add_arguments(parser):
+    parser.add_argument('--data', default=os.path.join(HERE, 'data'), help='directory of the generated databases')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='numbers of entries')
+    parser.add_argument('--shapes', nargs='+', default=SHAPES, choices=SHAPES, help='shapes of the group tree')
+    parser.add_argument('--kdfs', nargs='+', default=KDFS, choices=KDFS, help='key derivation functions')
+    parser.add_argument('--aes-rounds', type=int, help='AES-KDF rounds, 600000 if not given')
+    parser.add_argument('--argon2-iterations', type=int, help='Argon2 iterations, 14 if not given')
+    parser.add_argument('--argon2-memory', type=int, help='Argon2 memory in MiB, 64 if not given')
+
+
+def kdf_cost(args):
+    return dict(aes_rounds=args.aes_rounds, argon2_iterations=args.argon2_iterations, argon2_memory=args.argon2_memory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument('--force', action='store_true', help='regenerate existing databases')
+    args = parser.parse_args()
+    ensure_databases(args.data, args.sizes, args.shapes, args.kdfs, force=args.force,
+                     log=lambda msg: print(msg, file=sys.stderr), **kdf_cost(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Author: Tobias Karger und Marie Berger
+# Contact: coding@thepatchwork.de
+# License: The Unlicense, see LICENSE file.
+"""Time the lookup, entry and group plugins against synthetic databases.
+
+The databases are generated by generate.py on first use. Every benchmark
+runs ``--repeat`` times and reports the minimum, median and maximum wall
+time in seconds as JSON. Benchmarks that write work on a fresh copy of the
+database each time, the copy is not timed. With ``--baseline`` the medians
+are compared to an earlier result and the run fails if any of them got
+slower by more than ``--tolerance``.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import generate
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+COLLECTION = os.path.dirname(HERE)
+
+
+def load_collection():
+    """Make this checkout importable as torie_coding.keepass and return the plugins to benchmark."""
+    root = tempfile.mkdtemp(prefix='keepass-bench-')
+    namespace = os.path.join(root, 'ansible_collections', 'torie_coding')
+    os.makedirs(namespace)
+    os.symlink(COLLECTION, os.path.join(namespace, 'keepass'))
+    sys.path.insert(0, root)
+
+    from ansible.plugins.loader import init_plugin_loader, lookup_loader
+    init_plugin_loader([root])
+    from ansible_collections.torie_coding.keepass.plugins.modules import entry, group
+    from ansible_collections.torie_coding.keepass.plugins.module_utils.transaction import atomic_save
+    return root, lookup_loader.get('torie_coding.keepass.lookup'), entry, group, atomic_save
+
+
+def run_main(module, args):
+    """Call ``main()`` of a module like Ansible does and return its result."""
+    from ansible.module_utils import basic
+    basic._ANSIBLE_ARGS = json.dumps(dict(ANSIBLE_MODULE_ARGS=args)).encode('utf-8')
+    if hasattr(basic, '_ANSIBLE_PROFILE'):
+        # ansible-core 2.19 and newer
+        basic._ANSIBLE_PROFILE = 'legacy'
+    stdout = io.StringIO()
+    with contextlib.redirect_stdout(stdout):
+        try:
+            module.main()
+        except SystemExit:
+            pass
+    result = json.loads(stdout.getvalue())
+    if result.get('failed'):
+        raise RuntimeError(result.get('msg'))
+    return result
+
+
+class Benchmarks(object):
+
+    def __init__(self, lookup, entry, group, atomic_save, workdir):
+        self.lookup = lookup
+        self.entry = entry
+        self.group = group
+        self.atomic_save = atomic_save
+        self.workdir = workdir
+
+    def cases(self, database, size, shape):
+        """Return (name, setup, timed) triples, ``setup`` prepares what ``timed`` gets."""
+        from pykeepass import PyKeePass
+
+        group_path = generate.group_path(0, shape)
+        credentials = dict(database=database, database_password=generate.PASSWORD)
+        middle = 'entry-{:06d}'.format(size // 2)
+        middle_user = 'user-{:02d}'.format(size // 2 % 97)
+
+        def lookup(**kwargs):
+            return lambda target: self.lookup.run(['entry'], variables={}, **dict(credentials, not_found='error', **kwargs))
+
+        def warm(**kwargs):
+            # fill the database cache, so only the search is timed
+            def setup():
+                self.lookup.run(['entry'], variables={}, **dict(credentials, cache=True, **kwargs))
+            return setup
+
+        def copy():
+            target = os.path.join(self.workdir, os.path.basename(database))
+            shutil.copyfile(database, target)
+            return target
+
+        def module_args(target, **kwargs):
+            return dict(kwargs, database=target, database_password=generate.PASSWORD)
+
+        def opened():
+            target = copy()
+            return PyKeePass(target, password=generate.PASSWORD), target
+
+        return [
+            ('open', lambda: None, lambda target: PyKeePass(database, password=generate.PASSWORD)),
+            ('lookup_cold', lambda: None, lookup(title=middle, cache=False)),
+            ('lookup_filtered', warm(title=middle), lookup(title=middle, username=middle_user)),
+            ('lookup_filtered_group', warm(title=middle), lookup(username='user-00', group_path='/'.join(group_path))),
+            ('lookup_regex', warm(title=middle), lookup(title='^entry-0+9[0-9]$', regex=True)),
+            ('entry_create', copy, lambda target: run_main(self.entry, module_args(
+                target, action='create', title='bench-new', username='bench', password='secret', group_path='/'.join(group_path)))),
+            ('entry_modify', copy, lambda target: run_main(self.entry, module_args(
+                target, action='modify', title='entry-000000', username='user-00', url='https://modified.example.com',
+                group_path='/'.join(group_path)))),
+            ('group_create', copy, lambda target: run_main(self.group, module_args(
+                target, action='create', name='bench-new', path='/'.join(group_path), create_path=False))),
+            ('group_modify', copy, lambda target: run_main(self.group, module_args(
+                target, action='modify', name=group_path[-1], path='/'.join(group_path[:-1]) or None, new_name='bench-renamed'))),
+            ('save', opened, lambda opened: self.atomic_save(opened[0], opened[1])),
+        ]
+
+    def run(self, databases, repeat, only=None, log=None):
+        results = []
+        for database, size, shape, kdf in databases:
+            for name, setup, timed in self.cases(database, size, shape):
+                if only and name not in only:
+                    continue
+                if log:
+                    log('{} {}'.format(os.path.basename(database), name))
+                runs = []
+                for _ in range(repeat):
+                    target = setup()
+                    start = time.perf_counter()
+                    timed(target)
+                    runs.append(time.perf_counter() - start)
+                results.append(dict(
+                    database=os.path.basename(database), entries=size, shape=shape, kdf=kdf, benchmark=name,
+                    runs=runs, min=min(runs), median=statistics.median(runs), max=max(runs),
+                ))
+        return results
+
+
+def environment():
+    import ansible
+    import pykeepass
+    with open(os.path.join(COLLECTION, 'galaxy.yml')) as stream:
+        version = next((line.split(':', 1)[1].strip() for line in stream if line.startswith('version:')), None)
+    return dict(
+        collection=version,
+        python=platform.python_version(),
+        ansible_core=ansible.__version__ if hasattr(ansible, '__version__') else None,
+        pykeepass=getattr(pykeepass, '__version__', None),
+        platform=platform.platform(),
+        machine=platform.machine(),
+    )
+
+
+def compare(results, baseline, tolerance):
+    """Return the benchmarks whose median is more than ``tolerance`` slower than in ``baseline``."""
+    before = dict(((r['database'], r['benchmark']), r['median']) for r in baseline['results'])
+    regressions = []
+    for result in results:
+        old = before.get((result['database'], result['benchmark']))
+        if old and result['median'] > old * (1 + tolerance):
+            regressions.append(dict(database=result['database'], benchmark=result['benchmark'],
+                                    baseline=old, median=result['median'], ratio=result['median'] / old))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    generate.add_arguments(parser)
+    parser.add_argument('--benchmarks', nargs='+', help='only run these benchmarks')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of every benchmark')
+    parser.add_argument('--output', help='write the results to this file instead of stdout')
+    parser.add_argument('--baseline', help='results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown against the baseline, 0.25 is 25%%')
+    args = parser.parse_args()
+
+    def log(msg):
+        print(msg, file=sys.stderr)
+
+    databases = generate.ensure_databases(args.data, args.sizes, args.shapes, args.kdfs, log=log, **generate.kdf_cost(args))
+    root, lookup, entry, group, atomic_save = load_collection()
+    workdir = tempfile.mkdtemp(prefix='keepass-bench-work-')
+    try:
+        results = Benchmarks(lookup, entry, group, atomic_save, workdir).run(databases, args.repeat, args.benchmarks, log)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        shutil.rmtree(root, ignore_errors=True)
+
+    report = dict(environment=environment(), repeat=args.repeat, results=results)
+    if args.baseline:
+        with open(args.baseline) as stream:
+            report['regressions'] = compare(results, json.load(stream), args.tolerance)
+    if args.output:
+        with open(args.output, 'w') as stream:
+            json.dump(report, stream, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    for regression in report.get('regressions', []):
+        log('Regression: {database} {benchmark} took {median:.3f}s, {baseline:.3f}s before'.format(**regression))
+    if report.get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
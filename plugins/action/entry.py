@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+#
+# Author: Tobias Karger und Marie Berger
+# Contact: coding@thepatchwork.de
+# License: The Unlicense, see LICENSE file.
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+from ansible_collections.torie_coding.keepass.plugins.modules import entry
+from ansible_collections.torie_coding.keepass.plugins.plugin_utils.controller import KeePassAction
+
+
+class ActionModule(KeePassAction):
+
+    module_name = 'torie_coding.keepass.entry'
+    module = entry
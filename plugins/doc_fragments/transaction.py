@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#
+# Author: Tobias Karger und Marie Berger
+# Contact: coding@thepatchwork.de
+# License: The Unlicense, see LICENSE file.
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+
+class ModuleDocFragment(object):
+
+    # Options of the modules that open the database through a KeePassTransaction,
+    # see transaction_argument_spec() in plugins/module_utils/transaction.py
+    DOCUMENTATION = r'''
+options:
+    database:
+        description:
+            - Path of the KeePass database.
+        required: true
+        type: str
+    keyfile:
+        description:
+            - Path of the KeePass keyfile. Either this or 'database_password' (or both) are required.
+        required: false
+        type: str
+    database_password:
+        description:
+            - Database password. Either this or 'keyfile' (or both) are required.
+        required: false
+        type: str
+    agent_socket:
+        description:
+            - Socket of a local agent started with the M(torie_coding.keepass.agent) module. After the database was saved, the agent is told to drop its unlocked copy.
+            - Defaults to the environment variable KEEPASS_AGENT_SOCKET, or the default socket of the agent. Nothing happens if no agent listens on it.
+        required: false
+        type: str
+    save_fsync:
+        description:
+            - How the database is flushed to disk when it is saved. It is always written to a temporary file next to it and renamed into place, so a killed run never leaves a truncated database.
+            - Saving therefore needs write access to the directory of the database, not only to the file. The saved file keeps the mode and, where permitted, the owner of the old one, otherwise the task warns.
+            - C(always) flushes the new file before the rename, C(dir) also flushes the directory so the rename itself is durable, C(never) leaves both to the operating system.
+        required: false
+        default: always
+        choices: ['always', 'dir', 'never']
+        type: str
+    backup:
+        description:
+            - Keep the previous version of the database as C(<database>.bak) when it is saved. It is kept through a hard link and costs no extra I/O, or copied where the file system does not support hard links.
+        required: false
+        default: false
+        type: bool
+    concurrency:
+        description:
+            - How parallel tasks writing the same database, for example with many forks or when delegating to localhost, are kept from overwriting each other's changes.
+            - C(lock) holds a lock on C(<database>.lock) from opening the database until it is saved, so the tasks run one after the other.
+            - C(optimistic) only locks while saving. If another task saved the database in the meantime, it is read again and the changes of this task are applied to it again before it is saved.
+            - C(none) does not lock and the last task to save wins. It is the default, as the other modes create C(<database>.lock) and so need write access to the directory of the database.
+        required: false
+        default: none
+        choices: ['lock', 'optimistic', 'none']
+        type: str
+    lock_timeout:
+        description:
+            - Seconds to wait for the lock of the database before the task fails.
+        required: false
+        default: 60
+        type: int
+    key_cache:
+        description:
+            - Keep the key derived from the credentials in locked memory for the life of the process, so reopening the database skips the slow key derivation.
+            - Only helps where the process outlives one unlock, which is when the task runs on the controller through the action plugin, for example in a loop with C(concurrency=optimistic).
+            - The database is then saved with the same key, so the salt of the key derivation is not rotated on save.
+        required: false
+        default: false
+        type: bool
+    key_cache_ttl:
+        description:
+            - Seconds after which a key kept by O(key_cache) is wiped. 0 keeps it for the life of the process.
+        required: false
+        default: 300
+        type: int
+    timings:
+        description:
+            - Return the time spent in every phase of the task in RV(timings), to find out where a slow task spends its time.
+        required: false
+        default: false
+        type: bool
+    profile:
+        description:
+            - Run the module under cProfile and write the statistics to this file on the host the module runs on.
+            - The file can be read with C(python -m pstats).
+        required: false
+        type: path
+'''
@@ -6,17 +6,34 @@
 # License: The Unlicense, see LICENSE file.
 from __future__ import absolute_import, division, print_function
 
-import re
+import os
 import traceback
+from collections.abc import Mapping
 
 from ansible.errors import AnsibleError
+from ansible.module_utils.parsing.convert_bool import boolean
+from ansible.module_utils.six import string_types
 from ansible.plugins.lookup import LookupBase
-from pykeepass.entry import Entry
+from ansible_collections.torie_coding.keepass.plugins.module_utils.agent import AgentClient, AgentError, AgentUnavailable
+from ansible_collections.torie_coding.keepass.plugins.module_utils.cache import DATABASE_CACHE
+from ansible_collections.torie_coding.keepass.plugins.module_utils.database import (
+    DEFAULT_ENTRY_FIELDS,
+    PROTECTED_FIELDS,
+    GroupNotFoundError,
+    IndexedDatabase,
+    check_fields,
+    check_group_fields,
+    entry_results,
+)
+from ansible_collections.torie_coding.keepass.plugins.module_utils.index_cache import IndexCache
+from ansible_collections.torie_coding.keepass.plugins.module_utils.keys import KEY_CACHE, open_database
+from ansible_collections.torie_coding.keepass.plugins.module_utils.snapshot import DatabaseSnapshot
+from ansible_collections.torie_coding.keepass.plugins.module_utils.timing import NO_TIMINGS, Timings, profiled
+from ansible_collections.torie_coding.keepass.plugins.module_utils.uuid_index import parse_uuid
 
 PYKEEPASS_IMP_ERR = None
 try:
     import pykeepass.exceptions
-    from pykeepass import PyKeePass
 except ImportError:
     PYKEEPASS_IMP_ERR = traceback.format_exc()
     PYKEEPASS_FOUND = False
@@ -31,12 +48,14 @@ short_description: Search for Entries in a KeePass Database
 version_added: "1.2.0"
 description:
   - Uses pykeepass to search for Entries in a KeePass Database
+  - With the term C(group), returns a group with its subgroups and entries instead.
 requirements:
   - pykeepass
 
 options:
     _terms:
-      description: For what you are looking for
+      description:
+        - For what you are looking for, C(entry) or C(group).
       required: True
       type: str
     database:
@@ -55,13 +74,26 @@ options:
       description: Filter entries by title
       type: str
       required: False
+    uuid:
+      description:
+        - Return the entry with this UUID, resolved through an index instead of a search. The other filters still apply to it.
+        - With the term C(group), the group to return instead of O(group_path).
+        - Accepts the 32 hex digits with or without dashes, as every result reports them, or the base64 form of the KeePass XML.
+      type: str
+      required: False
+      version_added: "1.4.0"
     group_path:
-      description: Filter entries by group path
+      description:
+        - Filter entries by group path
+        - With the term C(group), the group to return.
       type: str
       required: False
       default: '/'
     regex:
-      description: Whether to use regular expressions for filtering
+      description:
+        - Whether to use regular expressions for filtering
+        - With it, title, username, notes and url are all searched with Python regular expressions. Tags always match exactly.
+        - Without it, title, username, url and tags are matched exactly through hash indexes of the opened database, which are built on first use and dropped with the cached database.
       type: bool, str
       required: False
       default: False
@@ -91,6 +123,172 @@ options:
       type: str
       required: False
       default: Null
+    depth:
+      description:
+        - With the term C(group), how many levels of subgroups to include. 0 returns only the group itself, -1 its whole subtree.
+      type: int
+      required: False
+      default: 1
+      version_added: "1.4.0"
+    include_entries:
+      description:
+        - With the term C(group), whether to list the entries of the group and of every included subgroup.
+      type: bool
+      required: False
+      default: True
+      version_added: "1.4.0"
+    group_fields:
+      description:
+        - With the term C(group), only return these fields of every group. Possible fields are name, path, icon_id, notes and uuid, all are returned by default.
+      type: list
+      elements: str
+      required: False
+      version_added: "1.4.0"
+    fields:
+      description:
+        - Only return these fields of every entry, for example C([title, username]). All fields are returned by default.
+        - Possible fields are title, username, group_path, icon_id, password, url, notes, tags and uuid.
+      type: list
+      elements: str
+      required: False
+      version_added: "1.4.0"
+    queries:
+      description:
+        - List of searches to run against the database, which is opened only once for all of them.
+        - Every item is a dictionary with any of the keys title, username, group_path, recursive, regex, notes, url, tags, uuid, fields, offset, limit, count_only and not_found. Keys not given fall back to the option of the same name.
+        - With it, the lookup returns one list of results per query, in the order of the queries.
+      type: list
+      elements: dict
+      required: False
+      version_added: "1.4.0"
+    not_found:
+      description:
+        - What to do if a search matches no entry. C(error) fails the lookup, C(warn) prints a warning and returns no results, C(empty) silently returns no results.
+        - Can be set per item of 'queries'.
+      type: str
+      required: False
+      default: empty
+      choices: ['error', 'warn', 'empty']
+      version_added: "1.4.0"
+    reveal_passwords:
+      description:
+        - Whether to return the passwords of the entries.
+        - If false, the password field is left out of every result, so bulk lookups that only need other fields do not copy thousands of plaintext secrets into the results.
+        - Asking for C(password) in 'fields' at the same time is an error.
+      type: bool
+      required: False
+      default: True
+      version_added: "1.4.0"
+    offset:
+      description:
+        - Skip this many matching entries.
+      type: int
+      required: False
+      default: 0
+      version_added: "1.4.0"
+    limit:
+      description:
+        - Return at most this many matching entries. 0 returns all of them.
+      type: int
+      required: False
+      default: 0
+      version_added: "1.4.0"
+    count_only:
+      description:
+        - Only return the number of matching entries instead of the entries.
+      type: bool
+      required: False
+      default: False
+      version_added: "1.4.0"
+    cache:
+      description:
+        - Keep the opened database in memory and reuse it for further lookups of the same task, for example in one templated expression or the items of a loop.
+        - Ansible runs every task in a worker process of its own, so the cache does not outlive the task. Use the M(torie_coding.keepass.agent) to keep a database unlocked across tasks.
+        - The database is reopened when its path, inode, size or modification time change, or when other credentials are given.
+      type: bool
+      required: False
+      default: True
+      version_added: "1.4.0"
+    snapshot:
+      description:
+        - Copy the opened database into a compact read-only snapshot and free the XML tree of pykeepass right away.
+        - Cached databases of large vaults then take a fraction of the memory. The snapshot holds everything the lookup returns, but no history entries.
+        - A database already in the cache is reused as it is.
+      type: bool
+      required: False
+      default: False
+      version_added: "1.4.0"
+    index_cache:
+      description:
+        - Keep an encrypted copy of the snapshot on disk and read it instead of the database as long as the database is unchanged.
+        - This skips decrypting and parsing the database, only the key derivation runs on every open. Implies O(snapshot).
+        - The copy is encrypted with AES-GCM under a key derived from the database's own key derivation, so it takes the same credentials and the same effort to brute-force as the database.
+        - It is written again after every change of the database.
+      type: bool
+      required: False
+      default: False
+      version_added: "1.4.0"
+    index_cache_dir:
+      description:
+        - Directory of the encrypted snapshots written by O(index_cache).
+        - Defaults to C($XDG_CACHE_HOME/torie_coding.keepass) or C(~/.cache/torie_coding.keepass).
+      type: path
+      required: False
+      version_added: "1.4.0"
+    timings:
+      description:
+        - Report the time spent in every phase of the lookup with C(-vv), to find out where a slow lookup spends its time.
+        - The phases are C(agent), C(read), C(kdf) (key derivation), C(parse) (decrypting and parsing the XML), C(snapshot), C(index_load), C(index_store), C(search) (including building the indexes on first use), C(results) and C(export). Phases that did not run are left out.
+      type: bool
+      required: False
+      default: False
+      version_added: "1.4.0"
+    profile:
+      description:
+        - Run the lookup under cProfile and write the statistics to this file on the controller. The file can be read with C(python -m pstats).
+      type: path
+      required: False
+      version_added: "1.4.0"
+    key_cache:
+      description:
+        - Keep the keys derived from the credentials in locked memory for the rest of the task, so reopening the database, for example after it changed, skips the slow key derivation.
+        - Like O(cache) it does not outlive the worker process of the task.
+        - Keys are stored by a digest of the key derivation parameters, salt and credentials, and overwritten when they expire and when the process exits.
+      type: bool
+      required: False
+      default: False
+      version_added: "1.4.0"
+    key_cache_ttl:
+      description:
+        - Seconds after which a key kept by O(key_cache) is wiped. 0 keeps it until the task ends.
+      type: int
+      required: False
+      default: 300
+      version_added: "1.4.0"
+    cache_ttl:
+      description:
+        - Seconds after which a cached database is dropped and reopened. 0 keeps it until the task ends.
+      type: int
+      required: False
+      default: 0
+      version_added: "1.4.0"
+    cache_size:
+      description:
+        - Maximum number of opened databases kept in the cache. The least recently used one is dropped first.
+      type: int
+      required: False
+      default: 8
+      version_added: "1.4.0"
+    agent_socket:
+      description:
+        - Socket of a local agent started with the M(torie_coding.keepass.agent) module.
+        - If an agent listens on it, the search is answered by the agent, which keeps the database unlocked across playbook runs.
+        - Defaults to C($XDG_RUNTIME_DIR/keepass-agent-<uid>/agent.sock), or the same below the temp directory.
+      type: str
+      required: False
+      env:
+        - name: KEEPASS_AGENT_SOCKET
+      version_added: "1.4.0"
 '''
 
 
@@ -107,14 +305,40 @@ EXAMPLES = """
   debug:
     msg: "{{ lookup('torie_coding.keepass.lookup', 'entry', database='/path/to/database.kdbx', database_password='secret', group_path='My Group', title='My Entry', recursive=False) }}"
 
+- name: Get the titles and usernames of the first 50 entries of a group
+  debug:
+    msg: "{{ lookup('torie_coding.keepass.lookup', 'entry', database='/path/to/database.kdbx', database_password='secret', group_path='My Group', fields=['title', 'username'], limit=50) }}"
+
+- name: Resolve several credentials with a single unlock of the database
+  set_fact:
+    credentials: "{{ query('torie_coding.keepass.lookup', 'entry', database='/path/to/database.kdbx', database_password='secret', not_found='error', queries=[
+                       {'title': 'db-admin', 'group_path': 'Databases'},
+                       {'title': 'smtp', 'fields': ['username', 'password']},
+                       {'title': 'optional', 'not_found': 'warn'}]) }}"
+
+- name: List the entries of a group without their passwords
+  debug:
+    msg: "{{ lookup('torie_coding.keepass.lookup', 'entry', database='/path/to/database.kdbx', database_password='secret', group_path='My Group', reveal_passwords=False) }}"
+
+- name: Count the entries of a group and its subgroups
+  debug:
+    msg: "{{ lookup('torie_coding.keepass.lookup', 'entry', database='/path/to/database.kdbx', database_password='secret', group_path='My Group', title='.*', regex=True, count_only=True) }}"
+
 - name: Find entries with a specific tag
   debug:
     msg: "{{ lookup('lookup', 'entry', database='/path/to/database.kdbx', database_password='secret', tags=['important']) }}"
+
+- name: Export a group with its whole subtree, without passwords
+  debug:
+    msg: "{{ lookup('torie_coding.keepass.lookup', 'group', database='/path/to/database.kdbx', database_password='secret', group_path='Servers', depth=-1, fields=['title', 'username', 'url'], group_fields=['name', 'path']) }}"
 """
 
 RETURN = """
 entries:
-    description: List of KeePass entries matching the search criteria
+    description:
+      - List of KeePass entries matching the search criteria, with only the keys given in 'fields'.
+      - With 'count_only', a list with the number of matching entries.
+      - With 'queries', a list with one such list per query.
     type: list
     elements: dict
     returned: always
@@ -130,137 +354,270 @@ entries:
             "tags": ["tag1", "tag2"]
         }
     ]
+group:
+    description:
+      - With the term C(group), a list with the group. Every group has the keys given in 'group_fields', its entries in C(entries) and its subgroups in C(groups), as far as they are included.
+    type: list
+    elements: dict
+    returned: with the term C(group)
+    sample: [
+        {
+            "name": "Servers",
+            "path": "Servers",
+            "icon_id": "48",
+            "notes": null,
+            "entries": [],
+            "groups": [
+                {
+                    "name": "web",
+                    "path": "Servers/web",
+                    "icon_id": "48",
+                    "notes": null,
+                    "entries": [{"title": "web01", "username": "root", "group_path": "Servers/web"}]
+                }
+            ]
+        }
+    ]
 """
 
+QUERY_OPTIONS = ('group_path', 'recursive', 'title', 'username', 'notes', 'url', 'tags', 'regex', 'uuid')
+PAGE_OPTIONS = ('fields', 'offset', 'limit', 'count_only')
+NOT_FOUND_CHOICES = ('error', 'warn', 'empty')
+
+
 class LookupModule(LookupBase):
 
     def run(self, terms, variables=None, **kwargs):
-        ret = []
         self._display.vv("Starting lookup plugin with terms: {}".format(terms))
+        self.set_options(var_options=variables, direct=kwargs)
+        self.timings = Timings() if self.get_option('timings') else NO_TIMINGS
+
+        with profiled(self.get_option('profile')):
+            ret = self.run_term(terms)
+
+        if self.timings.enabled:
+            self._display.vv("Timings: {}".format(self.timings.as_dict()))
+        self._display.v("Final search parameters used: {}".format(kwargs))
+        return ret
 
+    def run_term(self, terms):
+        """Answer the 'entry' or 'group' term with the options already set."""
+        ret = []
         if terms[0] == "entry":
-            self.set_options(var_options=variables, direct=kwargs)
             database = self.get_option('database')
             self._display.vv("Database path: {}".format(database))
             database_password = self.get_option('database_password')
             keyfile = self.get_option('keyfile')
-            title = self.get_option('title')
-            group_path = self.get_option('group_path')
-            regex = self.get_option('regex')
-            recursive = self.get_option('recursive')
-            if recursive is None:
-                recursive = True  # Default to True for entry searches
-
-            notes = self.get_option('notes')
-            url = self.get_option('url')
-            tags = self.get_option('tags')
-            username = self.get_option('username')
 
             if not database_password and not keyfile:
                 raise AnsibleError("Either 'database_password' or 'keyfile' (or both) are required.")
 
-            self._display.vv("Attempting to open the database...")
-            try:
-                kp = PyKeePass(database, password=database_password, keyfile=keyfile)
-                self._display.vv("Database opened successfully")
-            except IOError as exc:
-                self._display.vvv("Error opening the database or keyfile: {}".format(exc))
-                raise AnsibleError('Could not open the database or keyfile.') from exc
-            except pykeepass.exceptions.CredentialsError as exc:
-                self._display.vvv("Invalid credentials: {}".format(exc))
-                raise AnsibleError('Could not open the database, as the credentials are wrong.') from exc
-            except (pykeepass.exceptions.HeaderChecksumError, pykeepass.exceptions.PayloadChecksumError) as exc:
-                raise AnsibleError("Could not open the database, as the checksum of the database is wrong. This could be caused by a corrupt database.") from exc
-
-            entries = []
-            if not any([title, username, notes, url, tags]):
-                if group_path and group_path != "/":
-                    # Split the group_path into a list of group names
-                    group_path_list = group_path.split('/')
-                    self._display.vv("Searching for group path: {}".format(group_path_list))
-                    group = kp.find_groups(path=group_path_list, first=True)
-                    if not group:
-                        raise AnsibleError(f"Group '{group_path}' not found in the database.")
-                    self._display.vv("Group found: {}".format(group))
-                    entries = group.entries  # Return all entries in this group
-                else:
-                    # Search in root group
-                    # Alle Einträge in der Wurzelgruppe zurückgeben
-                    self._display.vv("Returning all entries in the root group")
-                    entries = kp.entries
-            else:
-                # Filtered search
-                search_params = {
-                    'recursive': recursive,
-                    'regex': regex,
-                }
-                if title:
-                    search_params['title'] = title
-                if username:
-                    search_params['username'] = username
-                if notes:
-                    search_params['notes'] = notes
-                if url:
-                    search_params['url'] = url
-                if tags and tags != ['']:
-                    search_params['tags'] = tags
-                if group_path and group_path != "/":
-                    # Split the group_path into a list of group names
-                    group_path_list = group_path.split('/')
-                    self._display.vv("Searching for group path: {}".format(group_path_list))
-                    group = kp.find_groups(path=group_path_list, first=True)
-                    if not group:
-                        raise AnsibleError(f"Group '{group_path}' not found in the database.")
-                    search_params['group'] = group
-                
-
-                if not recursive and group_path in [None, "/"]:
-                    # Explicit search in the root group if not recursive
-                    self._display.vv("Performing non-recursive search in the root group")
-                    root_group = kp.root_group
-                    entries = [e for e in root_group.entries if self.match_entry(e, title, username, notes, url, tags, regex)]
-                else:
-                    self._display.vv("Search parameters: {}".format(search_params))
-                    entries = kp.find_entries(**search_params)
-
-            self._display.vv("Number of entries found: {}".format(len(entries)))
-
-            # Filter only entry objects and process them
-            for entry in entries:
-                if isinstance(entry, Entry):
-                    self._display.vvv(f"Entry found: Title={entry.title}, Group={entry.group.path}, Username={entry.username}")
-                    result = self.set_result(entry)
+            queries = self.get_option('queries')
+            searches = [self.build_search(item) for item in queries or [{}]]
+            self._display.vv("Search parameters: {}".format([search['query'] for search in searches]))
+
+            results = self.search_agent(database, database_password, keyfile, searches)
+            if results is None:
+                db = self.load_database(database, database_password, keyfile)
+                results = []
+                for search in searches:
+                    try:
+                        with self.timings.phase('search'):
+                            entries = db.search(**search['query'])
+                    except GroupNotFoundError as exc:
+                        raise AnsibleError(str(exc)) from exc
+                    with self.timings.phase('results'):
+                        results.append(entry_results(entries, **search['page']))
+
+            for search, search_results in zip(searches, results):
+                self._display.vv("Number of results: {}".format(len(search_results)))
+                if not search_results or search['page']['count_only'] and not search_results[0]:
+                    self.not_found(search)
+                for result in search_results:
                     self._display.vvv("Entry result: {}".format(result))
-                    ret.append(result)
-                else:
-                    self._display.vvv(f"Skipping non-entry object: {entry}")
 
-        self._display.v("Final search parameters used: {}".format(kwargs))
+            if queries is None:
+                ret.extend(results[0])
+            else:
+                # one list of results per query, in the order of the queries
+                ret.extend(results)
+
+        elif terms[0] == "group":
+            database = self.get_option('database')
+            self._display.vv("Database path: {}".format(database))
+            database_password = self.get_option('database_password')
+            keyfile = self.get_option('keyfile')
+
+            if not database_password and not keyfile:
+                raise AnsibleError("Either 'database_password' or 'keyfile' (or both) are required.")
+
+            ret.append(self.export_group(database, database_password, keyfile))
+
+        else:
+            raise AnsibleError("Unsupported term '{}', use 'entry' or 'group'.".format(terms[0]))
         return ret
 
-    def match_entry(self, entry, title, username, notes, url, tags, regex):
-        """Helper function to match entries against the search criteria."""
-        if title and not (regex and re.search(title, entry.title) or entry.title == title):
-            return False
-        if username and entry.username != username:
-            return False
-        if notes and entry.notes != notes:
-            return False
-        if url and entry.url != url:
-            return False
-        if tags and entry.tags is not None:
-            if not set(tags).issubset(set(entry.tags)):
-                return False
-        return True
-
-    def set_result(self, entry):
-        result = {}
-        result['title'] = entry.title
-        result['username'] = entry.username
-        result['group_path'] = "/".join(entry.group.path)
-        result['icon_id'] = entry.icon
-        result['password'] = entry.password
-        result['url'] = entry.url
-        result['notes'] = entry.notes
-        result['tags'] = entry.tags
-        return result
\ No newline at end of file
+    def build_search(self, item):
+        """Merge one item of 'queries' with the top-level options into a search and a page."""
+        if not isinstance(item, Mapping):
+            raise AnsibleError("Every item of 'queries' has to be a dictionary, got: {}".format(item))
+        unknown = [key for key in item if key not in QUERY_OPTIONS + PAGE_OPTIONS + ('not_found',)]
+        if unknown:
+            raise AnsibleError("Unsupported keys in a query: {}".format(', '.join(unknown)))
+
+        def option(name):
+            return item[name] if item.get(name) is not None else self.get_option(name)
+
+        query = dict((name, option(name)) for name in QUERY_OPTIONS)
+        if query['recursive'] is None:
+            query['recursive'] = True  # Default to True for entry searches
+        query['recursive'] = boolean(query['recursive'], strict=False)
+        query['regex'] = boolean(query['regex'], strict=False)
+        if isinstance(query['tags'], string_types):
+            query['tags'] = [query['tags']]
+        query['uuid'] = self.check_uuid(query['uuid'])
+
+        page = dict((name, option(name)) for name in PAGE_OPTIONS)
+        page['offset'] = int(page['offset'])
+        page['limit'] = int(page['limit'])
+        page['count_only'] = boolean(page['count_only'], strict=False)
+        page['fields'] = self.entry_fields(page['fields'])
+        if page['offset'] < 0 or page['limit'] < 0:
+            raise AnsibleError("'offset' and 'limit' must not be negative.")
+
+        not_found = option('not_found')
+        if not_found not in NOT_FOUND_CHOICES:
+            raise AnsibleError("'not_found' has to be one of {}, got: {}".format(', '.join(NOT_FOUND_CHOICES), not_found))
+        return dict(query=query, page=page, not_found=not_found)
+
+    def check_uuid(self, value):
+        """Return the UUID in ``value`` as 32 hex digits, or None."""
+        if not value:
+            return None
+        try:
+            return parse_uuid(value).hex
+        except ValueError as exc:
+            raise AnsibleError(str(exc)) from exc
+
+    def entry_fields(self, fields):
+        """Check the requested entry fields and leave out the protected ones unless they may be revealed."""
+        try:
+            check_fields(fields)
+        except ValueError as exc:
+            raise AnsibleError(str(exc)) from exc
+        if self.get_option('reveal_passwords'):
+            return fields
+        if any(field in PROTECTED_FIELDS for field in fields or ()):
+            raise AnsibleError("'fields' asks for {} while 'reveal_passwords' is false.".format(', '.join(PROTECTED_FIELDS)))
+        return [field for field in fields or DEFAULT_ENTRY_FIELDS if field not in PROTECTED_FIELDS]
+
+    def export_group(self, database, database_password, keyfile):
+        """Return the group at 'group_path' with its subtree, answered by the agent if one runs."""
+        try:
+            check_group_fields(self.get_option('group_fields'))
+        except ValueError as exc:
+            raise AnsibleError(str(exc)) from exc
+        export = dict(
+            group_path=self.get_option('group_path'),
+            depth=self.get_option('depth'),
+            fields=self.entry_fields(self.get_option('fields')),
+            group_fields=self.get_option('group_fields'),
+            entries=self.get_option('include_entries'),
+            uuid=self.check_uuid(self.get_option('uuid')),
+        )
+        self._display.vv("Export parameters: {}".format(export))
+
+        result = self.agent_request('group', database, database_password, keyfile, export=export)
+        if result is None:
+            db = self.load_database(database, database_password, keyfile)
+            try:
+                with self.timings.phase('export'):
+                    result = db.export_group(**export)
+            except GroupNotFoundError as exc:
+                raise AnsibleError(str(exc)) from exc
+        return result
+
+    def not_found(self, search):
+        """Apply the not_found policy of a search that matched no entry."""
+        msg = "No entry found for the query {}".format(dict((k, v) for k, v in search['query'].items() if v is not None))
+        if search['not_found'] == 'error':
+            raise AnsibleError(msg)
+        if search['not_found'] == 'warn':
+            self._display.warning(msg)
+
+    def search_agent(self, database, database_password, keyfile, searches):
+        """Run the searches in a running agent. Returns None if no agent is available."""
+        return self.agent_request('find', database, database_password, keyfile,
+                                  searches=[dict(query=search['query'], page=search['page']) for search in searches])
+
+    def agent_request(self, op, database, database_password, keyfile, **params):
+        """Send a request for the database to a running agent. Returns None if no agent is available."""
+        client = AgentClient(self.get_option('agent_socket'))
+        if not client.present():
+            return None
+        try:
+            with self.timings.phase('agent'):
+                results = client.request(
+                    op,
+                    database=os.path.abspath(database),
+                    password=database_password,
+                    keyfile=os.path.abspath(keyfile) if keyfile else None,
+                    **params
+                )
+        except AgentUnavailable as exc:
+            self._display.vv("Not using the agent: {}".format(exc))
+            return None
+        except AgentError as exc:
+            raise AnsibleError(str(exc)) from exc
+        self._display.vv("Request answered by the agent at {}".format(client.socket_path))
+        return results
+
+    def load_database(self, database, database_password, keyfile):
+        """Open the database with open_database, turning its errors into AnsibleErrors."""
+        self._display.vv("Attempting to open the database...")
+        try:
+            return self.open_database(database, database_password, keyfile)
+        except IOError as exc:
+            self._display.vvv("Error opening the database or keyfile: {}".format(exc))
+            raise AnsibleError('Could not open the database or keyfile.') from exc
+        except pykeepass.exceptions.CredentialsError as exc:
+            self._display.vvv("Invalid credentials: {}".format(exc))
+            raise AnsibleError('Could not open the database, as the credentials are wrong.') from exc
+        except (pykeepass.exceptions.HeaderChecksumError, pykeepass.exceptions.PayloadChecksumError) as exc:
+            raise AnsibleError("Could not open the database, as the checksum of the database is wrong. This could be caused by a corrupt database.") from exc
+
+    def open_database(self, database, database_password, keyfile):
+        """Open the database, reusing a copy an earlier lookup of the same task opened.
+
+        The cache lives in the worker process Ansible forks for the task, so
+        later tasks open the database again.
+        """
+        snapshot = self.get_option('snapshot')
+        index_cache = IndexCache(self.get_option('index_cache_dir')) if self.get_option('index_cache') else None
+        key_cache = None
+        if self.get_option('key_cache'):
+            key_cache = KEY_CACHE.with_ttl(self.get_option('key_cache_ttl'))
+
+        def opener():
+            if index_cache is not None:
+                db, indexed = index_cache.open(database, database_password, keyfile, key_cache=key_cache, timings=self.timings)
+                self._display.vvv("Snapshot {} {}".format('read from' if indexed else 'written to', index_cache.cache_dir))
+                return IndexedDatabase(db)
+            kp = open_database(database, database_password, keyfile, key_cache=key_cache, timings=self.timings)
+            if snapshot:
+                with self.timings.phase('snapshot'):
+                    kp = DatabaseSnapshot(kp)
+            return IndexedDatabase(kp)
+
+        if not self.get_option('cache'):
+            db = opener()
+            self._display.vv("Database opened successfully")
+            return db
+
+        db, cached = DATABASE_CACHE.get(database, database_password, keyfile, opener,
+                                        max_size=self.get_option('cache_size'), ttl=self.get_option('cache_ttl'))
+        if cached:
+            self._display.vv("Database served from cache")
+        else:
+            self._display.vv("Database opened successfully")
+        return db
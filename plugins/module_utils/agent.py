@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+#
+# Author: Tobias Karger und Marie Berger
+# Contact: coding@thepatchwork.de
+# License: The Unlicense, see LICENSE file.
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import json
+import os
+import socket
+import stat
+import struct
+import tempfile
+import threading
+import time
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from ansible_collections.torie_coding.keepass.plugins.module_utils.cache import DatabaseCache
+from ansible_collections.torie_coding.keepass.plugins.module_utils.database import (
+    GroupNotFoundError,
+    IndexedDatabase,
+    entry_results,
+)
+from ansible_collections.torie_coding.keepass.plugins.module_utils.keys import KeyCache, open_database
+from ansible_collections.torie_coding.keepass.plugins.module_utils.snapshot import DatabaseSnapshot
+
+try:
+    import pykeepass.exceptions
+except ImportError:
+    PYKEEPASS_FOUND = False
+else:
+    PYKEEPASS_FOUND = True
+
+SOCKET_ENV = 'KEEPASS_AGENT_SOCKET'
+
+
+def default_socket_path():
+    """Return the agent socket path: $KEEPASS_AGENT_SOCKET or a per-user path in the runtime dir."""
+    if os.environ.get(SOCKET_ENV):
+        return os.environ[SOCKET_ENV]
+    base = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(base, 'keepass-agent-{}'.format(os.getuid()), 'agent.sock')
+
+
+class AgentError(Exception):
+    """Error reported by the agent. ``kind`` is one of credentials, io, checksum, not_found or None."""
+
+    def __init__(self, msg, kind=None):
+        super(AgentError, self).__init__(msg)
+        self.kind = kind
+
+
+class AgentUnavailable(Exception):
+    """No trustworthy agent is listening on the socket."""
+
+
+def _check_private(path, kind):
+    st = os.lstat(path)
+    if st.st_uid != os.getuid():
+        raise AgentUnavailable("{} {} is not owned by the current user".format(kind, path))
+    if st.st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+        raise AgentUnavailable("{} {} is accessible by other users".format(kind, path))
+    return st
+
+
+class AgentClient(object):
+    """Client side of the agent protocol: one JSON request and response line per connection."""
+
+    def __init__(self, socket_path=None, timeout=60):
+        self.socket_path = socket_path or default_socket_path()
+        self.timeout = timeout
+
+    def present(self):
+        return os.path.exists(self.socket_path)
+
+    def request(self, op, **params):
+        if not self.present():
+            raise AgentUnavailable("No agent socket at {}".format(self.socket_path))
+        # never hand credentials to a socket someone else could have created
+        _check_private(os.path.dirname(self.socket_path) or '.', 'Directory')
+        if not stat.S_ISSOCK(_check_private(self.socket_path, 'Socket').st_mode):
+            raise AgentUnavailable("{} is not a socket".format(self.socket_path))
+
+        params['op'] = op
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            try:
+                sock.connect(self.socket_path)
+            except (IOError, OSError) as exc:
+                raise AgentUnavailable("Could not connect to the agent: {}".format(exc))
+            sock.sendall(json.dumps(params).encode('utf-8') + b'\n')
+            data = b''
+            while not data.endswith(b'\n'):
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+        finally:
+            sock.close()
+
+        if not data:
+            raise AgentUnavailable("The agent closed the connection without an answer")
+        response = json.loads(data.decode('utf-8'))
+        if not response.get('ok'):
+            raise AgentError(response.get('error', 'Unknown agent error'), response.get('kind'))
+        return response.get('result')
+
+
+def notify_agent(socket_path, database):
+    """Tell a running agent that ``database`` was written, ignoring a missing agent."""
+    try:
+        AgentClient(socket_path, timeout=5).request('invalidate', database=os.path.abspath(database))
+    except (AgentUnavailable, AgentError, IOError, OSError, ValueError):
+        pass
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        agent = self.server.agent
+        if not agent.peer_allowed(self.connection):
+            return
+        agent.touch()
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            response = dict(ok=True, result=agent.dispatch(request))
+        except AgentError as exc:
+            response = dict(ok=False, error=str(exc), kind=exc.kind)
+        except pykeepass.exceptions.CredentialsError:
+            response = dict(ok=False, error='Could not open the database, as the credentials are wrong.', kind='credentials')
+        except (pykeepass.exceptions.HeaderChecksumError, pykeepass.exceptions.PayloadChecksumError):
+            response = dict(ok=False, error='Could not open the database, as the checksum of the database is wrong. '
+                                            'This could be caused by a corrupt database.', kind='checksum')
+        except GroupNotFoundError as exc:
+            response = dict(ok=False, error=str(exc), kind='not_found')
+        except (IOError, OSError):
+            response = dict(ok=False, error='Could not open the database or keyfile.', kind='io')
+        except Exception as exc:
+            response = dict(ok=False, error='Agent error: {}'.format(exc))
+        self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+        if agent.stopping:
+            # only now, the process exits as soon as the server is down
+            threading.Thread(target=self.server.shutdown).start()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class KeePassAgent(object):
+    """Long-lived local process that keeps databases unlocked in memory.
+
+    Databases are held in a DatabaseCache, so a database that changed on
+    disk is reopened and requests with other credentials never get a copy
+    opened with different ones. The socket lives in a directory only the
+    current user can access and connections from other users are refused.
+    """
+
+    def __init__(self, socket_path=None, idle_timeout=0, cache_ttl=0, cache_size=8, snapshot=False, key_cache_ttl=None):
+        self.socket_path = socket_path or default_socket_path()
+        self.idle_timeout = idle_timeout
+        self.cache = DatabaseCache(max_size=cache_size, ttl=cache_ttl)
+        self.snapshot = snapshot
+        # None disables the key cache
+        self.key_cache = KeyCache(ttl=key_cache_ttl) if key_cache_ttl is not None else None
+        self.server = None
+        self.stopping = False
+        self._last_request = time.monotonic()
+        # lxml trees are not meant to be shared between threads, handle one request at a time
+        self._lock = threading.Lock()
+
+    def open(self, database, password=None, keyfile=None):
+        if not password and not keyfile:
+            raise AgentError("Either 'database_password' or 'keyfile' (or both) are required.")
+
+        def opener():
+            kp = open_database(database, password, keyfile, key_cache=self.key_cache)
+            return IndexedDatabase(DatabaseSnapshot(kp) if self.snapshot else kp)
+
+        return self.cache.get(database, password, keyfile, opener)[0]
+
+    def dispatch(self, request):
+        op = request.get('op')
+        if op == 'stop':
+            self.stopping = True
+            return {}
+        with self._lock:
+            return self._dispatch(op, request)
+
+    def _dispatch(self, op, request):
+        if op == 'ping':
+            return dict(pid=os.getpid(), databases=len(self.cache))
+        if op == 'open':
+            self.open(request['database'], request.get('password'), request.get('keyfile'))
+            return dict(database=request['database'])
+        if op == 'find':
+            db = self.open(request['database'], request.get('password'), request.get('keyfile'))
+            return [entry_results(db.search(**search.get('query', {})), **search.get('page', {})) for search in request.get('searches', [])]
+        if op == 'group':
+            db = self.open(request['database'], request.get('password'), request.get('keyfile'))
+            return db.export_group(**request.get('export', {}))
+        if op == 'invalidate':
+            self.cache.invalidate(request.get('database'))
+            return {}
+        raise AgentError("Unknown operation '{}'".format(op))
+
+    def peer_allowed(self, connection):
+        if not hasattr(socket, 'SO_PEERCRED'):
+            # no peer credentials on this platform, the private directory has to do
+            return True
+        creds = connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+        uid = struct.unpack('3i', creds)[1]
+        return uid == os.getuid()
+
+    def touch(self):
+        self._last_request = time.monotonic()
+
+    def _watch_idle(self):
+        while True:
+            time.sleep(min(self.idle_timeout, 5))
+            if time.monotonic() - self._last_request > self.idle_timeout:
+                self.server.shutdown()
+                return
+
+    def serve(self):
+        """Bind the socket and serve requests until stopped or idle for too long."""
+        directory = os.path.dirname(self.socket_path) or '.'
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        try:
+            _check_private(directory, 'Directory')
+        except AgentUnavailable as exc:
+            raise AgentError("The agent socket has to be in a private directory: {}".format(exc))
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+        old_umask = os.umask(0o177)
+        try:
+            self.server = _Server(self.socket_path, _Handler)
+        finally:
+            os.umask(old_umask)
+        os.chmod(self.socket_path, 0o600)
+        self.server.agent = self
+
+        if self.idle_timeout:
+            watchdog = threading.Thread(target=self._watch_idle)
+            watchdog.daemon = True
+            watchdog.start()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            self.cache.invalidate()
+            if self.key_cache is not None:
+                self.key_cache.wipe()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
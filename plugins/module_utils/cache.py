@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+# Author: Tobias Karger und Marie Berger
+# Contact: coding@thepatchwork.de
+# License: The Unlicense, see LICENSE file.
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def credential_digest(password, keyfile):
+    """Return a digest identifying the credentials used to open a database.
+
+    The keyfile is hashed by content, so replacing it invalidates the digest
+    just like changing the password does. Plaintext credentials are never
+    stored in the cache.
+    """
+    digest = hashlib.sha256()
+    digest.update(b'password\0')
+    if password is not None:
+        digest.update(password.encode('utf-8'))
+    digest.update(b'\0keyfile\0')
+    if keyfile:
+        with open(keyfile, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_stamp(path):
+    """Return the (inode, size, mtime) triple used to detect changes on disk."""
+    st = os.stat(path)
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class DatabaseCache(object):
+    """LRU/TTL cache of opened KeePass databases.
+
+    Entries are keyed by the real path of the database and a digest of the
+    credentials. Every lookup compares the file's inode, size and mtime with
+    the ones recorded when the database was opened, and reopens it when the
+    file has changed on disk.
+
+    ``max_size`` and ``ttl`` are defaults, callers sharing one cache with
+    different settings pass their own to ``get``, which never changes the
+    defaults for the other callers.
+    """
+
+    def __init__(self, max_size=8, ttl=0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, database, password, keyfile, opener, max_size=None, ttl=None):
+        """Return the opened database, calling ``opener()`` on a cache miss.
+
+        A database opened on a miss is kept for ``ttl`` seconds, and the
+        least recently used ones are dropped beyond ``max_size``. Both
+        default to the settings of the cache.
+
+        Returns a tuple of the database object and a bool that is True when
+        it was served from the cache.
+        """
+        if max_size is None:
+            max_size = self.max_size
+        if ttl is None:
+            ttl = self.ttl
+        path = os.path.realpath(database)
+        key = (path, credential_digest(password, keyfile))
+        stamp = file_stamp(path)
+        now = time.monotonic()
+
+        with self._lock:
+            self._expire(now)
+            cached = self._entries.get(key)
+            if cached is not None and cached['stamp'] == stamp:
+                self._entries.move_to_end(key)
+                return cached['value'], True
+
+        value = opener()
+
+        with self._lock:
+            self._entries[key] = dict(stamp=stamp, value=value, loaded=now, ttl=ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > max(max_size, 1):
+                self._entries.popitem(last=False)
+        return value, False
+
+    def restamp(self, database, password, keyfile):
+        """Record the current stamp of ``database`` after it was written from its cached copy.
+
+        Cached copies opened with other credentials no longer match the file
+        and are dropped.
+        """
+        path = os.path.realpath(database)
+        key = (path, credential_digest(password, keyfile))
+        stamp = file_stamp(path)
+        with self._lock:
+            for other in [k for k in self._entries if k[0] == path and k != key]:
+                del self._entries[other]
+            if key in self._entries:
+                self._entries[key]['stamp'] = stamp
+
+    def invalidate(self, database=None):
+        """Drop the cached copies of ``database``, or everything if not given."""
+        with self._lock:
+            if database is None:
+                self._entries.clear()
+                return
+            path = os.path.realpath(database)
+            for key in [k for k in self._entries if k[0] == path]:
+                del self._entries[key]
+
+    def _expire(self, now):
+        for key in [k for k, v in self._entries.items() if v['ttl'] and now - v['loaded'] > v['ttl']]:
+            del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Shared by every plugin running in this process. Ansible forks a worker per
+# task and host, so on the controller it lasts for a single task.
+DATABASE_CACHE = DatabaseCache()
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+#
+# Author: Tobias Karger und Marie Berger
+# Contact: coding@thepatchwork.de
+# License: The Unlicense, see LICENSE file.
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+from ansible_collections.torie_coding.keepass.plugins.module_utils.entry_index import EntryIndex
+from ansible_collections.torie_coding.keepass.plugins.module_utils.group_index import GroupIndex, split_path
+from ansible_collections.torie_coding.keepass.plugins.module_utils.matcher import EntryMatcher
+from ansible_collections.torie_coding.keepass.plugins.module_utils.snapshot import GroupRecord
+from ansible_collections.torie_coding.keepass.plugins.module_utils.uuid_index import UuidIndex, format_uuid
+
+try:
+    from pykeepass.entry import Entry
+    from pykeepass.group import Group
+except ImportError:
+    # the plugins check for pykeepass themselves
+    pass
+
+
+class GroupNotFoundError(Exception):
+    pass
+
+
+ENTRY_FIELDS = {
+    'title': lambda entry: entry.title,
+    'username': lambda entry: entry.username,
+    'group_path': lambda entry: "/".join(entry.group.path),
+    'icon_id': lambda entry: entry.icon,
+    'password': lambda entry: entry.password,
+    'url': lambda entry: entry.url,
+    'notes': lambda entry: entry.notes,
+    'tags': lambda entry: entry.tags,
+    'uuid': lambda entry: format_uuid(entry.uuid),
+}
+DEFAULT_ENTRY_FIELDS = ('title', 'username', 'group_path', 'icon_id', 'password', 'url', 'notes', 'tags', 'uuid')
+# fields stored as protected values in the database
+PROTECTED_FIELDS = ('password',)
+
+
+def check_fields(fields):
+    """Raise ValueError for names in ``fields`` that are not entry fields."""
+    unknown = [field for field in fields or () if field not in ENTRY_FIELDS]
+    if unknown:
+        raise ValueError("Unknown entry fields {}, known fields are {}".format(
+            ', '.join(unknown), ', '.join(DEFAULT_ENTRY_FIELDS)))
+
+
+def entry_result(entry, fields=None):
+    """Return the dictionary the lookup plugin reports for an entry.
+
+    Only the given ``fields`` are read from the entry, all of them by default.
+    """
+    return dict((field, ENTRY_FIELDS[field](entry)) for field in fields or DEFAULT_ENTRY_FIELDS)
+
+
+def entry_results(entries, fields=None, offset=0, limit=0, count_only=False):
+    """Return the results for one page of ``entries``, or only their number.
+
+    Entries before ``offset`` and after ``limit`` (0 for no limit) are
+    never turned into dictionaries.
+    """
+    entries = list(entries)
+    if count_only:
+        return [len(entries)]
+    end = offset + limit if limit else None
+    return [entry_result(entry, fields) for entry in entries[offset:end]]
+
+
+GROUP_FIELDS = {
+    'name': lambda group, path: group.name,
+    'path': lambda group, path: "/".join(path),
+    'icon_id': lambda group, path: group.icon,
+    'notes': lambda group, path: group.notes,
+    'uuid': lambda group, path: format_uuid(group.uuid),
+}
+DEFAULT_GROUP_FIELDS = ('name', 'path', 'icon_id', 'notes', 'uuid')
+
+
+def check_group_fields(group_fields):
+    """Raise ValueError for names in ``group_fields`` that are not group fields."""
+    unknown = [field for field in group_fields or () if field not in GROUP_FIELDS]
+    if unknown:
+        raise ValueError("Unknown group fields {}, known fields are {}".format(
+            ', '.join(unknown), ', '.join(DEFAULT_GROUP_FIELDS)))
+
+
+def group_result(group, path, depth=1, fields=None, group_fields=None, entries=True):
+    """Return the dictionary the lookup plugin reports for a group and its subtree.
+
+    The children of every group are taken from its XML element in a single
+    pass. Subgroups are included ``depth`` levels deep, -1 for the whole
+    subtree, and every included group lists its entries if ``entries`` is
+    set. ``fields`` and ``group_fields`` select the keys of entries and
+    groups, all of them by default.
+    """
+    result = dict((field, GROUP_FIELDS[field](group, path)) for field in group_fields or DEFAULT_GROUP_FIELDS)
+    if depth == 0 and not entries:
+        return result
+
+    if isinstance(group, GroupRecord):
+        subgroups = group.subgroups
+        group_entries = group.entries
+    else:
+        subgroups = []
+        group_entries = []
+        for child in group._element:
+            if child.tag == 'Group' and depth != 0:
+                subgroups.append(Group(element=child, kp=group._kp))
+            elif child.tag == 'Entry' and entries:
+                group_entries.append(Entry(element=child, kp=group._kp))
+
+    if entries:
+        fields = fields or DEFAULT_ENTRY_FIELDS
+        # the path of the group is known, do not walk up the tree for every entry
+        entry_fields = [field for field in fields if field != 'group_path']
+        result['entries'] = []
+        for entry in group_entries:
+            entry_dict = entry_result(entry, entry_fields)
+            if 'group_path' in fields:
+                entry_dict['group_path'] = "/".join(path)
+            result['entries'].append(entry_dict)
+    if depth != 0:
+        result['groups'] = [group_result(subgroup, path + (subgroup.name,), depth - 1, fields, group_fields, entries)
+                            for subgroup in subgroups]
+    return result
+
+
+class IndexedDatabase(object):
+    """An opened database together with its lazily built indexes.
+
+    This is what the lookup plugin keeps in its cache for the rest of the
+    task, so the indexes live exactly as long as the opened copy of the
+    file they were built from. ``kp`` is a PyKeePass object or a DatabaseSnapshot of one.
+    """
+
+    def __init__(self, kp):
+        self.kp = kp
+        self._group_index = None
+        self._entry_index = None
+        self._uuid_index = None
+
+    @property
+    def group_index(self):
+        if self._group_index is None:
+            self._group_index = GroupIndex(self.kp)
+        return self._group_index
+
+    @property
+    def entry_index(self):
+        if self._entry_index is None:
+            self._entry_index = EntryIndex(self.kp)
+        return self._entry_index
+
+    @property
+    def uuid_index(self):
+        if self._uuid_index is None:
+            self._uuid_index = UuidIndex(self.kp)
+        return self._uuid_index
+
+    def search(self, group_path=None, recursive=True, title=None, username=None, notes=None, url=None, tags=None, regex=False,
+               uuid=None):
+        """Return the entries matching the lookup criteria, in document order.
+
+        Without any criterion all entries of the database, or the entries
+        directly in ``group_path``, are returned. Exact-match searches are
+        answered from the entry index, regex searches scan the searched
+        groups with a precompiled matcher. With ``uuid`` the entry is taken
+        from the UUID index and only checked against the other criteria.
+        """
+        if split_path(group_path) and self.group_index.find(group_path) is None:
+            raise GroupNotFoundError("Group '{}' not found in the database.".format(group_path))
+        tags = [tag for tag in tags or () if tag]
+
+        if uuid:
+            entry = self.uuid_index.find(uuid, 'entry')
+            if entry is None:
+                return []
+            key = split_path(group_path)
+            path = tuple(entry.group.path)
+            if path[:len(key)] != key or not recursive and path != key:
+                return []
+            return EntryMatcher(title, username, notes, url, tags, regex=regex).filter([entry])
+
+        if not any([title, username, notes, url, tags]):
+            if split_path(group_path):
+                return self.entry_index.scope(group_path, recursive=False)
+            return self.entry_index.scope()
+
+        if not regex:
+            return self.entry_index.find(group_path=group_path, recursive=recursive, title=title,
+                                         username=username, url=url, tags=tags, notes=notes)
+
+        matcher = EntryMatcher(title, username, notes, url, tags, regex=True)
+        return matcher.filter(self.entry_index.scope(group_path, recursive))
+
+    def export_group(self, group_path=None, depth=1, fields=None, group_fields=None, entries=True, uuid=None):
+        """Return the group at ``group_path``, or with the UUID ``uuid``, with its subtree, see ``group_result``."""
+        if uuid:
+            group = self.uuid_index.find(uuid, 'group')
+            if group is None:
+                raise GroupNotFoundError("Group with the UUID '{}' not found in the database.".format(uuid))
+            return group_result(group, tuple(group.path), depth, fields, group_fields, entries)
+        group = self.group_index.find(group_path)
+        if group is None:
+            raise GroupNotFoundError("Group '{}' not found in the database.".format(group_path))
+        return group_result(group, split_path(group_path), depth, fields, group_fields, entries)
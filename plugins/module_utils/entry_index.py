@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+#
+# Author: Tobias Karger und Marie Berger
+# Contact: coding@thepatchwork.de
+# License: The Unlicense, see LICENSE file.
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+from ansible_collections.torie_coding.keepass.plugins.module_utils.group_index import split_path
+
+
+class EntryIndex(object):
+    """Exact-match hash indexes over all entries of a database.
+
+    Entries are indexed by title, username, url, every single tag and the
+    path of the group they are directly in. Positions refer to the entry
+    list in document order, so results come back in the same order as
+    ``kp.find_entries`` returns them. History entries are not indexed.
+    """
+
+    FIELDS = ('title', 'username', 'url')
+
+    def __init__(self, kp):
+        self.entries = kp.entries
+        self._fields = dict((field, {}) for field in self.FIELDS)
+        self._tags = {}
+        self._groups = {}
+        if hasattr(kp.root_group, '_element'):
+            group_keys = self._group_keys(kp.root_group._element, lambda group: group.iterchildren('Group'), lambda group: group.findtext('Name'))
+        else:
+            # records of a DatabaseSnapshot
+            group_keys = self._group_keys(kp.root_group, lambda group: group.subgroups, lambda group: group.name)
+        for pos, entry in enumerate(self.entries):
+            for field in self.FIELDS:
+                self._fields[field].setdefault(getattr(entry, field), []).append(pos)
+            for tag in entry.tags:
+                self._tags.setdefault(tag, []).append(pos)
+            group = entry._element.getparent() if hasattr(entry, '_element') else entry.group
+            self._groups.setdefault(group_keys[group], []).append(pos)
+
+    @staticmethod
+    def _group_keys(root, subgroups, name):
+        """Map every group below ``root`` to the key of its path.
+
+        Like ``find_groups`` and GroupIndex, a path addresses the first of
+        several equally named sibling groups. The others and their subtrees
+        get keys with a ``(name, position)`` component that no path equals,
+        so they are only found through a recursive search of a parent.
+        """
+        keys = {root: ()}
+        stack = [root]
+        while stack:
+            parent = stack.pop()
+            seen = set()
+            for pos, group in enumerate(subgroups(parent)):
+                group_name = name(group)
+                component = group_name if group_name not in seen else (group_name, pos)
+                seen.add(group_name)
+                keys[group] = keys[parent] + (component,)
+                stack.append(group)
+        return keys
+
+    def group_positions(self, group_path, recursive=True):
+        """Return the positions of the entries in a group, or in its whole subtree."""
+        key = split_path(group_path)
+        if not recursive:
+            return set(self._groups.get(key, ()))
+        positions = set()
+        for path, members in self._groups.items():
+            if path[:len(key)] == key:
+                positions.update(members)
+        return positions
+
+    def scope(self, group_path=None, recursive=True):
+        """Return the entries in a group, or in its whole subtree, in document order."""
+        if not split_path(group_path) and recursive:
+            return list(self.entries)
+        return [self.entries[pos] for pos in sorted(self.group_positions(group_path, recursive))]
+
+    def find(self, group_path=None, recursive=True, title=None, username=None, url=None, tags=None, notes=None):
+        """Return the entries matching all given values exactly, in document order.
+
+        Every indexed criterion costs one dict lookup. ``notes`` is not
+        indexed and is only compared on the remaining candidates.
+        """
+        candidates = None
+        lists = []
+        for field, value in (('title', title), ('username', username), ('url', url)):
+            if value:
+                lists.append(self._fields[field].get(value, ()))
+        for tag in tags or ():
+            if tag:
+                lists.append(self._tags.get(tag, ()))
+        # intersect starting with the most selective criterion
+        for positions in sorted(lists, key=len):
+            candidates = set(positions) if candidates is None else candidates.intersection(positions)
+            if not candidates:
+                return []
+
+        if split_path(group_path) or not recursive:
+            in_group = self.group_positions(group_path, recursive)
+            candidates = in_group if candidates is None else candidates & in_group
+        elif candidates is None:
+            candidates = range(len(self.entries))
+
+        entries = [self.entries[pos] for pos in sorted(candidates)]
+        if notes:
+            entries = [entry for entry in entries if entry.notes == notes]
+        return entries
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#
+# Author: Tobias Karger und Marie Berger
+# Contact: coding@thepatchwork.de
+# License: The Unlicense, see LICENSE file.
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+
+def split_path(path):
+    """Normalize a group path to a tuple of group names.
+
+    Accepts a string like ``foo/bar/`` or a list of names. Leading, trailing
+    and double slashes are ignored, ``/`` and ``None`` mean the root group.
+    """
+    if path is None:
+        return ()
+    if isinstance(path, (list, tuple)):
+        return tuple(d for d in path if d)
+    return tuple(d for d in path.split("/") if d)
+
+
+def format_path(path):
+    """Format a group path the way the modules return it, e.g. ``foo/bar/``."""
+    return "".join(d + "/" for d in path)
+
+
+class GroupIndex(object):
+    """Dictionary index of normalized group paths to groups.
+
+    The tree is walked once when the index is built. Afterwards resolving a
+    path is a single dict lookup instead of an XPath scan over the whole
+    database. Groups added, renamed or deleted through the index keep it up
+    to date.
+    """
+
+    def __init__(self, kp):
+        self.kp = kp
+        self._groups = {(): kp.root_group}
+        stack = [((), kp.root_group)]
+        while stack:
+            parent_path, parent = stack.pop()
+            for subgroup in parent.subgroups:
+                key = parent_path + (subgroup.name,)
+                # like find_groups, the first of several equally named groups wins
+                if key not in self._groups:
+                    self._groups[key] = subgroup
+                    stack.append((key, subgroup))
+
+    def find(self, path):
+        """Return the group at ``path`` or None."""
+        return self._groups.get(split_path(path))
+
+    def add(self, path, name, icon=None, notes=None):
+        """Add group ``name`` below the existing group at ``path``."""
+        key = split_path(path)
+        group = self.kp.add_group(self._groups[key], group_name=name, icon=icon, notes=notes)
+        self._groups[key + (name,)] = group
+        return group
+
+    def ensure(self, path):
+        """Return the group at ``path``, creating missing groups along the way.
+
+        Returns the group and the list of paths that had to be created.
+        """
+        key = split_path(path)
+        created = []
+        for idx in range(1, len(key) + 1):
+            if key[:idx] not in self._groups:
+                self.add(key[:idx - 1], key[idx - 1])
+                created.append(key[:idx])
+        return self._groups[key], created
+
+    def rename(self, path, new_name):
+        """Rename the group at ``path`` and re-key its whole subtree.
+
+        Raises ValueError if a sibling already has the name ``new_name``.
+        """
+        key = split_path(path)
+        new_key = key[:-1] + (new_name,)
+        if new_key != key and new_key in self._groups:
+            raise ValueError("A group named '{}' already exists in '{}'.".format(new_name, format_path(key[:-1]) or '/'))
+        group = self._groups[key]
+        group.name = new_name
+        for old_key in self._subtree(key):
+            self._groups[new_key + old_key[len(key):]] = self._groups.pop(old_key)
+        return group
+
+    def delete(self, path):
+        """Delete the group at ``path`` and drop its whole subtree from the index."""
+        key = split_path(path)
+        self.kp.delete_group(group=self._groups[key])
+        for old_key in self._subtree(key):
+            del self._groups[old_key]
+
+    def _subtree(self, key):
+        return [k for k in self._groups if k[:len(key)] == key]
+
+    def __contains__(self, path):
+        return split_path(path) in self._groups
+
+    def __len__(self):
+        return len(self._groups)
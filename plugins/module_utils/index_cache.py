@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+#
+# Author: Tobias Karger und Marie Berger
+# Contact: coding@thepatchwork.de
+# License: The Unlicense, see LICENSE file.
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import hashlib
+import hmac
+import io
+import json
+import os
+import struct
+import tempfile
+import zlib
+
+from ansible_collections.torie_coding.keepass.plugins.module_utils.keys import read_header, transformed_key
+from ansible_collections.torie_coding.keepass.plugins.module_utils.snapshot import DatabaseSnapshot
+from ansible_collections.torie_coding.keepass.plugins.module_utils.timing import NO_TIMINGS
+
+try:
+    from Cryptodome.Cipher import AES
+    from pykeepass import PyKeePass
+except ImportError:
+    # the plugins check for pykeepass, which depends on pycryptodomex, themselves
+    pass
+
+# the version changes whenever DatabaseSnapshot.to_data does
+MAGIC = b'KPXIDX02'
+# sha256 of the kdbx header, size and mtime of the kdbx file, nonce, tag
+META = struct.Struct('>32sQQ12s16s')
+
+
+def default_cache_dir():
+    """Return the directory of index files: $XDG_CACHE_HOME/torie_coding.keepass or ~/.cache/torie_coding.keepass."""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'torie_coding.keepass')
+
+
+def index_path(database, cache_dir=None):
+    """Return the index file of ``database``, named after a hash of its real path."""
+    name = hashlib.sha256(os.path.realpath(database).encode('utf-8')).hexdigest()[:32]
+    return os.path.join(cache_dir or default_cache_dir(), name + '.index')
+
+
+def index_key(key, header_hash):
+    """Derive the key of an index file from the transformed key of the database.
+
+    Brute-forcing the credentials from the index costs the same key
+    derivation as brute-forcing them from the database itself.
+    """
+    return hmac.new(key, b'torie_coding.keepass index\x00' + header_hash, hashlib.sha256).digest()
+
+
+class IndexCache(object):
+    """Encrypted on-disk copies of database snapshots, one file per database.
+
+    An index file holds a DatabaseSnapshot encrypted with AES-GCM under a
+    key derived from the transformed key of the database. It is only used
+    while the header hash, size and mtime of the database are the ones it
+    was written for, so every save of the database makes it stale. The
+    authenticated metadata and the authentication tag make a tampered or
+    foreign index file a cache miss rather than wrong results.
+    """
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or default_cache_dir()
+
+    def open(self, database, password=None, keyfile=None, key_cache=None, timings=NO_TIMINGS):
+        """Return a snapshot of ``database`` and whether it came from the index file.
+
+        The database file is read once. On a hit its payload is never
+        decrypted or parsed, only the key derivation runs, unless the key is
+        found in ``key_cache`` (a KeyCache). On a miss the database is opened
+        with the already derived key and a fresh index file is written.
+        """
+        with timings.phase('read'), open(database, 'rb') as stream:
+            st = os.fstat(stream.fileno())
+            data = stream.read()
+        header, header_hash = read_header(data)
+        with timings.phase('kdf'):
+            if key_cache is not None:
+                key = key_cache.transformed_key(header, password, keyfile)
+            else:
+                key = transformed_key(header, password, keyfile)
+        path = index_path(database, self.cache_dir)
+        meta = (header_hash, st.st_size, st.st_mtime_ns)
+
+        with timings.phase('index_load'):
+            snapshot = self.load(path, meta, index_key(key, header_hash))
+        if snapshot is not None:
+            return snapshot, True
+
+        with timings.phase('parse'):
+            kp = PyKeePass(io.BytesIO(data), password=password, keyfile=keyfile, transformed_key=key)
+        with timings.phase('snapshot'):
+            snapshot = DatabaseSnapshot(kp)
+        try:
+            with timings.phase('index_store'):
+                self.store(path, meta, index_key(key, header_hash), snapshot)
+        except (IOError, OSError):
+            # a cache that cannot be written must not break the lookup
+            pass
+        return snapshot, False
+
+    def load(self, path, meta, key):
+        try:
+            with open(path, 'rb') as stream:
+                blob = stream.read()
+        except (IOError, OSError):
+            return None
+        if blob[:len(MAGIC)] != MAGIC or len(blob) < len(MAGIC) + META.size:
+            return None
+        header_hash, size, mtime_ns, nonce, tag = META.unpack_from(blob, len(MAGIC))
+        if (header_hash, size, mtime_ns) != meta:
+            return None
+        cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+        cipher.update(blob[:len(MAGIC) + META.size - len(nonce) - len(tag)])
+        try:
+            payload = cipher.decrypt_and_verify(blob[len(MAGIC) + META.size:], tag)
+        except ValueError:
+            # other credentials or a tampered file
+            return None
+        return DatabaseSnapshot.from_data(json.loads(zlib.decompress(payload).decode('utf-8')))
+
+    def store(self, path, meta, key, snapshot):
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        payload = zlib.compress(json.dumps(snapshot.to_data(), separators=(',', ':')).encode('utf-8'))
+        nonce = os.urandom(12)
+        cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+        aad = MAGIC + struct.pack('>32sQQ', *meta)
+        cipher.update(aad)
+        ciphertext, tag = cipher.encrypt_and_digest(payload)
+
+        # mkstemp creates the file with mode 0600
+        fd, tmp_path = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as stream:
+                stream.write(aad + nonce + tag + ciphertext)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def invalidate(self, database):
+        """Remove the index file of ``database``."""
+        try:
+            os.remove(index_path(database, self.cache_dir))
+        except (IOError, OSError):
+            pass
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+#
+# Author: Tobias Karger und Marie Berger
+# Contact: coding@thepatchwork.de
+# License: The Unlicense, see LICENSE file.
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import atexit
+import ctypes
+import ctypes.util
+import hashlib
+import io
+import threading
+import time
+
+from ansible_collections.torie_coding.keepass.plugins.module_utils.cache import credential_digest
+from ansible_collections.torie_coding.keepass.plugins.module_utils.timing import NO_TIMINGS
+
+try:
+    from construct import Container
+    from pykeepass import PyKeePass
+    from pykeepass.kdbx_parsing import kdbx3, kdbx4
+    from pykeepass.kdbx_parsing.kdbx import KDBX
+except ImportError:
+    # the plugins check for pykeepass themselves
+    pass
+
+
+def read_header(data):
+    """Parse the outer header of the kdbx file in ``data``.
+
+    Returns the parsed header and the sha256 of its raw bytes. Every save
+    rotates the master seed, so the hash changes whenever the file is
+    written.
+    """
+    header = KDBX.subcons[0].parse(data)
+    return header.value, hashlib.sha256(header.data).digest()
+
+
+def transformed_key(header, password=None, keyfile=None):
+    """Run the key derivation function of the database described by ``header``.
+
+    This is the expensive part of opening a database. The result can be
+    passed to PyKeePass as ``transformed_key``.
+    """
+    # the context pykeepass computes the key in while parsing the body
+    context = Container(
+        _=Container(
+            header=Container(value=header),
+            _=Container(password=password, keyfile=keyfile, transformed_key=None),
+        )
+    )
+    if header.major_version == 3:
+        return kdbx3.compute_transformed(context)
+    return kdbx4.compute_transformed(context)
+
+
+def kdf_digest(header):
+    """Return a digest of the key derivation parameters and salt in ``header``.
+
+    Together with the credentials they determine the transformed key, while
+    the master seed and IVs that every save rotates do not.
+    """
+    digest = hashlib.sha256()
+    if header.major_version == 3:
+        digest.update(b'aes-kdf\0' + header.dynamic_header.transform_seed.data)
+        digest.update(str(header.dynamic_header.transform_rounds.data).encode('ascii'))
+    else:
+        params = header.dynamic_header.kdf_parameters.data.dict
+        for name in sorted(name for name in params if not name.startswith('_')):
+            digest.update(name.encode('utf-8') + b'\0' + repr(params[name].value).encode('utf-8') + b'\0')
+    return digest.hexdigest()
+
+
+def _libc():
+    try:
+        return ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    except (OSError, TypeError):
+        return None
+
+
+_LIBC = _libc()
+
+
+def _mlock(buf, lock=True):
+    # best effort: keep the key out of swap where the platform and RLIMIT_MEMLOCK allow it
+    if _LIBC is None or not len(buf):
+        return False
+    try:
+        address = ctypes.addressof((ctypes.c_char * len(buf)).from_buffer(buf))
+        call = _LIBC.mlock if lock else _LIBC.munlock
+        return call(ctypes.c_void_p(address), ctypes.c_size_t(len(buf))) == 0
+    except (AttributeError, TypeError, ValueError):
+        return False
+
+
+class KeyCache(object):
+    """Transformed keys of recently opened databases, so reopening them skips the key derivation.
+
+    Keys are stored by a digest of the key derivation parameters, the salt
+    and the credentials, never by the credentials themselves. Every key is
+    kept in a bytearray that is locked into memory where possible, and
+    overwritten when it expires, is dropped or the process exits. Python
+    may still hold short-lived copies, as PyKeePass takes the key as bytes.
+
+    ``ttl`` is the default lifetime of a key. Callers sharing one cache with
+    their own lifetime use the view returned by ``with_ttl``, every key
+    expires after the lifetime it was stored with.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._keys = {}
+        self._lock = threading.Lock()
+        atexit.register(self.wipe)
+
+    def with_ttl(self, ttl):
+        """Return a view of the cache that stores the keys it derives for ``ttl`` seconds."""
+        return _KeyCacheView(self, ttl)
+
+    def transformed_key(self, header, password=None, keyfile=None, ttl=None):
+        """Return the transformed key of the database described by ``header``, deriving it on a miss.
+
+        A derived key is kept for ``ttl`` seconds, by default the ttl of the cache.
+        """
+        if ttl is None:
+            ttl = self.ttl
+        ident = (kdf_digest(header), credential_digest(password, keyfile))
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            cached = self._keys.get(ident)
+            if cached is not None:
+                return bytes(cached[0])
+
+        key = transformed_key(header, password, keyfile)
+        buf = bytearray(key)
+        _mlock(buf)
+        with self._lock:
+            self._drop(ident)
+            self._keys[ident] = (buf, now, ttl)
+        return key
+
+    def wipe(self):
+        """Overwrite and drop every cached key."""
+        with self._lock:
+            for ident in list(self._keys):
+                self._drop(ident)
+
+    def _drop(self, ident):
+        cached = self._keys.pop(ident, None)
+        if cached is not None:
+            buf = cached[0]
+            buf[:] = bytes(len(buf))
+            _mlock(buf, lock=False)
+
+    def _expire(self, now):
+        for ident in [i for i, (buf, stored, ttl) in self._keys.items() if ttl and now - stored > ttl]:
+            self._drop(ident)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class _KeyCacheView(object):
+    """A KeyCache that stores the keys it derives with its own ttl, see ``KeyCache.with_ttl``."""
+
+    def __init__(self, cache, ttl):
+        self.cache = cache
+        self.ttl = ttl
+
+    def transformed_key(self, header, password=None, keyfile=None):
+        return self.cache.transformed_key(header, password, keyfile, ttl=self.ttl)
+
+    def wipe(self):
+        self.cache.wipe()
+
+
+# Shared by every plugin running in this process. Only used by the plugins whose key_cache option is set.
+KEY_CACHE = KeyCache()
+
+
+def unlock(data, password=None, keyfile=None, key_cache=None, timings=NO_TIMINGS):
+    """Open the kdbx file in ``data`` with PyKeePass, taking the transformed key from ``key_cache``.
+
+    With enabled ``timings`` the key derivation and the parsing are timed as
+    the phases ``kdf`` and ``parse``.
+    """
+    if key_cache is None and not timings.enabled:
+        return PyKeePass(io.BytesIO(data), password=password, keyfile=keyfile)
+    header = read_header(data)[0]
+    with timings.phase('kdf'):
+        if key_cache is not None:
+            key = key_cache.transformed_key(header, password, keyfile)
+        else:
+            key = transformed_key(header, password, keyfile)
+    with timings.phase('parse'):
+        return PyKeePass(io.BytesIO(data), password=password, keyfile=keyfile, transformed_key=key)
+
+
+def open_database(database, password=None, keyfile=None, key_cache=None, timings=NO_TIMINGS):
+    """Open the database file with PyKeePass, see ``unlock``. Reading the file is timed as the phase ``read``."""
+    if key_cache is None and not timings.enabled:
+        return PyKeePass(database, password=password, keyfile=keyfile)
+    with timings.phase('read'):
+        with open(database, 'rb') as stream:
+            data = stream.read()
+    return unlock(data, password, keyfile, key_cache, timings)
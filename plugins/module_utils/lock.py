@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+#
+# Author: Tobias Karger und Marie Berger
+# Contact: coding@thepatchwork.de
+# License: The Unlicense, see LICENSE file.
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import fcntl
+import os
+import time
+
+
+class LockTimeout(Exception):
+    """The lock was not acquired within the timeout."""
+
+
+class DatabaseLock(object):
+    """Advisory lock shared by every process that writes ``database``.
+
+    The lock is taken on ``<database>.lock`` rather than on the database
+    itself, because saving replaces the database file and a lock held on
+    the old inode would not be seen by the next writer.
+    """
+
+    def __init__(self, database, timeout=60, poll_interval=0.05):
+        self.path = os.path.realpath(database) + '.lock'
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._fd = None
+
+    @property
+    def locked(self):
+        return self._fd is not None
+
+    def acquire(self):
+        if self._fd is not None:
+            return
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                if time.monotonic() >= deadline:
+                    os.close(fd)
+                    raise LockTimeout("Timed out after {} seconds waiting for the lock {}".format(self.timeout, self.path))
+                time.sleep(self.poll_interval)
+            else:
+                self._fd = fd
+                return
+
+    def release(self):
+        if self._fd is None:
+            return
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+#
+# Author: Tobias Karger und Marie Berger
+# Contact: coding@thepatchwork.de
+# License: The Unlicense, see LICENSE file.
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import re
+from functools import lru_cache
+
+
+@lru_cache(maxsize=256)
+def compile_pattern(pattern):
+    """Compile a search pattern once and keep it for later queries."""
+    return re.compile(pattern)
+
+
+class EntryMatcher(object):
+    """Precompiled query that checks all criteria of an entry in one pass.
+
+    With ``regex`` every text field (title, username, notes and url) is
+    searched with its compiled pattern, otherwise it has to match exactly.
+    Tags are never regular expressions, an entry must carry all of them.
+    """
+
+    FIELDS = ('title', 'username', 'notes', 'url')
+
+    def __init__(self, title=None, username=None, notes=None, url=None, tags=None, regex=False):
+        self.checks = []
+        for field, value in zip(self.FIELDS, (title, username, notes, url)):
+            if value:
+                self.checks.append((field, compile_pattern(value) if regex else None, value))
+        self.tags = frozenset(tag for tag in tags or () if tag)
+
+    def __call__(self, entry):
+        for field, pattern, value in self.checks:
+            actual = getattr(entry, field)
+            if pattern is None:
+                if actual != value:
+                    return False
+            elif actual is None or not pattern.search(actual):
+                return False
+        if self.tags and not self.tags.issubset(entry.tags):
+            return False
+        return True
+
+    def filter(self, entries):
+        return [entry for entry in entries if self(entry)]
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+#
+# Author: Tobias Karger und Marie Berger
+# Contact: coding@thepatchwork.de
+# License: The Unlicense, see LICENSE file.
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+
+def generate_password(length):
+    """Return a random password of ``length`` letters and digits."""
+    import string
+    alphabet = string.ascii_letters + string.digits
+    try:
+        import secrets as random
+    except ImportError:
+        import random
+
+    gen_password = ''.join(random.choice(alphabet) for _ in range(length))
+    return gen_password
@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+#
+# Author: Tobias Karger und Marie Berger
+# Contact: coding@thepatchwork.de
+# License: The Unlicense, see LICENSE file.
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import traceback
+
+from ansible.module_utils.six import string_types
+from ansible_collections.torie_coding.keepass.plugins.module_utils.group_index import format_path, split_path
+from ansible_collections.torie_coding.keepass.plugins.module_utils.password import generate_password
+from ansible_collections.torie_coding.keepass.plugins.module_utils.uuid_index import format_uuid, parse_uuid
+
+MASK = '********'
+GROUP_ITEM_OPTIONS = ['name', 'uuid', 'path', 'icon_id', 'notes', 'state', 'groups']
+
+
+class VaultState(object):
+    """One pass of matching a desired state against an opened database.
+
+    Groups and entries with a UUID are resolved through the UUID index of
+    the transaction, all others by name or title below their parent group
+    through per-group dictionaries built on first use. Everything matched
+    or created is remembered, so pruning needs no second lookup.
+
+    Applied differences are counted in ``summary``. With ``keep_changes``
+    they are also kept in ``changes``, and their old and new values in
+    ``before`` and ``after``, which bulk imports leave out to save memory.
+    """
+
+    def __init__(self, transaction, keep_changes=True):
+        self.transaction = transaction
+        self.module = transaction.module
+        self.kp = transaction.kp
+        self.keep_changes = keep_changes
+        self.summary = dict(created=0, updated=0, deleted=0)
+        self.changes = []
+        self.before = {}
+        self.after = {}
+        self.kept = set()
+        self.absent = []
+        self._subgroups = {}
+        self._entries = {}
+
+    def apply(self, params):
+        root = self.ensure(self.kp.root_group, split_path(params['path']))
+        self.kept.add(root._element)
+
+        # groups first, so the entries find the groups in their final place
+        self.apply_groups(root, params['groups'])
+        for item in params['entries']:
+            self.apply_entry(root, item)
+
+        # deleted last, an entry may still have to be moved out of them
+        for group in self.absent:
+            if self.exists(group):
+                self.delete(group, 'group')
+
+        if params['prune']:
+            self.prune(root)
+
+    # lookups
+
+    def subgroups(self, group):
+        """Return the subgroups of ``group`` by name, the first of several equally named groups wins."""
+        names = self._subgroups.get(group._element)
+        if names is None:
+            names = {}
+            for subgroup in group.subgroups:
+                names.setdefault(subgroup.name, subgroup)
+            self._subgroups[group._element] = names
+        return names
+
+    def entries(self, group):
+        """Return the entries of ``group`` by title, the first of several equally titled entries wins."""
+        titles = self._entries.get(group._element)
+        if titles is None:
+            titles = {}
+            for entry in group.entries:
+                titles.setdefault(entry.title, entry)
+            self._entries[group._element] = titles
+        return titles
+
+    def forget(self, *groups):
+        """Drop the name and title dictionaries of ``groups``, whose content changed."""
+        for group in groups:
+            self._subgroups.pop(group._element, None)
+            self._entries.pop(group._element, None)
+
+    def exists(self, item):
+        return item._element.getroottree().getroot() is self.kp.tree.getroot()
+
+    def check_uuid(self, value, name):
+        if not value:
+            return None
+        try:
+            return parse_uuid(value)
+        except ValueError as exc:
+            self.module.fail_json(msg=str(exc), name=name)
+
+    # changes
+
+    def record(self, action, kind, path, item, fields=None, before=None, after=None):
+        self.summary[action + 'd'] += 1
+        if not self.keep_changes:
+            return
+        change = dict(action=action, type=kind, path=path, uuid=format_uuid(item.uuid))
+        if fields is not None:
+            change['fields'] = sorted(fields)
+        self.changes.append(change)
+        key = '{} {}'.format(kind, path)
+        if before is not None:
+            self.before[key] = before
+        if after is not None:
+            self.after[key] = after
+
+    def ensure(self, group, names):
+        """Return the group at the path ``names`` below ``group``, creating missing groups along the way."""
+        for name in names:
+            subgroup = self.subgroups(group).get(name)
+            if subgroup is None:
+                subgroup = self.add_group(group, name, None, None, None)
+            group = subgroup
+            self.kept.add(group._element)
+        return group
+
+    def add_group(self, parent, name, group_uuid, icon_id, notes):
+        group = self.kp.add_group(parent, name, icon=str(icon_id if icon_id is not None else 48), notes=notes or 'Generated by ansible.')
+        if group_uuid is not None:
+            group.uuid = group_uuid
+        self.transaction.uuid_index.add(group)
+        self.subgroups(parent)[name] = group
+        self.record('create', 'group', format_path(group.path), group,
+                    after=dict(name=name, icon_id=group.icon, notes=group.notes))
+        return group
+
+    def delete(self, item, kind):
+        if kind == 'group':
+            path = format_path(item.path)
+            parent = item.parentgroup
+            self.record('delete', kind, path, item, before=dict(name=item.name))
+            self.kp.delete_group(group=item)
+        else:
+            parent = item.group
+            path = format_path(parent.path) + item.title
+            self.record('delete', kind, path, item, before=dict(title=item.title))
+            self.kp.delete_entry(entry=item)
+        self.forget(parent)
+
+    def update(self, item, kind, desired):
+        """Set the attributes of ``desired`` that differ from ``item`` and return their old and new values."""
+        before = {}
+        after = {}
+        for field, value in desired.items():
+            if value is None:
+                continue
+            current = getattr(item, field)
+            if field == 'tags':
+                current = current or []
+            if current != value:
+                before[field], after[field] = current, value
+        return before, after
+
+    # groups
+
+    def apply_groups(self, parent, items):
+        for item in items or []:
+            if isinstance(item, string_types):
+                names = split_path(item)
+                if not names:
+                    self.module.fail_json(msg="Empty group path in 'groups'.")
+                item = dict(name=names[-1], path=list(names[:-1]))
+            elif not isinstance(item, dict):
+                self.module.fail_json(msg="Items of 'groups' must be paths or dictionaries, got: {}".format(item))
+
+            unknown = set(item) - set(GROUP_ITEM_OPTIONS)
+            if unknown:
+                self.module.fail_json(msg="Unsupported keys in 'groups' item: {}".format(", ".join(sorted(unknown))))
+            self.apply_group(parent, item)
+
+    def apply_group(self, parent, item):
+        name = item.get('name')
+        group_uuid = self.check_uuid(item.get('uuid'), name)
+        if not name and group_uuid is None:
+            self.module.fail_json(msg="Every item of 'groups' needs a 'name' or a 'uuid'.")
+        state = (item.get('state') or 'present').lower()
+        if state not in ('present', 'absent'):
+            self.module.fail_json(msg="Invalid state '{}' of group '{}'.".format(state, name))
+        icon_id = item.get('icon_id')
+        if icon_id is not None:
+            try:
+                icon_id = int(icon_id)
+            except (TypeError, ValueError):
+                self.module.fail_json(msg="Invalid icon_id '{}' for group '{}'.".format(icon_id, name))
+        notes = item.get('notes')
+
+        names = split_path(item.get('path'))
+        if state == 'absent':
+            # do not create the parents of a group that should not exist
+            for parent_name in names:
+                parent = self.subgroups(parent).get(parent_name)
+                if parent is None:
+                    return
+        else:
+            parent = self.ensure(parent, names)
+
+        if group_uuid is not None:
+            group = self.transaction.uuid_index.find(group_uuid, 'group')
+        else:
+            group = self.subgroups(parent).get(name)
+
+        if state == 'absent':
+            if group is not None:
+                self.absent.append(group)
+            return
+
+        if group is None:
+            if not name:
+                self.module.fail_json(msg="'name' is required to create a group.", uuid=item.get('uuid'))
+            group = self.add_group(parent, name, group_uuid, icon_id, notes)
+        else:
+            self.reconcile_group(parent, group, name, icon_id, notes)
+        self.kept.add(group._element)
+
+        if item.get('groups'):
+            self.apply_groups(group, item['groups'])
+
+    def reconcile_group(self, parent, group, name, icon_id, notes):
+        old_path = format_path(group.path)
+        before, after = self.update(group, 'group', dict(
+            name=name, icon=str(icon_id) if icon_id is not None else None, notes=notes))
+
+        old_parent = group.parentgroup
+        if old_parent._element is not parent._element:
+            if parent._element is group._element or group._element in parent._element.iterancestors():
+                self.module.fail_json(msg="Cannot move group '{}' into itself.".format(old_path))
+            self.kp.move_group(group, parent)
+            self.forget(old_parent, parent)
+            before['path'] = old_path
+        for field, value in after.items():
+            setattr(group, field, value)
+        if 'name' in after:
+            self.forget(parent)
+        if not before:
+            return
+
+        path = format_path(group.path)
+        if 'path' in before:
+            after['path'] = path
+        self.record('update', 'group', path, group, fields=[_field(field) for field in before],
+                    before=_public(before), after=_public(after))
+
+    # entries
+
+    def apply_entry(self, root, item, update=True):
+        """Create, update or delete the entry ``item`` below ``root``. Existing entries are left alone without ``update``."""
+        title = item['title']
+        entry_uuid = self.check_uuid(item['uuid'], title)
+        if not title and entry_uuid is None:
+            self.module.fail_json(msg="Every item of 'entries' needs a 'title' or a 'uuid'.")
+        icon_id = item['icon_id']
+        if icon_id is not None and not 0 <= icon_id <= 68:
+            self.module.fail_json(msg='Icon_id out of range. Choose a value between 0 and 68', title=title)
+
+        names = split_path(item['group_path'])
+        if item['state'] == 'absent':
+            group = root
+            for name in names:
+                group = self.subgroups(group).get(name)
+                if group is None:
+                    return
+        else:
+            group = self.ensure(root, names)
+
+        if entry_uuid is not None:
+            entry = self.transaction.uuid_index.find(entry_uuid, 'entry')
+        else:
+            entry = self.entries(group).get(title)
+
+        if item['state'] == 'absent':
+            if entry is not None:
+                self.delete(entry, 'entry')
+            return
+
+        if entry is None:
+            entry = self.add_entry(group, item, entry_uuid)
+        elif update:
+            self.reconcile_entry(group, entry, item)
+        self.kept.add(entry._element)
+
+    def add_entry(self, group, item, entry_uuid):
+        title = item['title']
+        if not title:
+            self.module.fail_json(msg="'title' is required to create an entry.", uuid=item['uuid'])
+        password = item['password']
+        if password is None:
+            password = generate_password(item['password_length'] or 20)
+        icon_id = item['icon_id'] if item['icon_id'] is not None else 58
+        try:
+            entry = self.kp.add_entry(group, title, item['username'] or '', password, url=item['url'],
+                                      notes=item['notes'] or 'Generated by ansible.', tags=item['tags'], icon=str(icon_id))
+            if entry_uuid is not None:
+                entry.uuid = entry_uuid
+            for key, value in (item['custom_properties'] or {}).items():
+                entry.set_custom_property(key, str(value))
+        except Exception:
+            self.module.fail_json(msg='Could not add the entry.', title=title, exception=traceback.format_exc())
+        self.transaction.uuid_index.add(entry)
+        self.entries(group)[title] = entry
+
+        after = dict(title=title, username=entry.username, password=MASK, url=entry.url, notes=entry.notes,
+                     icon_id=entry.icon, tags=entry.tags or [])
+        if item['custom_properties']:
+            after['custom_properties'] = dict((key, MASK) for key in item['custom_properties'])
+        self.record('create', 'entry', format_path(group.path) + title, entry, after=after)
+        return entry
+
+    def reconcile_entry(self, group, entry, item):
+        old_group = entry.group
+        old_path = format_path(old_group.path) + entry.title
+        before, after = self.update(entry, 'entry', dict(
+            title=item['title'], username=item['username'], password=item['password'], url=item['url'],
+            notes=item['notes'], icon=str(item['icon_id']) if item['icon_id'] is not None else None, tags=item['tags']))
+        properties = dict((key, str(value)) for key, value in (item['custom_properties'] or {}).items()
+                          if entry.get_custom_property(key) != str(value))
+        moved = old_group._element is not group._element
+        if not before and not properties and not moved:
+            return
+
+        entry.save_history()
+        entry.touch(modify=True)
+        for field, value in after.items():
+            setattr(entry, field, value)
+        for key, value in properties.items():
+            entry.set_custom_property(key, value)
+        if moved:
+            self.kp.move_entry(entry, group)
+            self.forget(old_group, group)
+            before['group_path'] = format_path(old_group.path)
+            after['group_path'] = format_path(group.path)
+        elif 'title' in after:
+            self.forget(group)
+        if properties:
+            before['custom_properties'] = dict((key, MASK) for key in properties)
+            after['custom_properties'] = dict((key, MASK) for key in properties)
+
+        fields = [_field(field) for field in before]
+        before, after = _public(before), _public(after)
+        if 'password' in before:
+            before['password'] = after['password'] = MASK
+        self.record('update', 'entry', format_path(group.path) + entry.title, entry, fields=fields,
+                    before=dict(before, path=old_path) if moved else before, after=after)
+
+    # pruning
+
+    def prune(self, root):
+        """Delete everything below ``root`` that was neither matched nor created."""
+        recyclebin = self.kp.recyclebin_group
+        stack = [root]
+        while stack:
+            group = stack.pop()
+            for entry in group.entries:
+                if entry._element not in self.kept:
+                    self.delete(entry, 'entry')
+            for subgroup in group.subgroups:
+                if recyclebin is not None and subgroup._element is recyclebin._element:
+                    continue
+                if subgroup._element in self.kept:
+                    stack.append(subgroup)
+                else:
+                    self.delete(subgroup, 'group')
+
+
+def _field(field):
+    """Name of an attribute of pykeepass the way the options call it."""
+    return 'icon_id' if field == 'icon' else field
+
+def _public(values):
+    return dict((_field(field), value) for field, value in values.items())
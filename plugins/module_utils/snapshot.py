@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+#
+# Author: Tobias Karger und Marie Berger
+# Contact: coding@thepatchwork.de
+# License: The Unlicense, see LICENSE file.
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import base64
+import sys
+import uuid
+
+STRING_FIELDS = {'Title': 'title', 'UserName': 'username', 'Password': 'password', 'URL': 'url', 'Notes': 'notes'}
+
+
+class GroupRecord(object):
+    """Read-only copy of a group, with the attributes of a pykeepass Group that the lookup uses."""
+
+    __slots__ = ('uuid', 'name', 'icon', 'notes', 'path', 'subgroups', 'entries')
+
+    def __init__(self, uuid, name, icon, notes, path):
+        self.uuid = uuid
+        self.name = name
+        self.icon = icon
+        self.notes = notes
+        self.path = path
+        self.subgroups = []
+        self.entries = []
+
+
+class EntryRecord(object):
+    """Read-only copy of an entry, with the attributes of a pykeepass Entry that the lookup uses."""
+
+    __slots__ = ('uuid', 'title', 'username', 'password', 'url', 'notes', 'tags', 'icon', 'group')
+
+    def __init__(self, group):
+        self.uuid = None
+        self.title = None
+        self.username = None
+        self.password = None
+        self.url = None
+        self.notes = None
+        self.tags = []
+        self.icon = None
+        self.group = group
+
+
+ENTRY_DATA_FIELDS = ('title', 'username', 'password', 'url', 'notes', 'tags', 'icon')
+
+
+def _intern(value):
+    return sys.intern(value) if value is not None else None
+
+
+def _text(element, tag):
+    # like pykeepass, an empty element is None rather than ''
+    child = element.find(tag)
+    return child.text if child is not None else None
+
+
+def _uuid(element):
+    text = element.findtext('UUID')
+    return uuid.UUID(bytes=base64.b64decode(text)) if text else None
+
+
+def _hex(value):
+    return value.hex if value is not None else None
+
+
+def _from_hex(value):
+    return uuid.UUID(hex=value) if value is not None else None
+
+
+class DatabaseSnapshot(object):
+    """Compact read-only projection of an opened database.
+
+    The XML tree is walked once and copied into records with ``__slots__``.
+    Names, titles, usernames, URLs, icons and tags are interned, so values
+    repeated across thousands of entries are stored once. The snapshot
+    offers ``root_group`` and ``entries`` like PyKeePass, so the group and
+    entry indexes can be built on it, and holds no reference to the tree,
+    which can be freed together with the PyKeePass object. History entries
+    are not copied.
+    """
+
+    __slots__ = ('root_group', 'entries')
+
+    def __init__(self, kp):
+        self.entries = []
+        root = kp.root_group._element
+        self.root_group = GroupRecord(_uuid(root), _intern(_text(root, 'Name')), _intern(_text(root, 'IconID')), _text(root, 'Notes'), ())
+        # descend into every subgroup where it appears, so entries are collected in document order
+        stack = [(iter(root), self.root_group)]
+        while stack:
+            children, group = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+            elif child.tag == 'Entry':
+                entry = self._entry(child, group)
+                group.entries.append(entry)
+                self.entries.append(entry)
+            elif child.tag == 'Group':
+                name = _intern(_text(child, 'Name'))
+                subgroup = GroupRecord(_uuid(child), name, _intern(_text(child, 'IconID')), _text(child, 'Notes'), group.path + (name,))
+                group.subgroups.append(subgroup)
+                stack.append((iter(child), subgroup))
+
+    @staticmethod
+    def _entry(element, group):
+        entry = EntryRecord(group)
+        for child in element:
+            if child.tag == 'String':
+                field = STRING_FIELDS.get(child.findtext('Key'))
+                # like pykeepass, the first string with a key wins
+                if field is not None and getattr(entry, field) is None:
+                    value = _text(child, 'Value')
+                    setattr(entry, field, value if field in ('password', 'notes') else _intern(value))
+            elif child.tag == 'UUID' and child.text:
+                entry.uuid = uuid.UUID(bytes=base64.b64decode(child.text))
+            elif child.tag == 'IconID':
+                entry.icon = _intern(child.text)
+            elif child.tag == 'Tags' and child.text:
+                entry.tags = [_intern(tag) for tag in child.text.replace(',', ';').split(';')]
+        return entry
+
+    def to_data(self):
+        """Return the snapshot as flat lists that JSON can serialize.
+
+        Groups are listed parents first with the index of their parent,
+        entries in document order with the index of their group. UUIDs are
+        given as hex strings.
+        """
+        groups = []
+        positions = {}
+        stack = [(None, self.root_group)]
+        while stack:
+            parent, group = stack.pop()
+            positions[id(group)] = len(groups)
+            groups.append([parent, _hex(group.uuid), group.name, group.icon, group.notes])
+            stack.extend((positions[id(group)], subgroup) for subgroup in reversed(group.subgroups))
+        entries = [[positions[id(entry.group)], _hex(entry.uuid)] + [getattr(entry, field) for field in ENTRY_DATA_FIELDS]
+                   for entry in self.entries]
+        return dict(groups=groups, entries=entries)
+
+    @classmethod
+    def from_data(cls, data):
+        """Rebuild a snapshot from the output of ``to_data``."""
+        snapshot = cls.__new__(cls)
+        groups = []
+        for parent, group_uuid, name, icon, notes in data['groups']:
+            name = _intern(name)
+            path = groups[parent].path + (name,) if parent is not None else ()
+            group = GroupRecord(_from_hex(group_uuid), name, _intern(icon), notes, path)
+            if parent is not None:
+                groups[parent].subgroups.append(group)
+            groups.append(group)
+        snapshot.root_group = groups[0]
+        snapshot.entries = []
+        for values in data['entries']:
+            group = groups[values[0]]
+            entry = EntryRecord(group)
+            entry.uuid = _from_hex(values[1])
+            for field, value in zip(ENTRY_DATA_FIELDS, values[2:]):
+                setattr(entry, field, value if field in ('password', 'notes', 'tags') else _intern(value))
+            entry.tags = [_intern(tag) for tag in entry.tags or ()]
+            group.entries.append(entry)
+            snapshot.entries.append(entry)
+        return snapshot
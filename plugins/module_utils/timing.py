@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+#
+# Author: Tobias Karger und Marie Berger
+# Contact: coding@thepatchwork.de
+# License: The Unlicense, see LICENSE file.
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import cProfile
+import functools
+import time
+from contextlib import contextmanager
+
+
+class _NullPhase(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class Timings(object):
+    """Wall time spent in the phases of a task, in seconds.
+
+    Phases are timed with ``with timings.phase(name):``. Time spent in a
+    phase nested in another one only counts for the inner phase, so the
+    phases add up to the time measured. A phase entered several times is
+    summed up. Disabled timings measure nothing and cost next to nothing.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.phases = {}
+        self._nested = []
+        self._start = time.perf_counter()
+
+    def phase(self, name):
+        if not self.enabled:
+            return _NULL_PHASE
+        return self._timed(name)
+
+    @contextmanager
+    def _timed(self, name):
+        start = time.perf_counter()
+        self._nested.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = self._nested.pop()
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed - nested
+            if self._nested:
+                self._nested[-1] += elapsed
+
+    def as_dict(self):
+        """Return the phases in the order they were first entered, and the total time since the timings were created."""
+        result = dict((name, round(seconds, 6)) for name, seconds in self.phases.items())
+        result['total'] = round(time.perf_counter() - self._start, 6)
+        return result
+
+
+# Passed where no timings were asked for
+NO_TIMINGS = Timings(enabled=False)
+
+
+@contextmanager
+def profiled(path):
+    """Run the block under cProfile and write the statistics to ``path``, or just run it if ``path`` is empty.
+
+    The dump can be read with ``python -m pstats <path>`` or snakeviz.
+    """
+    if not path:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+
+
+def with_profile(run_module):
+    """Decorate a ``run_module(module, ...)`` function to profile it into the file of the module's 'profile' option."""
+
+    @functools.wraps(run_module)
+    def wrapper(module, *args, **kwargs):
+        with profiled(module.params.get('profile')):
+            return run_module(module, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+#
+# Author: Tobias Karger und Marie Berger
+# Contact: coding@thepatchwork.de
+# License: The Unlicense, see LICENSE file.
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import hashlib
+import os
+import shutil
+import tempfile
+import traceback
+
+from ansible.module_utils.basic import env_fallback
+from ansible_collections.torie_coding.keepass.plugins.module_utils.agent import SOCKET_ENV, notify_agent
+from ansible_collections.torie_coding.keepass.plugins.module_utils.cache import file_stamp
+from ansible_collections.torie_coding.keepass.plugins.module_utils.group_index import GroupIndex
+from ansible_collections.torie_coding.keepass.plugins.module_utils.keys import KEY_CACHE, open_database, unlock
+from ansible_collections.torie_coding.keepass.plugins.module_utils.lock import DatabaseLock, LockTimeout
+from ansible_collections.torie_coding.keepass.plugins.module_utils.timing import NO_TIMINGS, Timings
+from ansible_collections.torie_coding.keepass.plugins.module_utils.uuid_index import UuidIndex
+
+try:
+    import pykeepass.exceptions
+except ImportError:
+    # the modules check for pykeepass themselves and fail with missing_required_lib
+    pass
+
+
+FSYNC_CHOICES = ['always', 'dir', 'never']
+CONCURRENCY_CHOICES = ['lock', 'optimistic', 'none']
+
+
+def atomic_save(kp, database, fsync='always', backup=False, transformed_key=None, warn=None):
+    """Write ``kp`` next to ``database`` and move it into place with one rename.
+
+    The database is never truncated in place, so a killed run leaves either
+    the old or the new file behind. ``fsync`` is ``never``, ``always`` (flush
+    the new file before the rename) or ``dir`` (additionally flush the
+    directory, so the rename itself survives a crash). With ``backup`` the
+    previous file is kept as ``<database>.bak`` through a hard link, which
+    costs no extra I/O, or through a copy where the file system does not
+    support hard links. With a ``transformed_key`` the key derivation is
+    skipped and its salt kept, instead of rotating it.
+
+    Writing the temporary file needs write access to the directory of the
+    database, not only to the file. The new file gets the mode and, where
+    permitted, the owner of the old one. ``warn`` is called with a message
+    if the owner cannot be kept.
+    """
+    database = os.path.realpath(database)
+    directory = os.path.dirname(database)
+    try:
+        st = os.stat(database)
+    except OSError:
+        st = None
+
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(database) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as stream:
+            kp.save(filename=stream, transformed_key=transformed_key)
+            stream.flush()
+            if fsync != 'never':
+                os.fsync(stream.fileno())
+        if st is not None:
+            # mkstemp creates the file with mode 0600, keep what the database had
+            os.chmod(tmp_path, st.st_mode & 0o7777)
+            if (st.st_uid, st.st_gid) != (os.getuid(), os.getgid()):
+                try:
+                    os.chown(tmp_path, st.st_uid, st.st_gid)
+                except OSError as exc:
+                    if warn is not None:
+                        warn("Could not keep the owner {}:{} of {}, it is now owned by {}:{}: {}".format(
+                            st.st_uid, st.st_gid, database, os.getuid(), os.getgid(), exc))
+        if backup and st is not None:
+            backup_path = database + '.bak'
+            if os.path.lexists(backup_path):
+                os.remove(backup_path)
+            try:
+                os.link(database, backup_path)
+            except OSError:
+                shutil.copy2(database, backup_path)
+        os.replace(tmp_path, database)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    if fsync == 'dir':
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+class KeePassTransaction(object):
+    """Opened database whose mutations are written to disk once, on commit.
+
+    Operations are functions taking the transaction as first argument and
+    returning a result dict with a ``changed`` key. They only change the
+    in-memory tree, which is saved exactly once by ``commit()`` if any of
+    them reported a change. Nothing is written in check mode, and nothing is
+    written when the module fails before committing. The file is replaced
+    atomically, see ``atomic_save``.
+
+    ``concurrency`` decides how parallel writers of the same database are
+    kept from overwriting each other:
+
+    - ``lock`` holds the database lock from opening to saving, so writers
+      run their read-modify-save cycles one after the other.
+    - ``optimistic`` only holds it while saving. If the file changed since
+      it was opened, it is read again and all operations are replayed on the
+      new content before it is saved, so the other writer's changes are kept.
+    - ``none`` does not lock at all and the last writer wins.
+
+    With a ``cache`` (a DatabaseCache) the opened database is taken from and
+    kept in it, so later transactions in the same process skip unlocking it.
+    A cached copy that was changed but not saved is dropped from the cache.
+    The optimistic mode always reads the file itself.
+
+    With a ``key_cache`` (a KeyCache) the transformed key is taken from it
+    when opening, and the database is saved with the same key, so the salt
+    of the key derivation stays the same and the key stays valid.
+
+    With ``timings`` (a Timings) locking, reading, key derivation, parsing,
+    building the group and UUID indexes, applying operations, replaying and
+    saving are timed as phases.
+
+    Use the transaction as a context manager. Leaving it releases the lock
+    on every path, also when ``fail_json`` exits the module, which inside
+    the action plugin does not end the process.
+    """
+
+    def __init__(self, module, database, password=None, keyfile=None, agent_socket=None, fsync='always', backup=False,
+                 concurrency='none', lock_timeout=60, cache=None, key_cache=None, timings=NO_TIMINGS):
+        self.module = module
+        self.database = database
+        self.password = password
+        self.keyfile = keyfile
+        self.agent_socket = agent_socket
+        self.fsync = fsync
+        self.backup = backup
+        self.concurrency = concurrency
+        self.lock = DatabaseLock(database, timeout=lock_timeout)
+        self.cache = cache if concurrency != 'optimistic' else None
+        self.key_cache = key_cache
+        self.timings = timings
+        self.changed = False
+        self.operations = []
+        self._group_index = None
+        self._uuid_index = None
+        self._stamp = None
+        # check mode never writes and saving replaces the file atomically, so readers need no lock
+        if concurrency == 'lock' and not module.check_mode:
+            self.acquire_lock()
+        try:
+            self.kp = self.open()
+        except BaseException:
+            self.lock.release()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is not None:
+            self.discard()
+        self.lock.release()
+
+    def acquire_lock(self):
+        try:
+            with self.timings.phase('lock'):
+                self.lock.acquire()
+        except LockTimeout as exc:
+            self.module.fail_json(msg=str(exc))
+        except (IOError, OSError) as exc:
+            self.module.fail_json(msg='Could not lock the database: {}'.format(exc))
+
+    def open(self):
+        if not self.password and not self.keyfile:
+            self.module.fail_json(msg="Either 'database_password' or 'keyfile' (or both) are required.")
+        try:
+            if self.cache is not None:
+                return self.cache.get(self.database, self.password, self.keyfile, self._open_file)[0]
+            if self.concurrency != 'optimistic':
+                return self._open_file()
+            # parse exactly the bytes the stamp was taken from
+            with self.timings.phase('read'), open(self.database, 'rb') as stream:
+                st = os.fstat(stream.fileno())
+                data = stream.read()
+            self._stamp = ((st.st_ino, st.st_size, st.st_mtime_ns), hashlib.sha256(data).digest())
+            return unlock(data, self.password, self.keyfile, key_cache=self.key_cache, timings=self.timings)
+        except IOError:
+            self.module.fail_json(msg='Could not open the database or keyfile.')
+        except pykeepass.exceptions.CredentialsError:
+            self.module.fail_json(msg='Could not open the database, as the credentials are wrong.')
+        except (pykeepass.exceptions.HeaderChecksumError, pykeepass.exceptions.PayloadChecksumError):
+            self.module.fail_json(msg='Could not open the database, as the checksum of the database is wrong. This could be caused by a corrupt database.')
+
+    def _open_file(self):
+        return open_database(self.database, self.password, self.keyfile, key_cache=self.key_cache, timings=self.timings)
+
+    def discard(self):
+        """Drop the cached copy, whose in-memory changes were not saved."""
+        if self.cache is not None:
+            self.cache.invalidate(self.database)
+
+    def modified_on_disk(self):
+        """Whether the database file differs from the one that was opened."""
+        stat_stamp, digest = self._stamp
+        if file_stamp(self.database) == stat_stamp:
+            return False
+        with open(self.database, 'rb') as stream:
+            return hashlib.sha256(stream.read()).digest() != digest
+
+    @property
+    def group_index(self):
+        if self._group_index is None:
+            with self.timings.phase('group_index'):
+                self._group_index = GroupIndex(self.kp)
+        return self._group_index
+
+    @property
+    def uuid_index(self):
+        if self._uuid_index is None:
+            with self.timings.phase('uuid_index'):
+                self._uuid_index = UuidIndex(self.kp)
+        return self._uuid_index
+
+    def execute(self, operation, *args):
+        """Apply ``operation(self, *args)`` to the in-memory database and record it."""
+        with self.timings.phase('apply'):
+            result = operation(self, *args)
+        self.operations.append((operation, args, result))
+        if result.get('changed'):
+            self.changed = True
+        return result
+
+    def replay(self):
+        """Reopen the database and apply all recorded operations to its current content.
+
+        The result dicts handed out by ``execute()`` are updated in place.
+        """
+        self.kp = self.open()
+        self._group_index = None
+        self._uuid_index = None
+        self.changed = False
+        for operation, args, result in self.operations:
+            new_result = operation(self, *args)
+            result.clear()
+            result.update(new_result)
+            if result.get('changed'):
+                self.changed = True
+
+    def commit(self):
+        """Save the database once if anything changed. Returns whether it was written."""
+        try:
+            if not self.changed:
+                return False
+            if self.module.check_mode:
+                self.discard()
+                return False
+            if self.concurrency == 'optimistic':
+                self.acquire_lock()
+                if self.modified_on_disk():
+                    with self.timings.phase('replay'):
+                        self.replay()
+                    if not self.changed:
+                        return False
+            try:
+                with self.timings.phase('save'):
+                    atomic_save(self.kp, self.database, fsync=self.fsync, backup=self.backup,
+                                transformed_key=self.kp.transformed_key if self.key_cache is not None else None,
+                                warn=self.module.warn)
+            except Exception:
+                self.discard()
+                self.module.fail_json(msg='Could not save the database.', exception=traceback.format_exc())
+            if self.cache is not None:
+                self.cache.restamp(self.database, self.password, self.keyfile)
+        finally:
+            self.lock.release()
+        notify_agent(self.agent_socket, self.database)
+        return True
+
+
+def transaction_argument_spec():
+    """Return the argument spec of the options of every module that opens the database through a transaction.
+
+    They are documented by the doc fragment ``torie_coding.keepass.transaction``.
+    """
+    return dict(
+        database=dict(type='str', required=True),
+        keyfile=dict(type='str', required=False, default=None),
+        database_password=dict(type='str', required=False, default=None, no_log=True),
+        agent_socket=dict(type='str', required=False, fallback=(env_fallback, [SOCKET_ENV])),
+        save_fsync=dict(type='str', required=False, default='always', choices=FSYNC_CHOICES),
+        backup=dict(type='bool', required=False, default=False),
+        concurrency=dict(type='str', required=False, default='none', choices=CONCURRENCY_CHOICES),
+        lock_timeout=dict(type='int', required=False, default=60),
+        key_cache=dict(type='bool', required=False, default=False),
+        key_cache_ttl=dict(type='int', required=False, default=300),
+        timings=dict(type='bool', required=False, default=False),
+        profile=dict(type='path', required=False),
+    )
+
+
+def open_transaction(module, cache=None, **overrides):
+    """Open a KeePassTransaction with the options of ``transaction_argument_spec`` in ``module.params``.
+
+    ``overrides`` replace single keyword arguments of KeePassTransaction.
+    The timings of the transaction are enabled with the option ``timings``.
+    """
+    params = module.params
+    key_cache = None
+    if params['key_cache']:
+        key_cache = KEY_CACHE.with_ttl(params['key_cache_ttl'])
+    kwargs = dict(
+        password=params['database_password'],
+        keyfile=params['keyfile'],
+        agent_socket=params['agent_socket'],
+        fsync=params['save_fsync'],
+        backup=params['backup'],
+        concurrency=params['concurrency'],
+        lock_timeout=params['lock_timeout'],
+        cache=cache,
+        key_cache=key_cache,
+        timings=Timings() if params['timings'] else NO_TIMINGS,
+    )
+    kwargs.update(overrides)
+    return KeePassTransaction(module, params['database'], **kwargs)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+#
+# Author: Tobias Karger und Marie Berger
+# Contact: coding@thepatchwork.de
+# License: The Unlicense, see LICENSE file.
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import base64
+import binascii
+import uuid
+
+from ansible_collections.torie_coding.keepass.plugins.module_utils.snapshot import GroupRecord
+
+try:
+    from pykeepass.entry import Entry
+    from pykeepass.group import Group
+except ImportError:
+    # the plugins check for pykeepass themselves
+    pass
+
+
+def parse_uuid(value):
+    """Return ``value`` as a uuid.UUID.
+
+    Accepts the 32 hex digits with or without dashes and braces, as shown by
+    KeePassXC and returned by this collection, and the base64 form KeePass
+    stores in the XML. Raises ValueError for anything else.
+    """
+    if isinstance(value, uuid.UUID):
+        return value
+    value = str(value).strip()
+    try:
+        return uuid.UUID(value)
+    except ValueError:
+        pass
+    try:
+        raw = base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        raw = b''
+    if len(raw) != 16:
+        raise ValueError("'{}' is not a UUID".format(value))
+    return uuid.UUID(bytes=raw)
+
+
+def format_uuid(value):
+    """Format the UUID of a group or entry the way results report it."""
+    return str(value) if value is not None else None
+
+
+class UuidIndex(object):
+    """Dictionary index of the UUIDs of all groups and entries to their elements.
+
+    The tree is walked once when the index is built, resolving a UUID is a
+    single dict lookup afterwards. ``kp`` is a PyKeePass object or a
+    DatabaseSnapshot. History entries are not indexed. Objects deleted after
+    the index was built are not found any more, objects added afterwards
+    only if they are registered with ``add``.
+    """
+
+    def __init__(self, kp):
+        self.kp = kp
+        self._items = {}
+        if isinstance(kp.root_group, GroupRecord):
+            stack = [kp.root_group]
+            while stack:
+                group = stack.pop()
+                self._items[group.uuid] = group
+                stack.extend(group.subgroups)
+            for entry in kp.entries:
+                self._items[entry.uuid] = entry
+            return
+
+        for element in kp.root_group._element.iter('Group', 'Entry'):
+            if element.getparent().tag == 'History':
+                continue
+            text = element.findtext('UUID')
+            if text:
+                self._items[uuid.UUID(bytes=base64.b64decode(text))] = element
+
+    def find(self, value, kind=None):
+        """Return the group or entry with the UUID ``value``, or None.
+
+        With ``kind`` ('group' or 'entry') objects of the other kind are not
+        returned.
+        """
+        item = self._items.get(parse_uuid(value))
+        if item is None:
+            return None
+        if isinstance(item, GroupRecord):
+            found = 'group'
+        elif not hasattr(item, 'tag'):
+            found = 'entry'
+        else:
+            if item.getroottree().getroot() is not self.kp.tree.getroot():
+                # deleted, alone or with one of its parents, since the index was built
+                return None
+            found = item.tag.lower()
+            item = Group(element=item, kp=self.kp) if found == 'group' else Entry(element=item, kp=self.kp)
+        if kind is not None and found != kind:
+            return None
+        return item
+
+    def add(self, item):
+        """Register a group or entry added after the index was built."""
+        self._items[item.uuid] = getattr(item, '_element', item)
+
+    def __len__(self):
+        return len(self._items)
@@ -0,0 +1,264 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Author: Tobias Karger und Marie Berger
+# Contact: coding@thepatchwork.de
+# License: The Unlicense, see LICENSE file.
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import os
+import time
+import traceback
+
+from ansible.module_utils.basic import AnsibleModule, missing_required_lib, env_fallback
+from ansible_collections.torie_coding.keepass.plugins.module_utils.agent import (
+    SOCKET_ENV,
+    AgentClient,
+    AgentError,
+    AgentUnavailable,
+    KeePassAgent,
+    default_socket_path,
+)
+
+PYKEEPASS_IMP_ERR = None
+try:
+    import pykeepass.exceptions
+except ImportError:
+    PYKEEPASS_IMP_ERR = traceback.format_exc()
+    pykeepass_found = False
+else:
+    pykeepass_found = True
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.1',
+    'status': ['preview'],
+    'supported_by': 'community'
+}
+
+DOCUMENTATION = '''
+---
+module: agent
+short_description: Start or stop a local agent that keeps KeePass databases unlocked.
+version_added: "1.4.0"
+description:
+    - "This module starts or stops a long-lived local process that keeps KeePass (kdbx) databases unlocked in memory."
+    - "The lookup plugin answers searches through the agent when it listens on the configured socket, so the key derivation and the XML parsing
+      only happen once for all playbook runs on the host."
+    - "The entry and group modules tell the agent when they wrote a database, so it drops its copy right away."
+    - "The socket is created with mode 0600 in a directory only the current user can access. Connections of other users are refused."
+    - "Databases changed on disk are reopened on the next request."
+requirements:
+    - PyKeePass
+options:
+    state:
+        description:
+            - Whether the agent should be running.
+        required: false
+        default: started
+        choices: ['started', 'stopped']
+        type: str
+    socket:
+        description:
+            - Path of the agent socket. Its directory is created with mode 0700 and has to be private to the current user.
+            - Defaults to the environment variable KEEPASS_AGENT_SOCKET, or C($XDG_RUNTIME_DIR/keepass-agent-<uid>/agent.sock), or the same below the temp directory.
+        required: false
+        type: str
+    databases:
+        description:
+            - Databases to unlock right after the agent was started.
+        required: false
+        type: list
+        elements: dict
+        suboptions:
+            database:
+                description: Path of the KeePass database.
+                required: true
+                type: str
+            database_password:
+                description: Database password. Either this or 'keyfile' (or both) are required.
+                type: str
+            keyfile:
+                description: Path of the KeePass keyfile. Either this or 'database_password' (or both) are required.
+                type: str
+    idle_timeout:
+        description:
+            - Stop the agent after this many seconds without requests. 0 keeps it running until it is stopped.
+        required: false
+        default: 0
+        type: int
+    cache_ttl:
+        description:
+            - Seconds after which an unlocked database is dropped. 0 keeps it as long as the agent runs.
+        required: false
+        default: 0
+        type: int
+    snapshot:
+        description:
+            - Keep compact read-only snapshots of the unlocked databases instead of the XML trees of pykeepass, which take a multiple of the memory for large vaults.
+        required: false
+        default: false
+        type: bool
+    key_cache:
+        description:
+            - Keep the keys derived from the credentials in locked memory, so a database that changed on disk is reopened without the slow key derivation.
+            - The key stays valid as long as the salt of the key derivation is unchanged, which is the case when the writing tasks set O(torie_coding.keepass.entry#module:key_cache) as well.
+            - Keys are overwritten when they expire and when the agent stops.
+        required: false
+        default: false
+        type: bool
+    key_cache_ttl:
+        description:
+            - Seconds after which a key kept by O(key_cache) is wiped. 0 keeps it as long as the agent runs.
+        required: false
+        default: 300
+        type: int
+author:
+    - Tobias Karger und Marie Berger
+'''
+
+EXAMPLES = '''
+- name: Start the agent on the controller and unlock the vault
+  torie_coding.keepass.agent:
+    state: started
+    idle_timeout: 3600
+    databases:
+      - database: /path/to/KeePass_database.kdbx
+        database_password: "your_database_password"
+  delegate_to: localhost
+  run_once: true
+
+- name: Lookups are now answered by the agent
+  debug:
+    msg: "{{ lookup('torie_coding.keepass.lookup', 'entry', database='/path/to/KeePass_database.kdbx', database_password='your_database_password', title='My Entry') }}"
+
+- name: Stop the agent
+  torie_coding.keepass.agent:
+    state: stopped
+  delegate_to: localhost
+  run_once: true
+'''
+
+RETURN = '''
+socket:
+    description: Path of the agent socket.
+    type: str
+pid:
+    description: Process ID of the running agent. Not returned if the agent was stopped.
+    type: int
+changed:
+    description: Indicates whether the agent was started or stopped.
+    type: bool
+'''
+
+
+def main():
+    module_args = dict(
+        state=dict(type='str', required=False, default='started', choices=['started', 'stopped']),
+        socket=dict(type='str', required=False, fallback=(env_fallback, [SOCKET_ENV])),
+        databases=dict(
+            type='list',
+            elements='dict',
+            required=False,
+            options=dict(
+                database=dict(type='str', required=True),
+                database_password=dict(type='str', required=False, no_log=True),
+                keyfile=dict(type='str', required=False),
+            ),
+        ),
+        idle_timeout=dict(type='int', required=False, default=0),
+        cache_ttl=dict(type='int', required=False, default=0),
+        snapshot=dict(type='bool', required=False, default=False),
+        key_cache=dict(type='bool', required=False, default=False),
+        key_cache_ttl=dict(type='int', required=False, default=300),
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+    if not pykeepass_found:
+        module.fail_json(msg=missing_required_lib("pykeepass"), exception=PYKEEPASS_IMP_ERR)
+
+    socket_path = os.path.abspath(module.params['socket'] or default_socket_path())
+    client = AgentClient(socket_path, timeout=10)
+    pid = agent_pid(client)
+    changed = False
+
+    if module.params['state'] == 'stopped':
+        if pid is not None:
+            changed = True
+            if not module.check_mode:
+                client.request('stop')
+                wait_for(lambda: not client.present())
+        module.exit_json(changed=changed, socket=socket_path)
+
+    if pid is None:
+        changed = True
+        if module.check_mode:
+            module.exit_json(changed=changed, socket=socket_path)
+        start_agent(module, socket_path)
+        if not wait_for(lambda: agent_pid(client) is not None):
+            module.fail_json(msg='The agent did not come up on {}'.format(socket_path))
+        pid = agent_pid(client)
+
+    for item in module.params['databases'] or []:
+        if not item['database_password'] and not item['keyfile']:
+            module.fail_json(msg="Either 'database_password' or 'keyfile' (or both) are required.", database=item['database'])
+        if module.check_mode:
+            continue
+        try:
+            client.request(
+                'open',
+                database=os.path.abspath(item['database']),
+                password=item['database_password'],
+                keyfile=os.path.abspath(item['keyfile']) if item['keyfile'] else None,
+            )
+        except AgentError as exc:
+            module.fail_json(msg=str(exc), database=item['database'])
+
+    module.exit_json(changed=changed, socket=socket_path, pid=pid)
+
+def agent_pid(client):
+    try:
+        return client.request('ping')['pid']
+    except (AgentUnavailable, AgentError, ValueError):
+        return None
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.1)
+    return False
+
+def start_agent(module, socket_path):
+    """Double-fork the agent, so it outlives the module and leaves no zombie behind."""
+    agent = KeePassAgent(socket_path, idle_timeout=module.params['idle_timeout'], cache_ttl=module.params['cache_ttl'],
+                         snapshot=module.params['snapshot'],
+                         key_cache_ttl=module.params['key_cache_ttl'] if module.params['key_cache'] else None)
+    pid = os.fork()
+    if pid:
+        os.waitpid(pid, 0)
+        return
+
+    os.setsid()
+    if os.fork():
+        os._exit(0)
+    os.chdir('/')
+    # release the module's output pipes, ansible waits for them to close
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+    try:
+        agent.serve()
+    finally:
+        os._exit(0)
+
+if __name__ == '__main__':
+    main()
@@ -12,10 +12,14 @@ import traceback
 __metaclass__ = type
 
 from ansible.module_utils.basic import AnsibleModule, missing_required_lib
+from ansible_collections.torie_coding.keepass.plugins.module_utils.group_index import format_path, split_path
+from ansible_collections.torie_coding.keepass.plugins.module_utils.password import generate_password
+from ansible_collections.torie_coding.keepass.plugins.module_utils.timing import with_profile
+from ansible_collections.torie_coding.keepass.plugins.module_utils.transaction import open_transaction, transaction_argument_spec
+from ansible_collections.torie_coding.keepass.plugins.module_utils.uuid_index import format_uuid, parse_uuid
 
 PYKEEPASS_IMP_ERR = None
 try:
-    from pykeepass import PyKeePass
     import pykeepass.exceptions
 except ImportError:
     PYKEEPASS_IMP_ERR = traceback.format_exc()
@@ -39,36 +43,32 @@ description:
 requirements:
     - PyKeePass
 options:
-    database:
-        description:
-            - Path of the KeePass database.
-        required: true
-        type: str
     title:
         description:
             - Title, used for the title of the entry.
+            - Identifies the entry in 'group_path' unless 'uuid' is given. Either this or 'uuid' is required.
         required: false
         type: str
-    keyfile:
+    uuid:
         description:
-            - Path of the KeePass keyfile. Either this or 'database_password' (or both) are required.
+            - UUID of the entry, as every result returns it. The entry is then found through an index of all UUIDs instead of by title, so it is still found after it was renamed or moved.
+            - With action C(create), an entry with this UUID is left alone, otherwise the new entry gets it.
+            - With action C(modify), a different 'title' renames the entry.
+            - Accepts the 32 hex digits with or without dashes, or the base64 form of the KeePass XML.
         required: false
         type: str
+        version_added: "1.4.0"
     username:
         description:
-            - Username of the entry.
-        required: true
+            - Username of the entry. Required for action 'create'.
+            - Either this, 'uuid' or 'entries' is required.
+        required: false
         type: str
     password:
         description:
             - Password to be set.
         required: false
         type: str
-    database_password:
-        description:
-            - Database password. Either this or 'keyfile' (or both) are required.
-        required: false
-        type: str
     password_length:
         description:
             - The length of the generated passwords. Defaults to 20 characters.
@@ -93,16 +93,59 @@ options:
         type: str
     icon_id:
         description:
-            - Icon ID to be associated with the entry.
+            - Icon ID to be associated with the entry. Created entries get icon 58 if it is not given, modified entries keep their icon.
         required: false
         type: int
-        default: 58
     action:
         description:
             - The action to perform (create, modify, delete).
-        required: true
+            - Required unless every item of 'entries' sets its own action.
+            - C(modify) only changes the fields that differ. If none differs, the entry, its history and the database are left alone and the task reports no change.
+        required: false
         choices: ['create', 'modify', 'delete']
         type: str
+    entries:
+        description:
+            - List of entries to manage in a single run. The database is opened once, every item is applied to it and it is saved only once at the end.
+            - Options not set on an item fall back to the top-level option of the same name.
+            - Mutually exclusive with 'title'.
+        required: false
+        type: list
+        elements: dict
+        suboptions:
+            title:
+                description: Title of the entry. Either this or 'uuid' is required.
+                type: str
+            uuid:
+                description: UUID of the entry, see the top-level option 'uuid'. Does not fall back to it.
+                type: str
+            username:
+                description: Username of the entry.
+                type: str
+            password:
+                description: Password to be set.
+                type: str
+            password_length:
+                description: The length of the generated password.
+                type: int
+            url:
+                description: URL of the entry.
+                type: str
+            notes:
+                description: Notes for the entry.
+                type: str
+            group_path:
+                description: Group path in which to place the entry.
+                type: str
+            icon_id:
+                description: Icon ID to be associated with the entry.
+                type: int
+            action:
+                description: The action to perform for this entry (create, modify, delete).
+                choices: ['create', 'modify', 'delete']
+                type: str
+extends_documentation_fragment:
+    - torie_coding.keepass.transaction
 author:
     - Tobias Karger und Marie Berger
 '''
@@ -148,6 +191,25 @@ EXAMPLES = '''
     group_path: foo/bar
   register: entry
 
+- debug:
+    var: entry
+
+- name: Manage several entries with one open and one save of the database
+  torie_coding.keepass.entry:
+    action: create
+    database: /path/to/KeePass_database.kdbx
+    database_password: "your_database_password"
+    group_path: services
+    entries:
+      - title: service-a
+        username: svc-a
+      - title: service-b
+        username: svc-b
+        password_length: 32
+      - title: legacy-service
+        action: delete
+  register: entry
+
 - debug:
     var: entry
 '''
@@ -156,6 +218,9 @@ RETURN = '''
 title:
     description: The title of the entry created or modified.
     type: str
+uuid:
+    description: The UUID of the entry, as 32 hex digits with dashes.
+    type: str
 icon_id:
     description: The Icon ID associated with the entry.
     type: str
@@ -177,107 +242,171 @@ notes:
 changed:
     description: Indicates whether a change was made to the entry.
     type: bool
+entries:
+    description:
+        - Results of every item of 'entries', in the same order. Each item has the same keys as a single run returns.
+        - Only returned when 'entries' is given.
+    type: list
+    elements: dict
+timings:
+    description:
+        - Seconds spent in the phases of the task, only returned with O(timings).
+        - The phases are C(lock), C(read), C(kdf) (key derivation), C(parse) (decrypting and parsing the XML), C(group_index), C(find_entries), C(apply) (applying the changes in memory), C(replay) and C(save). Phases that did not run are left out, C(total) is the time from opening the database until the result was returned.
+    type: dict
 '''
 
 
-def main():
+ENTRY_OPTIONS = ['title', 'username', 'password', 'password_length', 'url', 'notes', 'group_path', 'icon_id', 'action']
+
+
+def module_spec():
+    """Return the keyword arguments of AnsibleModule, the action plugin validates with them too."""
     # define available arguments/parameters a user can pass to the module
-    module_args = dict(
-        database=dict(type='str', required=True),
+    module_args = transaction_argument_spec()
+    module_args.update(
         title=dict(type='str', required=False),
-        keyfile=dict(type='str', required=False, default=None),
-        database_password=dict(type='str', required=False, default=None, no_log=True),
+        uuid=dict(type='str', required=False),
         password=dict(type='str', required=False, default=None, no_log=True),
         password_length=dict(type='int', required=False, no_log=False),
-        username=dict(type='str', required=True),
+        username=dict(type='str', required=False),
         url=dict(type='str', required=False),
         group_path=dict(type='str', required=False),
         icon_id=dict(type='int', required=False),
         notes=dict(type='str', required=False),
-        action=dict(type='str', required=True),
-
+        action=dict(type='str', required=False),
+        entries=dict(
+            type='list',
+            elements='dict',
+            required=False,
+            options=dict(
+                title=dict(type='str', required=False),
+                uuid=dict(type='str', required=False),
+                username=dict(type='str', required=False),
+                password=dict(type='str', required=False, no_log=True),
+                password_length=dict(type='int', required=False, no_log=False),
+                url=dict(type='str', required=False),
+                notes=dict(type='str', required=False),
+                group_path=dict(type='str', required=False),
+                icon_id=dict(type='int', required=False),
+                action=dict(type='str', required=False, choices=['create', 'modify', 'delete']),
+            ),
+        ),
     )
 
-    # seed the result dict in the object
-    # we primarily care about changed and state
-    # change is if this module effectively modified the target
-    # state will include any data that you want your module to pass back
-    # for consumption, for example, in a subsequent task
-    result = dict(
-        changed=False,
-        username='',
-        password='',
-        url=''
+    return dict(
+        argument_spec=module_args,
+        mutually_exclusive=[('title', 'entries'), ('uuid', 'entries')],
+        required_one_of=[('username', 'uuid', 'entries')],
+        supports_check_mode=True
     )
 
+def main():
     # the AnsibleModule object will be our abstraction working with Ansible
     # this includes instantiation, a couple of common attr would be the
     # args/params passed to the execution, as well as if the module
     # supports check mode
-    module = AnsibleModule(
-        argument_spec=module_args,
-        supports_check_mode=True
-    )
+    module = AnsibleModule(**module_spec())
+    run_module(module)
 
+@with_profile
+def run_module(module, cache=None):
+    """Manage the entries of the database and exit the module.
+
+    ``module`` is an AnsibleModule, or the stand-in of the action plugin when
+    the task runs on the controller. ``cache`` keeps the database unlocked
+    between calls in the same process.
+    """
     if not pykeepass_found:
         module.fail_json(msg=missing_required_lib("pykeepass"), exception=PYKEEPASS_IMP_ERR)
 
-    database                = module.params['database']
-    title                   = module.params['title']
-    keyfile                 = module.params['keyfile']
-    database_password       = module.params['database_password']
-    password                = module.params['password']
-    password_length         = module.params['password_length']
-    username                = module.params['username']
-    url                     = module.params['url']
-    group_path              = module.params['group_path']
-    icon_id                 = module.params['icon_id']
-    action                  = module.params['action']
-    notes                   = module.params['notes']
+    entries                 = module.params['entries']
 
-    if password and password_length:
-        module.fail_json(msg="'password' and 'password_length' are defined. Only one is allowed")
-
-    if not database_password and not keyfile:
-        module.fail_json(msg="Either 'database_password' or 'keyfile' (or both) are required.")
-
-    try:
-        kp = PyKeePass(database, password=database_password, keyfile=keyfile)
-    except IOError:
-        KEEPASS_OPEN_ERR = traceback.format_exc()
-        module.fail_json(msg='Could not open the database or keyfile.')
-    except pykeepass.exceptions.CredentialsError:
-        KEEPASS_OPEN_ERR = traceback.format_exc()
-        module.fail_json(msg='Could not open the database, as the credentials are wrong.')
-    except (pykeepass.exceptions.HeaderChecksumError, pykeepass.exceptions.PayloadChecksumError):
-        KEEPASS_OPEN_ERR = traceback.format_exc()
-        module.fail_json(msg='Could not open the database, as the checksum of the database is wrong. This could be caused by a corrupt database.')
-
-    if icon_id is not None:
-        if icon_id > 68:
-            module.fail_json(msg='Icon_id out of range. Choose a value between 0 and 68', exception=traceback.format_exc())
-    else:
-        icon_id = 58
+    with open_transaction(module, cache=cache) as transaction:
+        if entries is None:
+            result = transaction.execute(manage_entry, module.params)
+        else:
+            # every item falls back to the top-level value of an option it does not set
+            results = []
+            for item in entries:
+                params = dict((key, module.params[key]) for key in ENTRY_OPTIONS)
+                params.update((key, value) for key, value in item.items() if value is not None)
+                results.append(transaction.execute(manage_entry, params))
+
+        # all items were applied to the in-memory database, write it only once
+        transaction.commit()
+
+    if entries is not None:
+        # after a replay on a database changed by another task the results may differ
+        result = dict(
+            changed=any(item_result['changed'] for item_result in results),
+            entries=results
+        )
+
+    if transaction.timings.enabled:
+        result['timings'] = transaction.timings.as_dict()
+    module.exit_json(**result)
+
+def manage_entry(transaction, params):
+    """Apply a single create/modify/delete to the opened database and return its result.
+
+    The database is only changed in memory, saving is left to the transaction.
+    """
+    module                  = transaction.module
+    kp                      = transaction.kp
+    title                   = params['title']
+    password                = params['password']
+    password_length         = params['password_length']
+    username                = params['username']
+    url                     = params['url']
+    group_path              = params['group_path']
+    icon_id                 = params['icon_id']
+    action                  = params['action']
+    notes                   = params['notes']
+    entry_uuid              = params.get('uuid')
+
+    if not action:
+        module.fail_json(msg="'action' is required, either for the module or for every item of 'entries'.", title=title)
 
-    if not group_path:
-        directory_list = []
-    else:
-        # remove slashes at the beginning, the end and dobble slashes, that will cause problems
-        directory_list = group_path.split("/")
-        for idx, dir in enumerate(directory_list):
-            if dir == "":
-                directory_list.pop(idx)
-    group = kp.find_groups(path=directory_list, first=True)
-    if group is None:
-        module.fail_json(msg='Group does not exist', exception=traceback.format_exc())
+    if password and password_length:
+        module.fail_json(msg="'password' and 'password_length' are defined. Only one is allowed", title=title)
+
+    if icon_id is not None and icon_id > 68:
+        module.fail_json(msg='Icon_id out of range. Choose a value between 0 and 68', title=title)
+
+    if entry_uuid:
+        try:
+            entry_uuid = parse_uuid(entry_uuid)
+        except ValueError as exc:
+            module.fail_json(msg=str(exc), title=title)
+    elif not title:
+        module.fail_json(msg="Either 'title' or 'uuid' is required.")
+
+    # an entry addressed by its UUID only needs a group to be created in
+    directory_list = split_path(group_path)
+    group = None
+    if not entry_uuid or action.lower() == "create":
+        group = transaction.group_index.find(directory_list)
+        if group is None:
+            module.fail_json(msg='Group does not exist', title=title)
+
+    def find_entry():
+        with transaction.timings.phase('find_entries'):
+            if entry_uuid:
+                return transaction.uuid_index.find(entry_uuid, 'entry')
+            return kp.find_entries(title=title, group=group, recursive=False, first=True)
 
     if action.lower() == "create":
         # try to get the entry from the database
-        entry = kp.find_entries(title=title, group=group, recursive=False, first=True)
+        entry = find_entry()
         if entry:
-            if entry.title == title:
-                result = set_result(entry, False)
-                module.exit_json(**result)
+            if entry_uuid or entry.title == title:
+                return set_result(entry, False)
+
+        if not username:
+            module.fail_json(msg="Action 'create' requires 'username'.", title=title)
+
+        if not title:
+            module.fail_json(msg="Action 'create' requires 'title'.")
 
         # if there is no matching entry, create a new one
         if not password:
@@ -286,77 +415,62 @@ def main():
             else:
                 password = generate_password(20)
 
-        if not module.check_mode:
-            try:
-                kp.add_entry(group, title, username, password, url=url, icon=str(icon_id), notes=notes or 'Generated by ansible.')
-                kp.save()
-            except:
-                KEEPASS_SAVE_ERR = traceback.format_exc()
-                module.fail_json(msg='Could not add the entry or save the database.', exception=KEEPASS_SAVE_ERR)
-
-        entry = kp.find_entries(title=title, group=group, recursive=False, first=True)
+        try:
+            entry = kp.add_entry(group, title, username, password, url=url, icon=str(icon_id if icon_id is not None else 58),
+                                 notes=notes or 'Generated by ansible.')
+            if entry_uuid:
+                entry.uuid = entry_uuid
+                transaction.uuid_index.add(entry)
+        except Exception:
+            KEEPASS_SAVE_ERR = traceback.format_exc()
+            module.fail_json(msg='Could not add the entry.', title=title, exception=KEEPASS_SAVE_ERR)
 
-        result = set_result(entry, True)
-        module.exit_json(**result)
+        return set_result(entry, True)
 
     elif action.lower() == "modify":
         # try to get the entry from the database
-        entry = kp.find_entries(title=title, group=group, recursive=False, first=True)
+        entry = find_entry()
         if entry is None:
-            module.fail_json(msg='No entry found in Database', exception=traceback.format_exc())
-        else:
-            entry.save_history()
-            entry.touch(modify=True)
-            kp.save()
-            if not password:
-                if password_length:
-                    entry.password = generate_password(password_length)
-            else:
-                entry.password = password
-
-            if username:
-                entry.username = username
-
-            if url:
-                entry.url = url
-
-            if notes:
-                entry.notes = notes
-
-            if icon_id:
-                entry.icon = str(icon_id)
-
-            kp.save()
-
-        result = set_result(entry, True)
-        module.exit_json(**result)
+            module.fail_json(msg='No entry found in Database', title=title)
+
+        desired = dict(username=username, url=url, notes=notes)
+        if password:
+            desired['password'] = password
+        elif password_length:
+            desired['password'] = generate_password(password_length)
+        if entry_uuid:
+            desired['title'] = title
+        if icon_id is not None:
+            desired['icon'] = str(icon_id)
+
+        # only touch the entry and its history if a field really differs, so a re-run changes nothing
+        changes = dict((field, value) for field, value in desired.items() if value and getattr(entry, field) != value)
+        if not changes:
+            return set_result(entry, False)
+
+        entry.save_history()
+        entry.touch(modify=True)
+        for field, value in changes.items():
+            setattr(entry, field, value)
+
+        return set_result(entry, True)
 
     elif action.lower() == "delete":
-        entry = kp.find_entries(title=title, group=group, recursive=False, first=True)
+        entry = find_entry()
         if entry is None:
-            module.fail_json(msg='No entry found in Database', exception=traceback.format_exc())
-        else:
-            kp.delete_entry(entry=entry)
-            kp.save()
-            module.exit_json(changed=True)
+            module.fail_json(msg='No entry found in Database', title=title)
 
-    else:
-        module.fail_json(msg='No action matched', exception=traceback.format_exc())
-
-def generate_password(length):
-    import string
-    alphabet = string.ascii_letters + string.digits
-    try:
-        import secrets as random
-    except ImportError:
-        import random
+        result = dict(changed=True, title=entry.title, group_path=format_path(entry.group.path), uuid=format_uuid(entry.uuid))
+        kp.delete_entry(entry=entry)
+        return result
 
-    gen_password = ''.join(random.choice(alphabet) for _ in range(length))
-    return gen_password
+    else:
+        module.fail_json(msg='No action matched', title=title)
 
 def set_result(entry, changed):
     result = {}
     result['title']             = entry.title
+    result['uuid']              = format_uuid(entry.uuid)
     result['group_path']        = ""
     for dir in entry.group.path:
         result['group_path'] += dir + "/"
@@ -13,10 +13,14 @@ __metaclass__ = type
 import traceback
 
 from ansible.module_utils.basic import AnsibleModule, missing_required_lib
+from ansible.module_utils.six import string_types
+from ansible_collections.torie_coding.keepass.plugins.module_utils.group_index import format_path, split_path
+from ansible_collections.torie_coding.keepass.plugins.module_utils.timing import with_profile
+from ansible_collections.torie_coding.keepass.plugins.module_utils.transaction import open_transaction, transaction_argument_spec
+from ansible_collections.torie_coding.keepass.plugins.module_utils.uuid_index import format_uuid, parse_uuid
 
 PYKEEPASS_IMP_ERR = None
 try:
-    from pykeepass import PyKeePass
     import pykeepass.exceptions
 except ImportError:
     PYKEEPASS_IMP_ERR = traceback.format_exc()
@@ -40,36 +44,30 @@ description:
 requirements:
     - PyKeePass
 options:
-    database:
-        description:
-            - Path of the KeePass database.
-        required: true
-        type: str
     name:
         description:
-            - Name of the group.
-        required: true
-        type: str
-    keyfile:
-        description:
-            - Path of the KeePass keyfile. Either this or 'database_password' (or both) are required.
+            - Name of the group. Either this, 'uuid' or 'groups' is required.
         required: false
         type: str
-    database_password:
+    uuid:
         description:
-            - Database password. Either this or 'keyfile' (or both) are required.
+            - UUID of the group, as every result returns it. The group is then found through an index of all UUIDs instead of by 'path' and 'name', so it is still found after it was renamed or moved.
+            - With action C(create), a group with this UUID is left alone, otherwise a group 'name' is created in 'path' with this UUID.
+            - Accepts the 32 hex digits with or without dashes, or the base64 form of the KeePass XML.
         required: false
         type: str
+        version_added: "1.4.0"
     icon_id:
         description:
-            - Icon ID to be associated with the group.
+            - Icon ID to be associated with the group. Created groups get icon 48 if it is not given, modified groups keep their icon.
         required: false
         type: int
-        default: 48
     action:
         description:
             - The action to perform (create, modify, delete).
-        required: true
+            - Required unless 'groups' is given, where it is the default action of the items and defaults to 'create'.
+            - C(modify) only changes the attributes that differ. If none differs, the database is not saved and the task reports no change.
+        required: false
         choices: ['create', 'modify', 'delete']
         type: str
     notes:
@@ -81,6 +79,7 @@ options:
     new_name:
         description:
             - The new name for the group (only for modifications).
+            - The task fails if another group in the same parent group already has this name.
         required: false
         type: str
     path:
@@ -95,6 +94,19 @@ options:
         required: false
         choices: ['true', 'false']
         type: boolean
+    groups:
+        description:
+            - Declarative tree or list of groups to reconcile in a single run. The database is opened once, walked once and saved only once at the end.
+            - Every item is either a path string like C(foo/bar/baz), which is created including its parents, or a dictionary with the keys
+              C(name), C(uuid), C(path), C(icon_id), C(notes), C(new_name), C(action) and C(groups). C(name) is required unless C(uuid) addresses an existing group.
+            - C(path) and nested C(groups) are relative to the enclosing item, or to 'path' for the top-level items.
+            - Nested C(groups) inherit the action of their parent item. Missing parents are always created, deleting a group that does not exist is not an error.
+            - Mutually exclusive with 'name' and 'uuid'.
+        required: false
+        type: list
+        elements: raw
+extends_documentation_fragment:
+    - torie_coding.keepass.transaction
 author:
     - Tobias Karger und Marie Berger
 '''
@@ -154,6 +166,27 @@ EXAMPLES = '''
     path: foo/bar
   register: group
 
+- debug:
+    var: group
+
+- name: Reconcile a whole group tree with one open and one save of the database
+  torie_coding.keepass.group:
+    database: /path/to/KeePass_database.kdbx
+    database_password: "your_database_password"
+    path: infrastructure
+    groups:
+      - servers/linux
+      - servers/windows
+      - name: network
+        notes: Switches and routers
+        groups:
+          - name: switches
+          - name: routers
+            icon_id: 50
+      - name: legacy
+        action: delete
+  register: group
+
 - debug:
     var: group
 '''
@@ -171,177 +204,291 @@ notes:
 full_path:
     description: The path of the Group including the groupname.
     type: str
+uuid:
+    description: The UUID of the group, as 32 hex digits with dashes.
+    type: str
 changed:
     description: Indicates whether a change was made to the group.
     type: bool
+groups:
+    description:
+        - Results of every item of 'groups' in the order they were walked, nested items included. Each item has the same keys as a single run returns.
+        - Only returned when 'groups' is given.
+    type: list
+    elements: dict
+timings:
+    description:
+        - Seconds spent in the phases of the task, only returned with O(timings).
+        - The phases are C(lock), C(read), C(kdf) (key derivation), C(parse) (decrypting and parsing the XML), C(group_index), C(apply) (applying the changes in memory), C(replay) and C(save). Phases that did not run are left out, C(total) is the time from opening the database until the result was returned.
+    type: dict
 '''
 
-def main():
+def module_spec():
+    """Return the keyword arguments of AnsibleModule, the action plugin validates with them too."""
     # define available arguments/parameters a user can pass to the module
-    module_args = dict(
-        database=dict(type='str', required=True),
-        name=dict(type='str', required=True),
-        keyfile=dict(type='str', required=False, default=None),
-        database_password=dict(type='str', required=False, default=None, no_log=True),
+    module_args = transaction_argument_spec()
+    module_args.update(
+        name=dict(type='str', required=False),
+        uuid=dict(type='str', required=False),
         icon_id=dict(type='int', required=False),
-        action=dict(type='str', required=True),
+        action=dict(type='str', required=False),
         notes=dict(type='str', required=False),
         new_name=dict(type='str', required=False),
         path=dict(type='str', required=False),
-        create_path=dict(type=bool, required=False)
+        create_path=dict(type=bool, required=False),
+        groups=dict(type='list', elements='raw', required=False)
     )
 
-    # seed the result dict in the object
-    # we primarily care about changed and state
-    # change is if this module effectively modified the target
-    # state will include any data that you want your module to pass back
-    # for consumption, for example, in a subsequent task
-    result = dict(
-        changed=False,
-        name=''
+    return dict(
+        argument_spec=module_args,
+        mutually_exclusive=[('name', 'groups'), ('uuid', 'groups')],
+        required_one_of=[('name', 'uuid', 'groups')],
+        supports_check_mode=True
     )
 
+def main():
     # the AnsibleModule object will be our abstraction working with Ansible
     # this includes instantiation, a couple of common attr would be the
     # args/params passed to the execution, as well as if the module
     # supports check mode
-    module = AnsibleModule(
-        argument_spec=module_args,
-        supports_check_mode=True
-    )
+    module = AnsibleModule(**module_spec())
+    run_module(module)
+
+@with_profile
+def run_module(module, cache=None):
+    """Manage the groups of the database and exit the module.
 
+    ``module`` is an AnsibleModule, or the stand-in of the action plugin when
+    the task runs on the controller. ``cache`` keeps the database unlocked
+    between calls in the same process.
+    """
     if not pykeepass_found:
         module.fail_json(msg=missing_required_lib("pykeepass"), exception=PYKEEPASS_IMP_ERR)
 
-    database                = module.params['database']
-    keyfile                 = module.params['keyfile']
-    database_password       = module.params['database_password']
-    name                    = module.params['name']
-    icon_id                 = module.params['icon_id']
     action                  = module.params['action']
-    notes                   = module.params['notes']
     new_name                = module.params['new_name']
-    path                    = module.params['path']
     create_path             = module.params['create_path']
+    groups                  = module.params['groups']
 
-    if (action.lower() == "create" and new_name) or (action.lower() == "delete" and new_name) :
-        module.fail_json(msg="Action 'Create' or 'Delete' do not take 'new_name'")
+    if groups is None:
+        if not action:
+            module.fail_json(msg="'action' is required if 'groups' is not given.")
 
-    if not database_password and not keyfile:
-        module.fail_json(msg="Either 'database_password' or 'keyfile' (or both) are required.")
-    
-    if (action.lower() == "create" and create_path is None) :
-        module.fail_json(msg="If Action 'Create' is given you need to set 'create_path' to specifiy wether given path should be created if not already exists")
+        if (action.lower() == "create" and new_name) or (action.lower() == "delete" and new_name) :
+            module.fail_json(msg="Action 'Create' or 'Delete' do not take 'new_name'")
 
-    if (action.lower() == "modify" and create_path is not None) :
-        module.fail_json(msg="If Action 'Modify' is given you cannot set 'create_path'")
+        if (action.lower() == "create" and create_path is None) :
+            module.fail_json(msg="If Action 'Create' is given you need to set 'create_path' to specifiy wether given path should be created if not already exists")
 
+        if (action.lower() == "modify" and create_path is not None) :
+            module.fail_json(msg="If Action 'Modify' is given you cannot set 'create_path'")
 
-    try:
-        kp = PyKeePass(database, password=database_password, keyfile=keyfile)
-    except IOError:
-        KEEPASS_OPEN_ERR = traceback.format_exc()
-        module.fail_json(msg='Could not open the database or keyfile.')
-    except pykeepass.exceptions.CredentialsError:
-        KEEPASS_OPEN_ERR = traceback.format_exc()
-        module.fail_json(msg='Could not open the database, as the credentials are wrong.')
-    except (pykeepass.exceptions.HeaderChecksumError, pykeepass.exceptions.PayloadChecksumError):
-        KEEPASS_OPEN_ERR = traceback.format_exc()
-        module.fail_json(msg='Could not open the database, as the checksum of the database is wrong. This could be caused by a corrupt database.')
-    if not path:
-        directory_list = []
-    else:
-    # remove slashes at the beginning, the end and dobble slashes, that will cause problems
-        directory_list = [d for d in path.split("/") if d]
+    with open_transaction(module, cache=cache) as transaction:
+        if groups is None:
+            result = transaction.execute(manage_group, module.params)
+        else:
+            result = transaction.execute(reconcile_groups, groups, split_path(module.params['path']), (action or 'create').lower())
+
+        # missing parents, the group itself or the whole tree were changed in memory, write it only once
+        transaction.commit()
+
+    # in the event of a successful module execution, you will want to
+    # simple AnsibleModule.exit_json(), passing the key/value results
+    if transaction.timings.enabled:
+        result['timings'] = transaction.timings.as_dict()
+    module.exit_json(**result)
+
+def manage_group(transaction, params):
+    """Apply a single create/modify/delete to the opened database and return its result."""
+    module                  = transaction.module
+    group_index             = transaction.group_index
+    name                    = params['name']
+    group_uuid              = check_uuid(module, params.get('uuid'), name)
+    icon_id                 = params['icon_id']
+    action                  = params['action']
+    notes                   = params['notes']
+    new_name                = params['new_name']
+    create_path             = params['create_path']
+    directory_list          = split_path(params['path'])
 
     if action.lower() == "create":
 
         # check if group already exists
-        group = kp.find_groups(path=directory_list + [name], first=True)
+        group = find_group(transaction, directory_list + (name,), group_uuid)
         if group is not None:
-            result = set_result(group, False)
-            module.exit_json(**result)
+            return set_result(group, False)
 
-        # only execute if dryrun is inactive
-        if not module.check_mode:
-            try:
-                # check if path already exists
-                group = kp.find_groups(path=directory_list,first=True)
-                if not group and create_path is True:
-                    for idx, temp_name in enumerate(directory_list):
-                        temp_path = directory_list[0 : idx + 1]
-
-                        under_group = kp.find_groups(path=temp_path)
-                        if not under_group:
-                            dest_group = kp.find_groups(path=temp_path[:-1]) if len(temp_path) > 1 else kp.root_group
-                            if not dest_group:
-                                raise Exception("No destination group found")
-
-                            group = kp.add_group(dest_group, group_name=temp_name)
-
-                    kp.save()
-                elif not group and create_path is False:
-                    module.fail_json(msg="Path does not exist. If Path should be created set 'create_path' to True", exception=traceback.format_exc())
-                else:
-                    pass
-                if not icon_id:
-                     icon_id = 48
-                kp.add_group(kp.find_groups(path=directory_list,first=True), group_name=name, icon=str(icon_id), notes=notes or 'Generated by ansible.')
-                kp.save()
-            except:
-                KEEPASS_SAVE_ERR = traceback.format_exc()
-                module.fail_json(msg='Could not add the group or save the database.', exception=KEEPASS_SAVE_ERR)
-
-        group = kp.find_groups(path=directory_list + [name],first=True)
-
-        result = set_result(group, True)
-
-        # in the event of a successful module execution, you will want to
-        # simple AnsibleModule.exit_json(), passing the key/value results
-        module.exit_json(**result)
+        if not name:
+            module.fail_json(msg="'name' is required to create a group.")
+
+        # check if path already exists
+        if directory_list not in group_index and not create_path:
+            module.fail_json(msg="Path does not exist. If Path should be created set 'create_path' to True")
+
+        try:
+            group_index.ensure(directory_list)
+            if not icon_id:
+                icon_id = 48
+            group = group_index.add(directory_list, name, icon=str(icon_id), notes=notes or 'Generated by ansible.')
+            set_uuid(transaction, group, group_uuid)
+        except Exception:
+            KEEPASS_SAVE_ERR = traceback.format_exc()
+            module.fail_json(msg='Could not add the group.', exception=KEEPASS_SAVE_ERR)
+
+        return set_result(group, True)
 
     elif action.lower() == "modify":
         # try to get the entry from the database
-        group = kp.find_groups(path=directory_list + [name], first=True)
+        group = find_group(transaction, directory_list + (name,), group_uuid)
         if group is None:
-            module.fail_json(msg='No group found in Database', exception=traceback.format_exc())
-        else:
-            if notes:
-                group.notes = notes
+            module.fail_json(msg='No group found in Database')
 
-            if icon_id:
-                group.icon = str(icon_id)
+        return set_result(group, modify_group(module, group_index, group, icon_id, notes, new_name))
 
-            if new_name:
-                group.name = new_name
+    elif action.lower() == "delete":
+        group = find_group(transaction, directory_list + (name,), group_uuid)
+        if group is None:
+            module.fail_json(msg='No group found in Database')
 
-            kp.save()
+        result = dict(changed=True, uuid=format_uuid(group.uuid))
+        delete_group(group_index, group)
+        return result
 
-            result = set_result(group, True)
-            module.exit_json(**result)
+    else:
+        module.fail_json(msg='No action matched')
+
+GROUP_ITEM_OPTIONS = ['name', 'uuid', 'path', 'icon_id', 'notes', 'new_name', 'action', 'groups']
+
+
+def reconcile_groups(transaction, items, parent_path, default_action):
+    """Reconcile all items of 'groups' against the opened database in one walk."""
+    results = []
+    apply_groups(transaction, items, parent_path, default_action, results)
+    return dict(changed=any(item_result['changed'] for item_result in results), groups=results)
+
+def apply_groups(transaction, items, parent_path, default_action, results):
+    module = transaction.module
+    group_index = transaction.group_index
+    for item in items:
+        if isinstance(item, string_types):
+            directory_list = split_path(item)
+            if not directory_list:
+                module.fail_json(msg="Empty group path in 'groups'.")
+            item = dict(name=directory_list[-1], path=list(directory_list[:-1]))
+        elif not isinstance(item, dict):
+            module.fail_json(msg="Items of 'groups' must be paths or dictionaries, got: {}".format(item))
+
+        unknown = set(item) - set(GROUP_ITEM_OPTIONS)
+        if unknown:
+            module.fail_json(msg="Unsupported keys in 'groups' item: {}".format(", ".join(sorted(unknown))))
+        name = item.get('name')
+        group_uuid = check_uuid(module, item.get('uuid'), name)
+        if not name and group_uuid is None:
+            module.fail_json(msg="Every item of 'groups' needs a 'name' or a 'uuid'.")
+        action = (item.get('action') or default_action).lower()
+        icon_id = item.get('icon_id')
+        notes = item.get('notes')
+        new_name = item.get('new_name')
+        if icon_id is not None:
+            try:
+                icon_id = int(icon_id)
+            except (TypeError, ValueError):
+                module.fail_json(msg="Invalid icon_id '{}' for group '{}'.".format(icon_id, name))
+        if new_name and action != "modify":
+            module.fail_json(msg="Action 'Create' or 'Delete' do not take 'new_name'", name=name)
+
+        key = parent_path + split_path(item.get('path')) + (name,)
+        group = find_group(transaction, key, group_uuid)
+        if group is not None:
+            key = tuple(group.path)
+
+        if action == "create":
+            if group is not None:
+                results.append(set_result(group, False))
+            else:
+                if not name:
+                    module.fail_json(msg="'name' is required to create a group.", uuid=item.get('uuid'))
+                group_index.ensure(key[:-1])
+                group = group_index.add(key[:-1], name, icon=str(icon_id or 48), notes=notes or 'Generated by ansible.')
+                set_uuid(transaction, group, group_uuid)
+                results.append(set_result(group, True))
+
+        elif action == "modify":
+            if group is None:
+                module.fail_json(msg='No group found in Database', name=name)
+            changed = modify_group(module, group_index, group, icon_id, notes, new_name)
+            key = tuple(group.path)
+            results.append(set_result(group, changed))
+
+        elif action == "delete":
+            if group is None:
+                results.append(dict(changed=False, name=name, full_path=format_path(key), uuid=item.get('uuid')))
+            else:
+                results.append(dict(changed=True, name=group.name, full_path=format_path(key), uuid=format_uuid(group.uuid)))
+                delete_group(group_index, group)
+            continue
 
-    elif action.lower() == "delete":
-        group = kp.find_groups(path=directory_list + [name], first=True)
-        if group is None:
-            module.fail_json(msg='No group found in Database', exception=traceback.format_exc())
         else:
-            kp.delete_group(group=group)
-            kp.save()
-            module.exit_json(changed=True)
+            module.fail_json(msg='No action matched', name=name)
 
-    else:
-        module.fail_json(msg='No action matched', exception=traceback.format_exc())
+        if item.get('groups'):
+            apply_groups(transaction, item['groups'], key, action, results)
 
-def generate_password(length):
-    import string
-    alphabet = string.ascii_letters + string.digits
+def check_uuid(module, value, name=None):
+    """Return the 'uuid' option ``value`` as a uuid.UUID, None if it is not set."""
+    if not value:
+        return None
     try:
-        import secrets as random
-    except ImportError:
-        import random
+        return parse_uuid(value)
+    except ValueError as exc:
+        module.fail_json(msg=str(exc), name=name)
+
+def find_group(transaction, key, group_uuid):
+    """Return the group with the UUID ``group_uuid`` if it is given, else the group at the path ``key``."""
+    if group_uuid is not None:
+        return transaction.uuid_index.find(group_uuid, 'group')
+    return transaction.group_index.find(key)
+
+def set_uuid(transaction, group, group_uuid):
+    if group_uuid is not None:
+        group.uuid = group_uuid
+        transaction.uuid_index.add(group)
+
+def indexed(group_index, group):
+    """Return whether the path index resolves the path of ``group`` to this very group, and not to a sibling of the same name."""
+    found = group_index.find(tuple(group.path))
+    return found is not None and found._element is group._element
+
+def modify_group(module, group_index, group, icon_id, notes, new_name):
+    """Change the given attributes of ``group`` that differ and return whether any did."""
+    changed = False
+    if notes and group.notes != notes:
+        group.notes = notes
+        changed = True
+    if icon_id is not None and group.icon != str(icon_id):
+        group.icon = str(icon_id)
+        changed = True
+    if new_name and group.name != new_name:
+        rename_group(module, group_index, group, new_name)
+        changed = True
+    return changed
+
+def rename_group(module, group_index, group, new_name):
+    """Rename ``group``, unless a sibling already has the name ``new_name``."""
+    parent = group.parentgroup
+    if any(sibling.name == new_name and sibling._element is not group._element for sibling in parent.subgroups):
+        module.fail_json(msg="A group named '{}' already exists in '{}'.".format(new_name, format_path(parent.path) or '/'),
+                         name=group.name)
+    if indexed(group_index, group):
+        group_index.rename(tuple(group.path), new_name)
+    else:
+        group.name = new_name
 
-    gen_password = ''.join(random.choice(alphabet) for _ in range(length))
-    return gen_password
+def delete_group(group_index, group):
+    if indexed(group_index, group):
+        group_index.delete(tuple(group.path))
+    else:
+        group_index.kp.delete_group(group=group)
 
 def set_result(group, changed):
     result = {}
@@ -351,6 +498,7 @@ def set_result(group, changed):
     for dir in group.path:
         result['full_path'] += dir + "/"
     result['notes']         = group.notes
+    result['uuid']          = format_uuid(group.uuid)
     result['changed']       = changed
     return result
 
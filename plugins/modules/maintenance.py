@@ -0,0 +1,302 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Author: Tobias Karger und Marie Berger
+# Contact: coding@thepatchwork.de
+# License: The Unlicense, see LICENSE file.
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import datetime
+import io
+import os
+import traceback
+
+from ansible.module_utils.basic import AnsibleModule, missing_required_lib
+from ansible_collections.torie_coding.keepass.plugins.module_utils.timing import with_profile
+from ansible_collections.torie_coding.keepass.plugins.module_utils.transaction import open_transaction, transaction_argument_spec
+
+PYKEEPASS_IMP_ERR = None
+try:
+    from pykeepass.entry import HistoryEntry
+    import pykeepass.exceptions
+    from lxml import etree
+except ImportError:
+    PYKEEPASS_IMP_ERR = traceback.format_exc()
+    pykeepass_found = False
+else:
+    pykeepass_found = True
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.1',
+    'status': ['release'],
+    'supported_by': 'community'
+}
+
+DOCUMENTATION = '''
+---
+module: maintenance
+short_description: Prune history, empty the recycle bin and drop unused attachments of a KeePass (kdbx) database.
+version_added: "1.4.0"
+description:
+    - "This module keeps a KeePass (kdbx) database small, so it stays quick to open, parse and save."
+    - "It prunes the history of the entries by count, age or size, empties the recycle bin and drops attachment data no entry refers to any more. The database is then saved once and the size of the file before and after is returned."
+    - "Every step only runs if its option is given. Nothing is saved if nothing was removed."
+    - "In check mode nothing is written, the returned size after is the size the database would have."
+requirements:
+    - PyKeePass
+options:
+    history_max_items:
+        description:
+            - Keep at most this many history items of every entry, the newest ones. 0 deletes the whole history.
+        required: false
+        type: int
+    history_max_age:
+        description:
+            - Delete history items last modified more than this many days ago.
+        required: false
+        type: int
+    history_max_size:
+        description:
+            - Delete the oldest history items of every entry until the history of the entry takes at most this many bytes, measured as serialized XML.
+            - Attachments are stored once per database and are not counted, see O(drop_orphan_binaries).
+        required: false
+        type: int
+    empty_recycle_bin:
+        description:
+            - Delete all groups and entries in the recycle bin. The recycle bin itself is kept.
+        required: false
+        default: false
+        type: bool
+    drop_orphan_binaries:
+        description:
+            - Delete the data of attachments no entry or history item refers to any more, for example after their history was pruned. The remaining attachments are renumbered.
+        required: false
+        default: false
+        type: bool
+extends_documentation_fragment:
+    - torie_coding.keepass.transaction
+author:
+    - Tobias Karger und Marie Berger
+'''
+
+EXAMPLES = '''
+- name: Keep the vault lean
+  torie_coding.keepass.maintenance:
+    database: /path/to/KeePass_database.kdbx
+    database_password: "your_database_password"
+    history_max_items: 10
+    history_max_age: 365
+    empty_recycle_bin: true
+    drop_orphan_binaries: true
+  register: maintenance
+
+- debug:
+    msg: "{{ maintenance.size_before }} bytes before, {{ maintenance.size_after }} bytes after"
+'''
+
+RETURN = '''
+changed:
+    description: Whether anything was removed.
+    type: bool
+history_items_removed:
+    description: Number of deleted history items of all entries.
+    type: int
+recycle_bin_groups_removed:
+    description: Number of groups deleted from the recycle bin, not counting their subgroups.
+    type: int
+recycle_bin_entries_removed:
+    description: Number of entries deleted from the recycle bin, not counting the entries of deleted groups.
+    type: int
+binaries_removed:
+    description: Number of deleted attachment data.
+    type: int
+binary_bytes_removed:
+    description: Size of the deleted attachment data in bytes.
+    type: int
+size_before:
+    description: Size of the database file in bytes before the task.
+    type: int
+size_after:
+    description: Size of the database file in bytes after the task. In check mode an estimate, which can differ from the size of an actual save by a few bytes of padding and random data.
+    type: int
+timings:
+    description:
+        - Seconds spent in the phases of the task, only returned with O(timings).
+        - The phases are C(lock), C(read), C(kdf), C(parse), C(apply), C(replay), C(save) and, in check mode, C(estimate).
+    type: dict
+'''
+
+
+def module_spec():
+    """Return the keyword arguments of AnsibleModule, the action plugin validates with them too."""
+    module_args = transaction_argument_spec()
+    module_args.update(
+        history_max_items=dict(type='int', required=False),
+        history_max_age=dict(type='int', required=False),
+        history_max_size=dict(type='int', required=False),
+        empty_recycle_bin=dict(type='bool', required=False, default=False),
+        drop_orphan_binaries=dict(type='bool', required=False, default=False),
+    )
+
+    return dict(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+def main():
+    module = AnsibleModule(**module_spec())
+    run_module(module)
+
+@with_profile
+def run_module(module, cache=None):
+    """Clean up the database, save it once and exit the module.
+
+    ``module`` is an AnsibleModule, or the stand-in of the action plugin when
+    the task runs on the controller. ``cache`` keeps the database unlocked
+    between calls in the same process.
+    """
+    if not pykeepass_found:
+        module.fail_json(msg=missing_required_lib("pykeepass"), exception=PYKEEPASS_IMP_ERR)
+
+    for option in ('history_max_items', 'history_max_age', 'history_max_size'):
+        if module.params[option] is not None and module.params[option] < 0:
+            module.fail_json(msg="'{}' must not be negative.".format(option))
+
+    try:
+        size_before = os.path.getsize(module.params['database'])
+    except OSError:
+        module.fail_json(msg='Could not open the database or keyfile.')
+
+    with open_transaction(module, cache=cache) as transaction:
+        result = transaction.execute(clean_up, module.params)
+        if result['changed'] and module.check_mode:
+            # write to memory with the key it was opened with, which skips the key derivation
+            with transaction.timings.phase('estimate'):
+                stream = io.BytesIO()
+                transaction.kp.save(filename=stream, transformed_key=transaction.kp.transformed_key)
+                size_after = len(stream.getvalue())
+
+        # everything was removed from the in-memory database, write it only once
+        if transaction.commit():
+            size_after = os.path.getsize(module.params['database'])
+        elif not module.check_mode or not result['changed']:
+            size_after = size_before
+
+    result = dict(result, size_before=size_before, size_after=size_after)
+    if transaction.timings.enabled:
+        result['timings'] = transaction.timings.as_dict()
+    module.exit_json(**result)
+
+def clean_up(transaction, params):
+    """Remove history, the content of the recycle bin and unused binaries from the opened database."""
+    kp = transaction.kp
+    result = dict(history_items_removed=0, recycle_bin_groups_removed=0, recycle_bin_entries_removed=0,
+                  binaries_removed=0, binary_bytes_removed=0)
+
+    if any(params[option] is not None for option in ('history_max_items', 'history_max_age', 'history_max_size')):
+        result['history_items_removed'] = prune_history(kp, params['history_max_items'], params['history_max_age'], params['history_max_size'])
+
+    if params['empty_recycle_bin']:
+        result['recycle_bin_groups_removed'], result['recycle_bin_entries_removed'] = empty_recycle_bin(kp)
+
+    if params['drop_orphan_binaries']:
+        result['binaries_removed'], result['binary_bytes_removed'] = drop_orphan_binaries(kp)
+
+    result['changed'] = any(result[key] for key in ('history_items_removed', 'recycle_bin_groups_removed',
+                                                    'recycle_bin_entries_removed', 'binaries_removed'))
+    return result
+
+def prune_history(kp, max_items, max_age, max_size):
+    """Delete history items by age, count and size and return how many were deleted.
+
+    History items are stored oldest first. All History elements are found in
+    a single walk of the tree.
+    """
+    cutoff = None
+    if max_age is not None:
+        cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=max_age)
+
+    removed = 0
+    for history in kp.tree.getroot().iter('History'):
+        items = history.findall('Entry')
+        if not items:
+            continue
+        drop = set()
+        if cutoff is not None:
+            for item in items:
+                mtime = HistoryEntry(element=item, kp=kp).mtime
+                if mtime is not None and mtime < cutoff:
+                    drop.add(item)
+        kept = [item for item in items if item not in drop]
+        if max_items is not None and len(kept) > max_items:
+            drop.update(kept[:len(kept) - max_items])
+            kept = kept[len(kept) - max_items:]
+        if max_size is not None:
+            sizes = [len(etree.tostring(item)) for item in kept]
+            total = sum(sizes)
+            for item, size in zip(kept, sizes):
+                if total <= max_size:
+                    break
+                drop.add(item)
+                total -= size
+        for item in drop:
+            history.remove(item)
+        removed += len(drop)
+    return removed
+
+def empty_recycle_bin(kp):
+    """Delete the content of the recycle bin and return the number of deleted groups and entries."""
+    recyclebin = kp.recyclebin_group
+    if recyclebin is None:
+        return 0, 0
+    groups = recyclebin.subgroups
+    entries = recyclebin.entries
+    for group in groups:
+        kp.delete_group(group=group)
+    for entry in entries:
+        kp.delete_entry(entry=entry)
+    return len(groups), len(entries)
+
+def drop_orphan_binaries(kp):
+    """Delete binaries no attachment refers to and return their number and size.
+
+    Unlike PyKeePass.delete_binary, which searches the whole tree once per
+    binary, all references are collected and renumbered in a single walk.
+    """
+    references = [value for value in kp.tree.getroot().iter('Value')
+                  if value.get('Ref') is not None and value.getparent().tag == 'Binary']
+    used = set(int(value.get('Ref')) for value in references)
+    binaries = kp.binaries
+    mapping = {}
+    for old_id in range(len(binaries)):
+        if old_id in used:
+            mapping[old_id] = len(mapping)
+    unused = [old_id for old_id in range(len(binaries)) if old_id not in mapping]
+    if not unused:
+        return 0, 0
+
+    if kp.version >= (4, 0):
+        store = kp.payload.inner_header.binary
+        for old_id in reversed(unused):
+            store.pop(old_id)
+    else:
+        container = kp.tree.getroot().find('Meta/Binaries')
+        for element in list(container):
+            old_id = int(element.get('ID'))
+            if old_id in mapping:
+                element.set('ID', str(mapping[old_id]))
+            else:
+                container.remove(element)
+
+    for value in references:
+        old_id = int(value.get('Ref'))
+        if old_id in mapping:
+            value.set('Ref', str(mapping[old_id]))
+    return len(unused), sum(len(binaries[old_id]) for old_id in unused)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,420 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Author: Tobias Karger und Marie Berger
+# Contact: coding@thepatchwork.de
+# License: The Unlicense, see LICENSE file.
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import csv
+import filecmp
+import io
+import json
+import os
+import tempfile
+import traceback
+
+from ansible.module_utils.basic import AnsibleModule, missing_required_lib
+from ansible.module_utils.common.text.converters import to_text
+from ansible.module_utils.six import string_types
+from ansible_collections.torie_coding.keepass.plugins.module_utils.group_index import split_path
+from ansible_collections.torie_coding.keepass.plugins.module_utils.reconcile import VaultState
+from ansible_collections.torie_coding.keepass.plugins.module_utils.timing import with_profile
+from ansible_collections.torie_coding.keepass.plugins.module_utils.transaction import open_transaction, transaction_argument_spec
+from ansible_collections.torie_coding.keepass.plugins.module_utils.uuid_index import format_uuid
+
+PYKEEPASS_IMP_ERR = None
+try:
+    from pykeepass.entry import Entry
+    import pykeepass.exceptions
+except ImportError:
+    PYKEEPASS_IMP_ERR = traceback.format_exc()
+    pykeepass_found = False
+else:
+    pykeepass_found = True
+
+YAML_IMP_ERR = None
+try:
+    import yaml
+except ImportError:
+    YAML_IMP_ERR = traceback.format_exc()
+    yaml_found = False
+else:
+    yaml_found = True
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.1',
+    'status': ['release'],
+    'supported_by': 'community'
+}
+
+DOCUMENTATION = '''
+---
+module: transfer
+short_description: Import entries into a KeePass (kdbx) database from CSV, JSON or YAML files, or export them.
+version_added: "1.4.0"
+description:
+    - "This module imports many entries into a KeePass (kdbx) database at once, or exports them to a file."
+    - "An import reads the rows of the file one by one into the database, which is opened once and saved once at the end. Entries that exist already, by UUID or by title in their group, are only changed where they differ, so re-running an import changes nothing."
+    - "An export writes one entry after the other to a temporary file, which replaces the file only if its content changed. The rendered entries are never held in memory together."
+    - "CSV and JSON Lines files are read and written as a stream. JSON and YAML files are written as a stream, but read as a whole."
+requirements:
+    - PyKeePass
+    - PyYAML, for the C(yaml) format
+options:
+    action:
+        description:
+            - Whether to import the entries of 'file' into the database, or to export the entries of the database to 'file'.
+            - An export reads the database without locking it, whatever 'concurrency' is set to.
+        required: true
+        choices: ['import', 'export']
+        type: str
+    file:
+        description:
+            - The file to import from or export to. An exported file is created with mode 0600, an existing one keeps its mode.
+        required: true
+        type: path
+    format:
+        description:
+            - Format of 'file'. C(jsonl) is JSON Lines, one JSON object per line.
+            - Defaults to the extension of 'file', C(.csv), C(.jsonl) or C(.ndjson), C(.json), C(.yml) or C(.yaml).
+        required: false
+        choices: ['csv', 'jsonl', 'json', 'yaml']
+        type: str
+    group_path:
+        description:
+            - Group the C(group_path) of the rows is relative to. An import creates it if it does not exist, an export only exports its entries.
+            - Exported rows hold the path relative to this group, so importing a file with the same 'group_path' it was exported with changes nothing.
+        required: false
+        default: "/"
+        type: str
+    existing:
+        description:
+            - What an import does with entries that exist already. C(update) changes the fields that differ, C(skip) leaves them alone.
+        required: false
+        default: update
+        choices: ['update', 'skip']
+        type: str
+    fields:
+        description:
+            - Fields an export writes for every entry, in this order.
+        required: false
+        default: ['group_path', 'title', 'username', 'password', 'url', 'notes', 'tags', 'icon_id', 'uuid']
+        type: list
+        elements: str
+    recursive:
+        description:
+            - Whether an export includes the entries of the subgroups of 'group_path'. The recycle bin is never exported.
+        required: false
+        default: true
+        type: bool
+notes:
+    - "Rows are objects or CSV lines with the keys C(title), C(uuid), C(group_path), C(username), C(password), C(url), C(notes), C(tags), C(icon_id),
+      C(custom_properties) and C(state), see M(torie_coding.keepass.vault_state). Keys are case insensitive, and the CSV headers of KeePass and KeePassXC
+      (C(Group), C(Title), C(Username), C(Password), C(URL), C(Notes), C(Icon)) are understood. Other columns are ignored, empty values are not set."
+    - "C(tags) are a list, or a string separated by C(;) or C(,). C(custom_properties) can only be given in JSON and YAML files."
+extends_documentation_fragment:
+    - torie_coding.keepass.transaction
+author:
+    - Tobias Karger und Marie Berger
+'''
+
+EXAMPLES = '''
+- name: Seed the test vault from a CSV file
+  torie_coding.keepass.transfer:
+    action: import
+    database: /path/to/KeePass_database.kdbx
+    database_password: "your_database_password"
+    file: /path/to/entries.csv
+    group_path: seeded
+  register: imported
+
+- name: Export all entries without their passwords
+  torie_coding.keepass.transfer:
+    action: export
+    database: /path/to/KeePass_database.kdbx
+    database_password: "your_database_password"
+    file: /path/to/entries.jsonl
+    fields: [group_path, title, username, url, uuid]
+'''
+
+RETURN = '''
+changed:
+    description: Whether the import changed the database, or the export changed the file.
+    type: bool
+rows:
+    description: Number of rows imported or exported.
+    type: int
+summary:
+    description: Number of created, updated and deleted groups and entries, only returned by imports.
+    type: dict
+    sample: {"created": 120, "updated": 3, "deleted": 0}
+file:
+    description: The file imported from or exported to.
+    type: str
+timings:
+    description:
+        - Seconds spent in the phases of the task, only returned with O(timings).
+        - The phases are C(lock), C(read), C(kdf), C(parse), C(uuid_index), C(apply) (an import), C(export), C(replay) and C(save).
+    type: dict
+'''
+
+EXPORT_FIELDS = ['group_path', 'title', 'username', 'password', 'url', 'notes', 'tags', 'icon_id', 'uuid']
+EXTENSIONS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.json': 'json', '.yml': 'yaml', '.yaml': 'yaml'}
+ROW_KEYS = ['title', 'uuid', 'group_path', 'username', 'password', 'password_length', 'url', 'notes', 'icon_id', 'tags',
+            'custom_properties', 'state']
+# column names of the CSV exports of KeePass and KeePassXC
+ROW_ALIASES = {'group': 'group_path', 'user name': 'username', 'login name': 'username', 'web site': 'url', 'icon': 'icon_id',
+               'comments': 'notes'}
+
+
+def module_spec():
+    """Return the keyword arguments of AnsibleModule, the action plugin validates with them too."""
+    module_args = transaction_argument_spec()
+    module_args.update(
+        action=dict(type='str', required=True, choices=['import', 'export']),
+        file=dict(type='path', required=True),
+        format=dict(type='str', required=False, choices=['csv', 'jsonl', 'json', 'yaml']),
+        group_path=dict(type='str', required=False, default='/'),
+        existing=dict(type='str', required=False, default='update', choices=['update', 'skip']),
+        fields=dict(type='list', elements='str', required=False, default=list(EXPORT_FIELDS)),
+        recursive=dict(type='bool', required=False, default=True),
+    )
+
+    return dict(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+def main():
+    module = AnsibleModule(**module_spec())
+    run_module(module)
+
+@with_profile
+def run_module(module, cache=None):
+    """Import or export the entries and exit the module.
+
+    ``module`` is an AnsibleModule, or the stand-in of the action plugin when
+    the task runs on the controller. ``cache`` keeps the database unlocked
+    between calls in the same process.
+    """
+    if not pykeepass_found:
+        module.fail_json(msg=missing_required_lib("pykeepass"), exception=PYKEEPASS_IMP_ERR)
+
+    params = module.params
+    file_format = params['format'] or EXTENSIONS.get(os.path.splitext(params['file'])[1].lower())
+    if file_format is None:
+        module.fail_json(msg="Cannot tell the format of '{}' from its extension, set 'format'.".format(params['file']))
+    if file_format == 'yaml' and not yaml_found:
+        module.fail_json(msg=missing_required_lib("PyYAML"), exception=YAML_IMP_ERR)
+    unknown = set(params['fields']) - set(EXPORT_FIELDS)
+    if unknown:
+        module.fail_json(msg="Unsupported fields: {}. Choose from {}.".format(", ".join(sorted(unknown)), ", ".join(EXPORT_FIELDS)))
+
+    export = params['action'] == 'export'
+    # saving replaces the database atomically, so reading it needs no lock
+    with open_transaction(module, cache=cache, concurrency='none' if export else params['concurrency']) as transaction:
+        if export:
+            with transaction.timings.phase('export'):
+                result = export_entries(module, transaction.kp, params, file_format)
+        else:
+            result = transaction.execute(import_rows, params, file_format)
+            # all rows were applied to the in-memory database, write it only once
+            transaction.commit()
+
+    result = dict(result, file=params['file'])
+    if transaction.timings.enabled:
+        result['timings'] = transaction.timings.as_dict()
+    module.exit_json(**result)
+
+# import
+
+def import_rows(transaction, params, file_format):
+    """Apply every row of the file to the opened database, reading it row by row."""
+    module = transaction.module
+    state = VaultState(transaction, keep_changes=False)
+    root = state.ensure(transaction.kp.root_group, split_path(params['group_path']))
+    update = params['existing'] == 'update'
+    rows = 0
+    try:
+        for line, row in read_rows(params['file'], file_format):
+            state.apply_entry(root, normalize_row(module, row, line), update=update)
+            rows += 1
+    except (IOError, OSError) as exc:
+        module.fail_json(msg="Could not read '{}': {}".format(params['file'], exc))
+    except (ValueError, csv.Error) as exc:
+        module.fail_json(msg="Could not parse '{}': {}".format(params['file'], exc))
+    return dict(changed=any(state.summary.values()), rows=rows, summary=state.summary)
+
+def read_rows(path, file_format):
+    """Yield the line or item number and the content of every row of the file."""
+    if file_format == 'csv':
+        # utf-8-sig drops the byte order mark some spreadsheets write
+        with io.open(path, 'r', encoding='utf-8-sig', newline='') as stream:
+            reader = csv.DictReader(stream)
+            for row in reader:
+                yield reader.line_num, row
+    elif file_format == 'jsonl':
+        with io.open(path, 'r', encoding='utf-8') as stream:
+            for line, text in enumerate(stream, 1):
+                if text.strip():
+                    try:
+                        yield line, json.loads(text)
+                    except ValueError as exc:
+                        raise ValueError('line {}: {}'.format(line, exc))
+    else:
+        with io.open(path, 'r', encoding='utf-8') as stream:
+            if file_format == 'json':
+                data = json.load(stream)
+            else:
+                try:
+                    data = yaml.safe_load(stream)
+                except yaml.YAMLError as exc:
+                    raise ValueError(str(exc))
+        if not isinstance(data, list):
+            raise ValueError('the file must contain a list of entries')
+        for item, row in enumerate(data, 1):
+            yield item, row
+
+def normalize_row(module, row, line):
+    """Return the row as an entry item of VaultState.apply_entry."""
+    if not isinstance(row, dict):
+        module.fail_json(msg="Row {} is not an object: {}".format(line, row))
+    item = dict((key, None) for key in ROW_KEYS)
+    for key, value in row.items():
+        if key is None:
+            # a CSV line with more values than the header has columns
+            continue
+        # YAML reads keys like 1 or yes as numbers and booleans
+        key = to_text(key).strip().lower()
+        key = ROW_ALIASES.get(key, key)
+        if key in item and value not in (None, ''):
+            item[key] = value
+
+    for key in ('title', 'uuid', 'group_path', 'username', 'password', 'url', 'notes'):
+        if item[key] is not None:
+            item[key] = str(item[key])
+    for key in ('icon_id', 'password_length'):
+        if item[key] is not None:
+            try:
+                item[key] = int(item[key])
+            except (TypeError, ValueError):
+                module.fail_json(msg="Invalid {} '{}' in row {}.".format(key, item[key], line))
+    if isinstance(item['tags'], string_types):
+        item['tags'] = [tag.strip() for tag in item['tags'].replace(',', ';').split(';') if tag.strip()]
+    if item['custom_properties'] is not None and not isinstance(item['custom_properties'], dict):
+        module.fail_json(msg="'custom_properties' in row {} must be an object.".format(line))
+    item['state'] = item['state'] or 'present'
+    if item['state'] not in ('present', 'absent'):
+        module.fail_json(msg="Invalid state '{}' in row {}.".format(item['state'], line))
+    return item
+
+# export
+
+def export_entries(module, kp, params, file_format):
+    """Write the entries to a temporary file next to 'file' and move it into place if it differs."""
+    path = os.path.realpath(params['file'])
+    group = kp.root_group
+    for name in split_path(params['group_path']):
+        group = next((subgroup for subgroup in group.subgroups if subgroup.name == name), None)
+        if group is None:
+            module.fail_json(msg="Group '{}' does not exist.".format(params['group_path']))
+
+    try:
+        fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', suffix='.tmp', dir=os.path.dirname(path))
+    except (IOError, OSError) as exc:
+        module.fail_json(msg="Could not write '{}': {}".format(params['file'], exc))
+    try:
+        with io.open(fd, 'w', encoding='utf-8', newline='') as stream:
+            rows = write_rows(stream, file_format, params['fields'], iter_rows(kp, group, params['fields'], params['recursive']))
+        changed = not os.path.exists(path) or not filecmp.cmp(tmp_path, path, shallow=False)
+        if changed and not module.check_mode:
+            if os.path.exists(path):
+                os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+            os.replace(tmp_path, path)
+    except (IOError, OSError) as exc:
+        module.fail_json(msg="Could not write '{}': {}".format(params['file'], exc))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return dict(changed=changed, rows=rows)
+
+def iter_rows(kp, group, fields, recursive):
+    """Yield the fields of the entries below ``group`` one by one, in the order of the tree, leaving out the recycle bin.
+
+    The group path of a row is relative to ``group``, the way an import reads it.
+    """
+    recyclebin = kp.recyclebin_group
+    recyclebin = recyclebin._element if recyclebin is not None else None
+    # group element to its path below ``group``, or None inside the recycle bin
+    paths = {}
+
+    def group_path(element):
+        if element not in paths:
+            if element is recyclebin:
+                paths[element] = None
+            elif element is group._element:
+                paths[element] = ''
+            else:
+                parent = group_path(element.getparent())
+                paths[element] = None if parent is None else parent + element.findtext('Name') + '/'
+        return paths[element]
+
+    elements = group._element.iter('Entry') if recursive else group._element.iterchildren('Entry')
+    for element in elements:
+        if element.getparent().tag == 'History':
+            continue
+        path = group_path(element.getparent())
+        if path is None:
+            continue
+        entry = Entry(element=element, kp=kp)
+        row = {}
+        for field in fields:
+            if field == 'group_path':
+                row[field] = path
+            elif field == 'icon_id':
+                row[field] = entry.icon
+            elif field == 'uuid':
+                row[field] = format_uuid(entry.uuid)
+            elif field == 'tags':
+                row[field] = entry.tags or []
+            else:
+                row[field] = getattr(entry, field)
+        yield row
+
+def write_rows(stream, file_format, fields, rows):
+    """Write the rows to ``stream`` one by one and return their number."""
+    count = 0
+    if file_format == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=fields)
+        writer.writeheader()
+        for row in rows:
+            if 'tags' in row:
+                row['tags'] = ';'.join(row['tags'])
+            writer.writerow(row)
+            count += 1
+    elif file_format == 'jsonl':
+        for row in rows:
+            stream.write(json.dumps(row, ensure_ascii=False) + '\n')
+            count += 1
+    elif file_format == 'json':
+        stream.write('[')
+        for row in rows:
+            stream.write(',\n' if count else '\n')
+            stream.write(json.dumps(row, ensure_ascii=False))
+            count += 1
+        stream.write('\n]\n' if count else ']\n')
+    else:
+        for row in rows:
+            yaml.safe_dump([row], stream, default_flow_style=False, allow_unicode=True, sort_keys=False)
+            count += 1
+        if not count:
+            stream.write('[]\n')
+    return count
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Author: Tobias Karger und Marie Berger
+# Contact: coding@thepatchwork.de
+# License: The Unlicense, see LICENSE file.
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import traceback
+
+from ansible.module_utils.basic import AnsibleModule, missing_required_lib
+from ansible_collections.torie_coding.keepass.plugins.module_utils.reconcile import VaultState
+from ansible_collections.torie_coding.keepass.plugins.module_utils.timing import with_profile
+from ansible_collections.torie_coding.keepass.plugins.module_utils.transaction import open_transaction, transaction_argument_spec
+
+PYKEEPASS_IMP_ERR = None
+try:
+    import pykeepass.exceptions
+except ImportError:
+    PYKEEPASS_IMP_ERR = traceback.format_exc()
+    pykeepass_found = False
+else:
+    pykeepass_found = True
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.1',
+    'status': ['release'],
+    'supported_by': 'community'
+}
+
+DOCUMENTATION = '''
+---
+module: vault_state
+short_description: Bring a whole KeePass (kdbx) database in line with a desired tree of groups and entries.
+version_added: "1.4.0"
+description:
+    - "This module compares a desired tree of groups and entries with a KeePass (kdbx) database and applies only the differences."
+    - "The database is opened once, the desired tree is matched against it in a single pass through dictionary indexes of the paths and UUIDs, and the database is saved at most once, and only if anything differs."
+    - "Only the attributes given in the desired state are compared and changed, everything else is left alone. With 'prune', groups and entries below 'path' that are not part of the desired state are deleted."
+    - "Supports check mode and diff mode. The diff lists every group and entry that is created, changed or deleted, passwords and custom properties masked."
+requirements:
+    - PyKeePass
+options:
+    path:
+        description:
+            - Group the desired state is relative to. It is created if it does not exist. Defaults to the root group.
+        required: false
+        default: "/"
+        type: str
+    groups:
+        description:
+            - Desired tree of groups below 'path'.
+            - Every item is either a path string like C(foo/bar/baz), which is created including its parents, or a dictionary with the keys
+              C(name), C(uuid), C(path), C(icon_id), C(notes), C(state) and C(groups). C(name) is required unless C(uuid) addresses an existing group.
+            - A group with a C(uuid) is found wherever it is and moved and renamed into place, otherwise it is found by its name below its parent.
+            - C(path) and nested C(groups) are relative to the enclosing item. Groups with C(state=absent) are deleted including their content, after all entries were applied.
+        required: false
+        default: []
+        type: list
+        elements: raw
+    entries:
+        description:
+            - Desired entries. Their groups are created if they do not exist.
+            - An entry with a C(uuid) is found wherever it is and moved into C(group_path), otherwise it is found by its C(title) in C(group_path).
+        required: false
+        default: []
+        type: list
+        elements: dict
+        suboptions:
+            title:
+                description: Title of the entry. Either this or 'uuid' is required, and it is required to create the entry.
+                type: str
+            uuid:
+                description: UUID of the entry. A created entry gets this UUID.
+                type: str
+            group_path:
+                description: Group of the entry, relative to 'path'.
+                type: str
+            username:
+                description: Username of the entry.
+                type: str
+            password:
+                description: Password of the entry. A created entry without one gets a generated password.
+                type: str
+            password_length:
+                description: Length of the password generated for a created entry without 'password'. Default is 20.
+                type: int
+            url:
+                description: URL of the entry.
+                type: str
+            notes:
+                description: Notes of the entry.
+                type: str
+            icon_id:
+                description: Icon ID of the entry, between 0 and 68.
+                type: int
+            tags:
+                description: Tags of the entry, compared as a list.
+                type: list
+                elements: str
+            custom_properties:
+                description: Custom string fields of the entry. Only the given fields are compared and set, others are kept.
+                type: dict
+            state:
+                description: Whether the entry should exist.
+                choices: ['present', 'absent']
+                default: present
+                type: str
+    prune:
+        description:
+            - Delete all groups and entries below 'path' that are not part of the desired state. The recycle bin is never deleted.
+        required: false
+        default: false
+        type: bool
+extends_documentation_fragment:
+    - torie_coding.keepass.transaction
+author:
+    - Tobias Karger und Marie Berger
+'''
+
+EXAMPLES = '''
+- name: Keep the infrastructure part of the vault in line with the inventory
+  torie_coding.keepass.vault_state:
+    database: /path/to/KeePass_database.kdbx
+    database_password: "your_database_password"
+    path: infrastructure
+    prune: true
+    groups:
+      - servers/linux
+      - name: network
+        notes: Switches and routers
+        groups:
+          - name: switches
+      - name: legacy
+        state: absent
+    entries:
+      - title: web01
+        group_path: servers/linux
+        username: root
+        password: "{{ web01_root_password }}"
+        url: ssh://web01.example.com
+        tags: [linux, web]
+      - uuid: 0f8fad5b-d9cb-469f-a165-70867728950e
+        title: core-switch
+        group_path: network/switches
+        username: admin
+  register: vault
+
+- debug:
+    var: vault.changes
+'''
+
+RETURN = '''
+changed:
+    description: Whether the database differed from the desired state.
+    type: bool
+changes:
+    description:
+        - Every difference that was applied, in the order it was applied.
+        - Each item has the keys C(action) (C(create), C(update) or C(delete)), C(type) (C(group) or C(entry)), C(path) (the group path, for entries followed by the title), C(uuid) and, for updates, C(fields), the names of the changed attributes. A moved group or entry lists C(path) or C(group_path).
+    type: list
+    elements: dict
+summary:
+    description: Number of created, updated and deleted groups and entries.
+    type: dict
+    sample: {"created": 2, "updated": 1, "deleted": 0}
+diff:
+    description: Before and after values of all changed attributes by path, only returned in diff mode. Passwords and custom properties are masked.
+    type: dict
+timings:
+    description:
+        - Seconds spent in the phases of the task, only returned with O(timings).
+        - The phases are C(lock), C(read), C(kdf), C(parse), C(uuid_index), C(apply), C(replay) and C(save).
+    type: dict
+'''
+
+def module_spec():
+    """Return the keyword arguments of AnsibleModule, the action plugin validates with them too."""
+    module_args = transaction_argument_spec()
+    module_args.update(
+        path=dict(type='str', required=False, default='/'),
+        prune=dict(type='bool', required=False, default=False),
+        groups=dict(type='list', elements='raw', required=False, default=[]),
+        entries=dict(
+            type='list',
+            elements='dict',
+            required=False,
+            default=[],
+            options=dict(
+                title=dict(type='str', required=False),
+                uuid=dict(type='str', required=False),
+                group_path=dict(type='str', required=False),
+                username=dict(type='str', required=False),
+                password=dict(type='str', required=False, no_log=True),
+                password_length=dict(type='int', required=False, no_log=False),
+                url=dict(type='str', required=False),
+                notes=dict(type='str', required=False),
+                icon_id=dict(type='int', required=False),
+                tags=dict(type='list', elements='str', required=False),
+                custom_properties=dict(type='dict', required=False, no_log=True),
+                state=dict(type='str', required=False, default='present', choices=['present', 'absent']),
+            ),
+        ),
+    )
+
+    return dict(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+def main():
+    module = AnsibleModule(**module_spec())
+    run_module(module)
+
+@with_profile
+def run_module(module, cache=None):
+    """Bring the database in line with the desired state and exit the module.
+
+    ``module`` is an AnsibleModule, or the stand-in of the action plugin when
+    the task runs on the controller. ``cache`` keeps the database unlocked
+    between calls in the same process.
+    """
+    if not pykeepass_found:
+        module.fail_json(msg=missing_required_lib("pykeepass"), exception=PYKEEPASS_IMP_ERR)
+
+    with open_transaction(module, cache=cache) as transaction:
+        result = transaction.execute(apply_state, module.params)
+
+        # the whole difference was applied to the in-memory database, write it only once
+        transaction.commit()
+
+    result = dict(result)
+    diff = result.pop('diff')
+    if getattr(module, '_diff', False):
+        result['diff'] = diff
+    if transaction.timings.enabled:
+        result['timings'] = transaction.timings.as_dict()
+    module.exit_json(**result)
+
+def apply_state(transaction, params):
+    """Apply the difference between the desired state and the opened database, and return it."""
+    state = VaultState(transaction)
+    state.apply(params)
+    return dict(
+        changed=bool(state.changes),
+        changes=state.changes,
+        summary=state.summary,
+        diff=dict(before=state.before, after=state.after),
+    )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+#
+# Author: Tobias Karger und Marie Berger
+# Contact: coding@thepatchwork.de
+# License: The Unlicense, see LICENSE file.
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import traceback
+
+from ansible.module_utils.common.parameters import remove_values
+from ansible.module_utils.parsing.convert_bool import boolean
+from ansible.plugins.action import ActionBase
+from ansible.utils.vars import merge_hash
+from ansible_collections.torie_coding.keepass.plugins.module_utils.cache import DatabaseCache
+
+try:
+    # ansible-core 2.11 and newer
+    from ansible.module_utils.common.arg_spec import ArgumentSpecValidator
+except ImportError:
+    ArgumentSpecValidator = None
+
+# Unlocked databases of the entry and group tasks run in this worker process.
+# Ansible forks a worker per task and host, so they are reused across the
+# items of a loop, but never across tasks.
+CONTROLLER_CACHE = DatabaseCache()
+
+
+class ModuleExit(SystemExit):
+    """Raised by ControllerModule where AnsibleModule would exit the process."""
+
+    def __init__(self, result):
+        super(ModuleExit, self).__init__(1 if result.get('failed') else 0)
+        self.result = result
+
+
+class ControllerModule(object):
+    """Stand-in for AnsibleModule that runs a module's code inside an action plugin.
+
+    The task arguments are validated with the module's own argument spec,
+    and values marked ``no_log`` are masked in the result like AnsibleModule
+    does.
+    """
+
+    def __init__(self, spec, args, check_mode=False, diff=False):
+        self.check_mode = check_mode
+        self._diff = diff
+        self._warnings = []
+        self._no_log_values = set()
+        validator = ArgumentSpecValidator(
+            spec['argument_spec'],
+            mutually_exclusive=spec.get('mutually_exclusive'),
+            required_one_of=spec.get('required_one_of'),
+        )
+        validated = validator.validate(args)
+        self._no_log_values = validated._no_log_values
+        self.params = validated.validated_parameters
+        if validated.error_messages:
+            self.fail_json(msg=validated.errors.msg)
+
+    def warn(self, warning):
+        self._warnings.append(warning)
+
+    def exit_json(self, **kwargs):
+        kwargs.setdefault('changed', False)
+        raise ModuleExit(self._result(kwargs))
+
+    def fail_json(self, msg, **kwargs):
+        kwargs['failed'] = True
+        kwargs['msg'] = msg
+        raise ModuleExit(self._result(kwargs))
+
+    def _result(self, result):
+        if self._warnings:
+            result['warnings'] = self._warnings
+        return remove_values(result, self._no_log_values)
+
+
+class KeePassAction(ActionBase):
+    """Run a KeePass module on the controller when the task would run there anyway.
+
+    Tasks on the local connection (``connection: local`` or ``delegate_to:
+    localhost``) without become or async call the module code in the worker
+    process instead of shipping it, which skips building the module,
+    starting an interpreter and importing pykeepass. The unlocked database
+    is kept in CONTROLLER_CACHE for the next item of a loop. Every task
+    still saves its own changes, there is no flush at the end of the play.
+    All other tasks, or all tasks with the variable
+    ``keepass_run_on_controller`` set to false, run the module as usual.
+    """
+
+    _supports_check_mode = True
+    _supports_async = True
+
+    # fully qualified name of the module and the module itself, set by the subclasses
+    module_name = None
+    module = None
+
+    def run(self, tmp=None, task_vars=None):
+        result = super(KeePassAction, self).run(tmp, task_vars)
+        del tmp  # tmp no longer has any effect
+
+        if not self.runs_on_controller(task_vars or {}):
+            wrap_async = self._task.async_val and not self._connection.has_native_async
+            result = merge_hash(result, self._execute_module(module_name=self.module_name, task_vars=task_vars, wrap_async=wrap_async))
+            if not wrap_async:
+                self._remove_tmp_path(self._connection._shell.tmpdir)
+            return result
+
+        self._display.vvv("Running {} on the controller".format(self.module_name))
+        try:
+            module = ControllerModule(self.module.module_spec(), self._task.args, check_mode=self._play_context.check_mode,
+                                     diff=self._task.diff)
+            self.module.run_module(module, cache=CONTROLLER_CACHE)
+            module_result = dict(failed=True, msg='{} did not exit'.format(self.module_name))
+        except ModuleExit as exc:
+            module_result = exc.result
+        except Exception as exc:
+            module_result = dict(failed=True, msg='Unexpected error in {}: {}'.format(self.module_name, exc), exception=traceback.format_exc())
+
+        if module_result.get('failed'):
+            # the failed task may have changed the cached copy without saving it
+            CONTROLLER_CACHE.invalidate(self._task.args.get('database'))
+        return merge_hash(result, module_result)
+
+    def runs_on_controller(self, task_vars):
+        if ArgumentSpecValidator is None or not self.module.pykeepass_found:
+            return False
+        if not boolean(self._templar.template(task_vars.get('keepass_run_on_controller', True)), strict=False):
+            return False
+        if self._task.async_val or self._play_context.become:
+            return False
+        return self._connection.transport == 'local'